@@ -0,0 +1,9 @@
+"""Benchmarks for the expense tracker.
+
+Run from the repository root, for example::
+
+    python -m benchmarks.app --rows 10000 --requests 500 --concurrency 1,8
+
+See each module's docstring for its options. Nothing here is collected
+by pytest or installed with the package.
+"""
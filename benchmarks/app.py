@@ -0,0 +1,304 @@
+"""Load test the WSGI app: home, detail, search, totals, create and login.
+
+Seeds ``--rows`` fake expenses into a throwaway SQLite file, or the
+database given with ``--database-url`` (its tables are dropped and
+recreated, so never point it at real data; ``DATABASE_URL`` is ignored
+so that a shell set up for the app can't do that by accident), builds the app with ``expense_tracker.main`` and hits
+each scenario from 1..N threads at once. Requests go through WebTest in
+process by default, or over HTTP to a waitress server with
+``--server waitress``.
+
+p50/p95/p99 latency and requests per second are printed per scenario
+and concurrency level, then compared against the stored result in
+``--baseline`` (benchmarks/baseline.json by default); the run exits 1 if
+any p95 or req/s is more than ``--tolerance`` worse, or if any request
+failed. ``--save-baseline`` writes the current run there instead.
+Baselines only mean something on the machine that recorded them, with
+the same ``--rows``, ``--requests`` and ``--server``.
+
+The login user is taken from ``AUTH_USERNAME``/``AUTH_PASSWORD`` (the
+plain text password here; it is hashed before the app sees it) and
+defaults to bench/bench.
+"""
+import argparse
+import http.cookiejar
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from passlib.apps import custom_app_context
+from webtest import TestApp
+
+from benchmarks.common import (
+    TITLES,
+    compare,
+    load_baseline,
+    print_table,
+    save_baseline,
+    seed,
+    summarize,
+    temp_sqlite_url,
+)
+
+SCENARIOS = ('home', 'detail', 'search', 'totals', 'create', 'login')
+# what typeahead sends: the first few letters of a title
+SEARCHES = sorted({title[:length].lower() for title in TITLES for length in (1, 2, 3)})
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+CSRF_RE = re.compile(r'name="csrf_token" value="([^"]+)"')
+
+
+class WebTestClient(object):
+    """One simulated browser, calling the app in process."""
+
+    def __init__(self, app):
+        self.app = TestApp(app)
+        self.cookiejar = self.app.cookiejar
+
+    def get(self, path):
+        response = self.app.get(path, expect_errors=True)
+        return response.status_int, response.text
+
+    def post(self, path, params):
+        response = self.app.post(path, params, expect_errors=True)
+        return response.status_int, response.text
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HTTPClient(object):
+    """One simulated browser, talking to a real server."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.cookiejar = http.cookiejar.CookieJar()
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(self.cookiejar), _NoRedirect)
+
+    def _open(self, request):
+        try:
+            with self.opener.open(request) as response:
+                return response.status, response.read().decode('utf-8')
+        except urllib.error.HTTPError as err:
+            return err.code, err.read().decode('utf-8')
+
+    def get(self, path):
+        return self._open(self.base_url + path)
+
+    def post(self, path, params):
+        data = urllib.parse.urlencode(params).encode('ascii')
+        return self._open(urllib.request.Request(self.base_url + path, data=data))
+
+
+def forget(client, name):
+    for cookie in list(client.cookiejar):
+        if cookie.name == name:
+            client.cookiejar.clear(cookie.domain, cookie.path, cookie.name)
+
+
+def csrf_token(client, path):
+    status, body = client.get(path)
+    match = CSRF_RE.search(body)
+    if match is None:
+        raise RuntimeError('no csrf token on {} ({})'.format(path, status))
+    return match.group(1)
+
+
+def log_in(client, username, password):
+    token = csrf_token(client, '/login')
+    status, _ = client.post('/login', {
+        'csrf_token': token, 'username': username, 'password': password})
+    if status != 302:
+        raise RuntimeError('login failed with status {}'.format(status))
+
+
+def make_scenario(name, client, rows, username, password):
+    """Do any untimed setup for ``client`` and return (request, expected status)."""
+    if name == 'home':
+        return lambda: client.get('/'), 200
+    if name == 'detail':
+        return lambda: client.get('/expenses/{}'.format(random.randint(1, rows))), 200
+    if name == 'search':
+        return lambda: client.get('/api/expenses/search?q=' + random.choice(SEARCHES)), 200
+    if name == 'totals':
+        return lambda: client.get('/api/expenses/totals/monthly'), 200
+    if name == 'create':
+        log_in(client, username, password)
+        token = csrf_token(client, '/expenses/new-expense')
+        form = {'csrf_token': token, 'title': 'Bench', 'amount': '12.5',
+                'due_date': '2017-10-18'}
+        return lambda: client.post('/expenses/new-expense', form), 302
+    if name == 'login':
+        token = csrf_token(client, '/login')
+        form = {'csrf_token': token, 'username': username, 'password': password}
+
+        def request():
+            result = client.post('/login', form)
+            forget(client, 'auth_tkt')  # or the next post short-circuits
+            return result
+        return request, 302
+    raise ValueError('unknown scenario {!r}'.format(name))
+
+
+def run_scenario(name, make_client, concurrency, total, rows, username, password):
+    """Run ``total`` requests split over ``concurrency`` threads."""
+    per_thread = max(1, total // concurrency)
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    ready = threading.Barrier(concurrency + 1)
+
+    def worker():
+        try:
+            request, expected = make_scenario(
+                name, make_client(), rows, username, password)
+            request()  # warm up
+        except Exception as err:
+            with lock:
+                errors.append(repr(err))
+            ready.abort()
+            return
+        try:
+            ready.wait()
+        except threading.BrokenBarrierError:
+            return  # another worker failed its setup
+        own = []
+        for _ in range(per_thread):
+            start = time.perf_counter()
+            status, _ = request()
+            own.append(time.perf_counter() - start)
+            if status != expected:
+                with lock:
+                    errors.append('status {} != {}'.format(status, expected))
+        with lock:
+            latencies.extend(own)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    try:
+        ready.wait()
+    except threading.BrokenBarrierError:
+        pass
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    stats = summarize(latencies, time.perf_counter() - start)
+    stats['errors'] = len(errors)
+    if errors:
+        print('{} @ {}: {} errors, first: {}'.format(
+            name, concurrency, len(errors), errors[0]), file=sys.stderr)
+    return stats
+
+
+def serve(app, threads):
+    """Start waitress on a free port in a daemon thread; return its URL."""
+    from waitress.server import create_server
+    server = create_server(app, host='127.0.0.1', port=0, threads=threads)
+    threading.Thread(target=server.run, daemon=True).start()
+    return 'http://127.0.0.1:{}'.format(server.effective_port), server
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=10000,
+                        help='expenses to seed (default 10000)')
+    parser.add_argument('--requests', type=int, default=200,
+                        help='requests per scenario and concurrency level (default 200)')
+    parser.add_argument('--concurrency', default='1,4,16',
+                        help='comma separated thread counts (default 1,4,16)')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help='comma separated subset of ' + ', '.join(SCENARIOS))
+    parser.add_argument('--server', choices=('webtest', 'waitress'), default='webtest')
+    parser.add_argument('--database-url',
+                        help='database to drop, seed and test against '
+                             '(default a new SQLite file)')
+    parser.add_argument('--setting', action='append', default=[], metavar='KEY=VALUE',
+                        help='extra app setting, e.g. cache.backend=memory')
+    parser.add_argument('--baseline', default=BASELINE,
+                        help='baseline JSON to compare against (default %(default)s)')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='write this run to --baseline instead of comparing')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed slowdown as a fraction (default 0.25)')
+    args = parser.parse_args(argv)
+    args.concurrency = [int(level) for level in args.concurrency.split(',')]
+    args.scenarios = [name for name in args.scenarios.split(',') if name]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error('unknown scenarios: ' + ', '.join(sorted(unknown)))
+    return args
+
+
+def main(argv=sys.argv[1:]):
+    args = parse_args(argv)
+    os.environ['DATABASE_URL'] = args.database_url or temp_sqlite_url()
+    username = os.environ.setdefault('AUTH_USERNAME', 'bench')
+    password = os.environ.get('AUTH_PASSWORD', 'bench')
+    os.environ['AUTH_PASSWORD'] = custom_app_context.hash(password)
+
+    # login is slow on purpose and waitress queues by design here;
+    # don't log every instance of either
+    logging.getLogger('expense_tracker.profiling').setLevel(logging.ERROR)
+    logging.getLogger('waitress.queue').setLevel(logging.ERROR)
+
+    from expense_tracker import main as make_app
+    settings = dict(setting.split('=', 1) for setting in args.setting)
+    app = make_app({}, **settings)
+    seed(app.registry['db_engines']['primary'], args.rows)
+
+    server = None
+    if args.server == 'waitress':
+        base_url, server = serve(app, max(args.concurrency))
+
+        def make_client():
+            return HTTPClient(base_url)
+    else:
+        def make_client():
+            return WebTestClient(app)
+
+    results = {}
+    failed = False
+    try:
+        for name in args.scenarios:
+            for level in args.concurrency:
+                stats = run_scenario(name, make_client, level, args.requests,
+                                     args.rows, username, password)
+                results.setdefault(name, {})[str(level)] = stats
+                failed = failed or bool(stats['errors'])
+    finally:
+        if server is not None:
+            server.close()
+    print_table(results)
+
+    meta = {'rows': args.rows, 'requests': args.requests, 'server': args.server}
+    if args.save_baseline:
+        save_baseline(args.baseline, {'meta': meta, 'results': results})
+        print('saved baseline to', args.baseline)
+    else:
+        baseline = load_baseline(args.baseline)
+        if baseline is None:
+            print('no baseline at', args.baseline, file=sys.stderr)
+        else:
+            if baseline.get('meta') != meta:
+                print('warning: baseline was recorded with {}'.format(baseline.get('meta')),
+                      file=sys.stderr)
+            regressions = compare(results, baseline['results'], args.tolerance)
+            for regression in regressions:
+                print('REGRESSION', regression, file=sys.stderr)
+            failed = failed or bool(regressions)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
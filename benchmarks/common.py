@@ -0,0 +1,107 @@
+"""Helpers shared by the benchmark scripts: seeding, stats, baselines."""
+import json
+import os
+import random
+import tempfile
+from datetime import datetime
+
+from faker import Faker
+
+from expense_tracker.models import Expense
+from expense_tracker.models.meta import Base
+from expense_tracker.models.totals import rebuild_totals
+
+TITLES = ['Rent', 'Phone Bill', 'Food', 'Car', 'Internet', 'Gym', 'Insurance', 'Travel']
+
+
+def temp_sqlite_url():
+    fd, path = tempfile.mkstemp(prefix='expense-bench-', suffix='.db')
+    os.close(fd)
+    return 'sqlite:///' + path
+
+
+def seed(engine, rows, batch_size=5000, seed_value=1234):
+    """Recreate the tables and fill them with ``rows`` fake expenses."""
+    fake = Faker()
+    fake.seed_instance(seed_value)
+    rng = random.Random(seed_value)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    now = datetime.now()
+    with engine.begin() as connection:
+        for start in range(0, rows, batch_size):
+            connection.execute(Expense.__table__.insert(), [
+                {
+                    'title': rng.choice(TITLES) if rng.random() < 0.7 else fake.word().title(),
+                    'amount_cents': rng.randint(100, 200000),
+                    'due_date': fake.date_time_between(start_date='-2y', end_date='+1y'),
+                    'creation_date': now,
+                    'updated_at': now,
+                }
+                for _ in range(min(batch_size, rows - start))
+            ])
+        rebuild_totals(connection)
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, wall_time):
+    """p50/p95/p99 in milliseconds plus throughput for one run."""
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'rps': round(len(latencies) / wall_time, 1) if wall_time else 0.0,
+    }
+
+
+def load_baseline(path):
+    if not path or not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baseline(path, results):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def compare(results, baseline, tolerance):
+    """List the regressions of ``results`` against ``baseline``.
+
+    A run regresses when its p95 latency grows, or its throughput drops,
+    by more than ``tolerance`` (a fraction) compared to the baseline.
+    Keys missing from the baseline are skipped.
+    """
+    regressions = []
+    for name, runs in sorted(results.items()):
+        for level, current in sorted(runs.items()):
+            previous = baseline.get(name, {}).get(level)
+            if not previous:
+                continue
+            if 'p95_ms' in previous and current['p95_ms'] > previous['p95_ms'] * (1 + tolerance):
+                regressions.append('{} @ {}: p95 {}ms vs baseline {}ms'.format(
+                    name, level, current['p95_ms'], previous['p95_ms']))
+            if 'rps' in previous and current['rps'] < previous['rps'] * (1 - tolerance):
+                regressions.append('{} @ {}: {} rps vs baseline {} rps'.format(
+                    name, level, current['rps'], previous['rps']))
+    return regressions
+
+
+def print_table(results):
+    print('{:<12} {:>6} {:>9} {:>9} {:>9} {:>9}'.format(
+        'scenario', 'conc', 'p50 ms', 'p95 ms', 'p99 ms', 'req/s'))
+    for name, runs in sorted(results.items()):
+        for level, stats in sorted(runs.items(), key=lambda item: int(item[0])):
+            print('{:<12} {:>6} {:>9} {:>9} {:>9} {:>9}'.format(
+                name, level, stats['p50_ms'], stats['p95_ms'], stats['p99_ms'], stats['rps']))
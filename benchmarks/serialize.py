@@ -0,0 +1,129 @@
+"""Rows per second through a list page: loading, to_dict and JSON.
+
+Seeds ``--rows`` fake expenses into a throwaway SQLite file and times
+both ways of turning all of them into a JSON list:
+
+``before``
+    whole Expense objects through the ORM identity map, a ``to_dict``
+    that calls ``strftime`` twice per row, and Pyramid's stock JSON
+    renderer with registry adapters for datetimes and Decimals
+``after``
+    DICT_COLUMNS rows, ``expense_dict`` with the per-day date cache, and
+    the app's ``json`` renderer (orjson when installed)
+
+Each stage is the best of ``--repeat`` runs. Both paths must produce the
+same JSON document, or the run exits 1.
+"""
+import argparse
+import json
+import sys
+import time
+from datetime import datetime
+from decimal import Decimal
+
+from pyramid.renderers import JSON
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks.common import seed, temp_sqlite_url
+from expense_tracker.models import Expense
+from expense_tracker.models.mymodel import DICT_COLUMNS, expense_dict
+from expense_tracker.renderers import FastJSON, orjson
+
+
+def legacy_dict(expense):
+    """Expense.to_dict() as it was before the column path."""
+    return {
+        'id': expense.id,
+        'title': expense.title,
+        'amount': expense.amount,
+        'amount_cents': expense.amount_cents,
+        'currency': expense.currency,
+        'due_date': expense.due_date.strftime('%m/%d/%Y'),
+        'creation_date': expense.creation_date.strftime('%m/%d/%Y')
+    }
+
+
+def legacy_renderer():
+    renderer = JSON()
+    renderer.add_adapter(datetime, lambda obj, request: obj.isoformat())
+    renderer.add_adapter(Decimal, lambda obj, request: float(obj))
+    return renderer(None)
+
+
+def before(session, render):
+    load = lambda: session.query(Expense).order_by(Expense.due_date, Expense.id).all()
+    to_dicts = lambda rows: [legacy_dict(expense) for expense in rows]
+    encode = lambda dicts: render({'expenses': dicts}, {'request': None})
+    return load, to_dicts, encode
+
+
+def after(session, render):
+    load = lambda: session.query(*DICT_COLUMNS).order_by(Expense.due_date, Expense.id).all()
+    to_dicts = lambda rows: [expense_dict(*row) for row in rows]
+    encode = lambda dicts: render({'expenses': dicts}, {'request': None})
+    return load, to_dicts, encode
+
+
+def best_of(repeat, function, *args):
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def run(make_session, stages, render, repeat):
+    """Seconds per stage, best of ``repeat``, and the JSON produced."""
+    timings = {}
+    session = make_session()
+    load, to_dicts, encode = stages(session, render)
+    # a new session per load, or the identity map makes reloads cheap
+    timings['load'], rows = best_of(
+        repeat, lambda: (session.close(), load())[1])
+    timings['dicts'], dicts = best_of(repeat, to_dicts, rows)
+    timings['json'], body = best_of(repeat, encode, dicts)
+    session.close()
+    return timings, body
+
+
+def main(argv=sys.argv[1:]):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=50000,
+                        help='expenses to seed (default 50000)')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='runs per stage, the best counts (default 5)')
+    args = parser.parse_args(argv)
+
+    engine = create_engine(temp_sqlite_url())
+    seed(engine, args.rows)
+    make_session = sessionmaker(bind=engine)
+    legacy, fast = legacy_renderer(), FastJSON(None)
+
+    results = {}
+    for name, stages, render in (('before', before, legacy), ('after', after, fast)):
+        results[name] = run(make_session, stages, render, args.repeat)
+
+    print('{:<8} {:>12} {:>12} {:>12} {:>12}'.format(
+        '', 'load rows/s', 'dict rows/s', 'json rows/s', 'total rows/s'))
+    for name, (timings, _) in results.items():
+        rates = [args.rows / timings[stage] for stage in ('load', 'dicts', 'json')]
+        total = args.rows / sum(timings.values())
+        print('{:<8} {:>12,.0f} {:>12,.0f} {:>12,.0f} {:>12,.0f}'.format(name, *rates, total))
+    speedup = sum(results['before'][0].values()) / sum(results['after'][0].values())
+    print('\n{:.1f}x faster end to end ({} rows, json by {})'.format(
+        speedup, args.rows, 'orjson' if orjson else 'the json module'))
+
+    body_before, body_after = results['before'][1], results['after'][1]
+    if isinstance(body_before, str):
+        body_before = body_before.encode('utf-8')
+    if json.loads(body_before) != json.loads(body_after):
+        print('the two paths produced different JSON', file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
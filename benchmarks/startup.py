@@ -0,0 +1,127 @@
+"""Measure how long a fresh worker takes to build the app, and what it imports.
+
+Runs ``--runs`` new interpreters under ``python -X importtime``; each one
+imports expense_tracker and calls ``main()`` against a throwaway SQLite
+database. The report shows the median import and main() times and the
+packages that took the longest to import, measured by their own (self)
+import time.
+
+The run exits 1 when the median time to a ready app goes over
+``--budget-ms``, or when a module named in ``--forbid`` gets imported
+(by default test-only packages such as pytest and Faker), so CI can run
+it as a check. Budgets depend on the machine; set one with some room
+above what that machine measures.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+from benchmarks.common import temp_sqlite_url
+
+FORBIDDEN = ('pytest', 'faker', 'webtest', 'alembic', 'expense_tracker.tests',
+             'expense_tracker.conftest', 'expense_tracker.scripts')
+
+CHILD = '''
+import json, sys, time
+start = time.perf_counter()
+from expense_tracker import main
+imported = time.perf_counter()
+main({{}}, **{settings!r})
+ready = time.perf_counter()
+sys.stdout.write(json.dumps({{
+    'import_ms': (imported - start) * 1000,
+    'main_ms': (ready - imported) * 1000,
+    'ready_ms': (ready - start) * 1000,
+    'modules': sorted(sys.modules),
+}}))
+'''
+
+
+def parse_importtime(lines):
+    """Sum ``-X importtime`` self times (in ms) per top level package."""
+    totals = defaultdict(float)
+    for line in lines:
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        totals[name.strip().split('.')[0]] += int(self_us) / 1000
+    return totals
+
+
+def run_once(settings):
+    env = dict(os.environ)
+    # never the app's own database
+    env['DATABASE_URL'] = temp_sqlite_url()
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', CHILD.format(settings=settings)],
+        env=env, capture_output=True, text=True)
+    if proc.returncode:
+        raise RuntimeError('app failed to start:\n' + proc.stderr[-2000:])
+    return json.loads(proc.stdout), parse_importtime(proc.stderr.splitlines())
+
+
+def forbidden_modules(modules, forbid):
+    """The entries of ``forbid`` that were imported, themselves or a submodule."""
+    return [
+        prefix for prefix in forbid
+        if any(name == prefix or name.startswith(prefix + '.') for name in modules)
+    ]
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5,
+                        help='fresh interpreters to start (default 5)')
+    parser.add_argument('--budget-ms', type=float, default=None,
+                        help='fail if the median time to a ready app is over this')
+    parser.add_argument('--forbid', default=','.join(FORBIDDEN),
+                        help='comma separated modules that must not be imported '
+                             '(default %(default)s)')
+    parser.add_argument('--top', type=int, default=15,
+                        help='packages to list by import time (default 15)')
+    parser.add_argument('--setting', action='append', default=[], metavar='KEY=VALUE',
+                        help='extra app setting, e.g. warmup.enabled=true')
+    args = parser.parse_args(argv)
+    args.forbid = [name for name in args.forbid.split(',') if name]
+    return args
+
+
+def main(argv=sys.argv[1:]):
+    args = parse_args(argv)
+    settings = dict(setting.split('=', 1) for setting in args.setting)
+    runs, packages = [], defaultdict(list)
+    modules = set()
+    for _ in range(args.runs):
+        timings, totals = run_once(settings)
+        modules.update(timings.pop('modules'))
+        runs.append(timings)
+        for name, ms in totals.items():
+            packages[name].append(ms)
+
+    median = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+    print('{:<28} {:>9}'.format('package', 'self ms'))
+    ranked = sorted(packages.items(), key=lambda item: -statistics.median(item[1]))
+    for name, values in ranked[:args.top]:
+        print('{:<28} {:>9.1f}'.format(name, statistics.median(values)))
+    print()
+    print('import {import_ms:.1f}ms, main() {main_ms:.1f}ms, ready in {ready_ms:.1f}ms '
+          '(median of {runs})'.format(runs=len(runs), **median))
+
+    failed = False
+    forbidden = forbidden_modules(modules, args.forbid)
+    if forbidden:
+        print('FORBIDDEN imports: ' + ', '.join(forbidden), file=sys.stderr)
+        failed = True
+    if args.budget_ms is not None and median['ready_ms'] > args.budget_ms:
+        print('OVER BUDGET: ready in {:.1f}ms, budget {:.1f}ms'.format(
+            median['ready_ms'], args.budget_ms), file=sys.stderr)
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
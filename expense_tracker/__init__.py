@@ -1,15 +1,31 @@
 from pyramid.config import Configurator
+from pyramid.settings import asbool
+from expense_tracker.models import settings_from_environ
+from expense_tracker.warmup import warm_up
 import os
+import time
 
 
 def main(global_config, **settings):
     """ This function returns a Pyramid WSGI application.
     """
+    started = time.perf_counter()
     settings['sqlalchemy.url'] = os.environ['DATABASE_URL']
+    settings_from_environ(settings)
     config = Configurator(settings=settings)
     config.include('pyramid_jinja2')
+    config.include('.warmup')
     config.include('.models')
+    config.include('.profiling')
+    config.include('.cache')
+    config.include('.renderers')
+    config.include('.search')
+    if asbool(settings.get('snapshot.enabled')):
+        # needs NumPy, from the analytics extra
+        config.include('.snapshot')
+    if asbool(settings.get('group_commit.enabled')):
+        config.include('.group_commit')
     config.include('.routes')
     config.include('.security')
-    config.scan()
-    return config.make_wsgi_app()
+    config.scan('.views')
+    return warm_up(config.make_wsgi_app(), started)
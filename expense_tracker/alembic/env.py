@@ -0,0 +1,79 @@
+"""Pyramid bootstrap environment. """
+import os
+
+from alembic import context
+from pyramid.paster import get_appsettings, setup_logging
+
+from expense_tracker.models import get_engine
+from expense_tracker.models.meta import Base
+
+config = context.config
+
+setup_logging(config.config_file_name)
+
+settings = get_appsettings(config.config_file_name)
+# Point to your environment's database URL, same as the app does
+if 'DATABASE_URL' in os.environ:
+    settings['sqlalchemy.url'] = os.environ['DATABASE_URL']
+# the app's statement timeout would cut long index builds short
+settings.pop('sqlalchemy.statement_timeout', None)
+target_metadata = Base.metadata
+
+# indexes that only exist on PostgreSQL and are managed by hand in the
+# migrations (or by partition_expenses), so autogenerate should not try
+# to drop them
+POSTGRESQL_ONLY = {'ix_models_title_trgm', 'ix_models_title_tsv', 'ix_models_id'}
+
+
+def include_object(obj, name, type_, reflected, compare_to):
+    return not (type_ == 'index' and name in POSTGRESQL_ONLY)
+
+
+def run_migrations_offline():
+    """Run migrations in 'offline' mode.
+
+    This configures the context with just a URL
+    and not an Engine, though an Engine is acceptable
+    here as well.  By skipping the Engine creation
+    we don't even need a DBAPI to be available.
+
+    Calls to context.execute() here emit the given string to the
+    script output.
+
+    """
+    context.configure(
+        url=settings['sqlalchemy.url'],
+        target_metadata=target_metadata,
+        include_object=include_object,
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    """Run migrations in 'online' mode.
+
+    In this scenario we need to create an Engine
+    and associate a connection with the context.
+
+    """
+    engine = get_engine(settings)
+
+    connection = engine.connect()
+    context.configure(
+        connection=connection,
+        target_metadata=target_metadata,
+        include_object=include_object,
+    )
+
+    try:
+        with context.begin_transaction():
+            context.run_migrations()
+    finally:
+        connection.close()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
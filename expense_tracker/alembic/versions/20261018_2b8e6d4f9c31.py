@@ -0,0 +1,52 @@
+"""jobs: the queue run_jobs workers take slow work from
+
+Revision ID: 2b8e6d4f9c31
+Revises: 7c2e5f8a4d16
+Create Date: 2026-10-18 20:41:09.264815
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2b8e6d4f9c31'
+down_revision = '7c2e5f8a4d16'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'jobs',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('kind', sa.Unicode(length=40), nullable=False),
+        sa.Column('owner_id', sa.Integer(), nullable=True),
+        sa.Column('state', sa.Unicode(length=10), server_default='queued', nullable=False),
+        sa.Column('params', sa.Text(), nullable=True),
+        sa.Column('payload', sa.LargeBinary(), nullable=True),
+        sa.Column('progress', sa.Text(), nullable=True),
+        sa.Column('result', sa.Text(), nullable=True),
+        sa.Column('output', sa.LargeBinary(), nullable=True),
+        sa.Column('output_type', sa.Unicode(length=100), nullable=True),
+        sa.Column('error', sa.Unicode(), nullable=True),
+        sa.Column('attempts', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('max_attempts', sa.Integer(), server_default='3', nullable=False),
+        sa.Column('run_after', sa.DateTime(), nullable=True),
+        sa.Column('locked_by', sa.Unicode(length=100), nullable=True),
+        sa.Column('heartbeat_at', sa.DateTime(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('started_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(
+            ['owner_id'], ['users.id'], name=op.f('fk_jobs_owner_id_users')),
+        sa.PrimaryKeyConstraint('id', name=op.f('pk_jobs'))
+    )
+    op.create_index(op.f('ix_jobs_owner_id'), 'jobs', ['owner_id'])
+    op.create_index('ix_jobs_state_run_after', 'jobs', ['state', 'run_after'])
+
+
+def downgrade():
+    op.drop_index('ix_jobs_state_run_after', table_name='jobs')
+    op.drop_index(op.f('ix_jobs_owner_id'), table_name='jobs')
+    op.drop_table('jobs')
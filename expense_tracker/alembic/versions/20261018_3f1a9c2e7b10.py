@@ -0,0 +1,36 @@
+"""create the models table
+
+Revision ID: 3f1a9c2e7b10
+Revises:
+Create Date: 2026-10-18 09:12:44.118203
+
+Databases that were built with ``initdb`` before migrations existed
+already have this table; mark them with ``alembic stamp 3f1a9c2e7b10``
+and then upgrade as usual.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1a9c2e7b10'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'models',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('title', sa.Unicode(), nullable=True),
+        sa.Column('amount', sa.Float(precision=2), nullable=True),
+        sa.Column('due_date', sa.DateTime(), nullable=True),
+        sa.Column('creation_date', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id', name=op.f('pk_models'))
+    )
+
+
+def downgrade():
+    op.drop_table('models')
@@ -0,0 +1,27 @@
+"""index each user's newest change, for conditional GETs
+
+Revision ID: 4a7d2c9e1f58
+Revises: 2b8e6d4f9c31
+Create Date: 2026-10-18 22:12:44.318207
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4a7d2c9e1f58'
+down_revision = '2b8e6d4f9c31'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_models_owner_id_updated_at', 'models', ['owner_id', 'updated_at'])
+    op.create_index('ix_expense_totals_owner_id_updated_at', 'expense_totals',
+                    ['owner_id', 'updated_at'])
+
+
+def downgrade():
+    op.drop_index('ix_expense_totals_owner_id_updated_at', table_name='expense_totals')
+    op.drop_index('ix_models_owner_id_updated_at', table_name='models')
@@ -0,0 +1,46 @@
+"""store amounts as integer cents plus a currency code
+
+Revision ID: 5e2a91d0c7f3
+Revises: bceb88682114
+Create Date: 2026-10-18 16:05:41.207318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e2a91d0c7f3'
+down_revision = 'bceb88682114'
+branch_labels = None
+depends_on = None
+
+models = sa.table(
+    'models',
+    sa.column('amount', sa.Float),
+    sa.column('amount_cents', sa.BigInteger),
+)
+
+
+def upgrade():
+    with op.batch_alter_table('models') as batch_op:
+        batch_op.add_column(sa.Column('amount_cents', sa.BigInteger(), nullable=True))
+        # everything so far was entered in pounds
+        batch_op.add_column(sa.Column(
+            'currency', sa.Unicode(length=3), nullable=False, server_default='GBP'))
+    op.execute(models.update().values(
+        amount_cents=sa.cast(sa.func.round(models.c.amount * 100), sa.BigInteger)))
+    with op.batch_alter_table('models') as batch_op:
+        batch_op.drop_column('amount')
+    op.create_index(
+        'ix_models_owner_id_amount_cents', 'models', ['owner_id', 'amount_cents', 'id'])
+
+
+def downgrade():
+    op.drop_index('ix_models_owner_id_amount_cents', table_name='models')
+    with op.batch_alter_table('models') as batch_op:
+        batch_op.add_column(sa.Column('amount', sa.Float(precision=2), nullable=True))
+    op.execute(models.update().values(amount=models.c.amount_cents / 100.0))
+    with op.batch_alter_table('models') as batch_op:
+        batch_op.drop_column('currency')
+        batch_op.drop_column('amount_cents')
@@ -0,0 +1,40 @@
+"""job_chunks: job files kept in pieces instead of whole columns
+
+Revision ID: 6c1e8f3a5d27
+Revises: 4a7d2c9e1f58
+Create Date: 2026-10-18 23:40:12.581034
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6c1e8f3a5d27'
+down_revision = '4a7d2c9e1f58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'job_chunks',
+        sa.Column('job_id', sa.Integer(), nullable=False),
+        sa.Column('part', sa.Unicode(length=10), nullable=False),
+        sa.Column('seq', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('data', sa.LargeBinary(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ['job_id'], ['jobs.id'], name=op.f('fk_job_chunks_job_id_jobs')),
+        sa.PrimaryKeyConstraint('job_id', 'part', 'seq', name=op.f('pk_job_chunks'))
+    )
+    # files of jobs queued or finished before this are dropped with them
+    with op.batch_alter_table('jobs') as batch_op:
+        batch_op.drop_column('payload')
+        batch_op.drop_column('output')
+
+
+def downgrade():
+    with op.batch_alter_table('jobs') as batch_op:
+        batch_op.add_column(sa.Column('output', sa.LargeBinary(), nullable=True))
+        batch_op.add_column(sa.Column('payload', sa.LargeBinary(), nullable=True))
+    op.drop_table('job_chunks')
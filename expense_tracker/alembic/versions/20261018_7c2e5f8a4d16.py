@@ -0,0 +1,59 @@
+"""expense_totals: counts and totals per owner, currency, month and title
+
+Revision ID: 7c2e5f8a4d16
+Revises: e4f1a6c3b258
+Create Date: 2026-10-18 19:02:17.530861
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c2e5f8a4d16'
+down_revision = 'e4f1a6c3b258'
+branch_labels = None
+depends_on = None
+
+models = sa.table(
+    'models',
+    sa.column('owner_id', sa.Integer),
+    sa.column('currency', sa.Unicode),
+    sa.column('due_date', sa.DateTime),
+    sa.column('title', sa.Unicode),
+    sa.column('amount_cents', sa.BigInteger),
+    sa.column('updated_at', sa.DateTime),
+)
+
+
+def upgrade():
+    totals = op.create_table(
+        'expense_totals',
+        sa.Column('owner_id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('currency', sa.Unicode(length=3), nullable=False),
+        sa.Column('month', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('title', sa.Unicode(), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.Column('amount_cents', sa.BigInteger(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint(
+            'owner_id', 'currency', 'month', 'title', name=op.f('pk_expense_totals'))
+    )
+    # backfill; the same buckets as expense_tracker.models.totals.bucket
+    owner = sa.func.coalesce(models.c.owner_id, 0)
+    month = sa.func.coalesce(sa.cast(
+        sa.extract('year', models.c.due_date) * 100 + sa.extract('month', models.c.due_date),
+        sa.Integer), 0)
+    title = sa.func.coalesce(models.c.title, '')
+    op.execute(totals.insert().from_select(
+        ['owner_id', 'currency', 'month', 'title', 'count', 'amount_cents', 'updated_at'],
+        sa.select([
+            owner, models.c.currency, month, title,
+            sa.func.count(), sa.func.coalesce(sa.func.sum(models.c.amount_cents), 0),
+            sa.func.max(models.c.updated_at),
+        ]).group_by(owner, models.c.currency, month, title)
+    ))
+
+
+def downgrade():
+    op.drop_table('expense_totals')
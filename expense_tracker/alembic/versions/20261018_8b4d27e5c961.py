@@ -0,0 +1,41 @@
+"""index the models table for filtering, sorting and pagination
+
+Revision ID: 8b4d27e5c961
+Revises: 3f1a9c2e7b10
+Create Date: 2026-10-18 09:40:02.573816
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b4d27e5c961'
+down_revision = '3f1a9c2e7b10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(op.f('ix_models_creation_date'), 'models', ['creation_date'])
+    op.create_index('ix_models_due_date_id', 'models', ['due_date', 'id'])
+    op.create_index(
+        'ix_models_title_prefix', 'models', ['title'],
+        postgresql_ops={'title': 'text_pattern_ops'}
+    )
+    if op.get_bind().dialect.name == 'postgresql':
+        # substring / similarity matches on title
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        op.create_index(
+            'ix_models_title_trgm', 'models', ['title'],
+            postgresql_using='gin',
+            postgresql_ops={'title': 'gin_trgm_ops'}
+        )
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.drop_index('ix_models_title_trgm', table_name='models')
+    op.drop_index('ix_models_title_prefix', table_name='models')
+    op.drop_index('ix_models_due_date_id', table_name='models')
+    op.drop_index(op.f('ix_models_creation_date'), table_name='models')
@@ -0,0 +1,31 @@
+"""full text index on expense titles
+
+Revision ID: 9d3c5b7e1a20
+Revises: 5e2a91d0c7f3
+Create Date: 2026-10-18 17:31:12.660492
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d3c5b7e1a20'
+down_revision = '5e2a91d0c7f3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # elsewhere search keeps an index in memory (expense_tracker.search);
+    # the expression must stay the same as search.TITLE_VECTOR
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute(
+            "CREATE INDEX ix_models_title_tsv ON models"
+            " USING gin (to_tsvector('simple'::regconfig, coalesce(title, '')))"
+        )
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.drop_index('ix_models_title_tsv', table_name='models')
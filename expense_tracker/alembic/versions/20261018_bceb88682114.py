@@ -0,0 +1,44 @@
+"""users, and an owner for each expense
+
+Revision ID: bceb88682114
+Revises: c52e0b9a1d44
+Create Date: 2026-10-18 14:22:09.518203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'bceb88682114'
+down_revision = 'c52e0b9a1d44'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'users',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('username', sa.Unicode(length=255), nullable=False),
+        sa.Column('password_hash', sa.Unicode(length=255), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id', name=op.f('pk_users')),
+        sa.UniqueConstraint('username', name=op.f('uq_users_username'))
+    )
+    # existing rows stay unowned (visible to everyone) until claimed
+    # with `add_user <ini> <name> --claim`
+    with op.batch_alter_table('models') as batch_op:
+        batch_op.add_column(sa.Column('owner_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key(
+            op.f('fk_models_owner_id_users'), 'users', ['owner_id'], ['id'])
+    op.create_index(
+        'ix_models_owner_id_due_date', 'models', ['owner_id', 'due_date', 'id'])
+
+
+def downgrade():
+    op.drop_index('ix_models_owner_id_due_date', table_name='models')
+    with op.batch_alter_table('models') as batch_op:
+        batch_op.drop_constraint(op.f('fk_models_owner_id_users'), type_='foreignkey')
+        batch_op.drop_column('owner_id')
+    op.drop_table('users')
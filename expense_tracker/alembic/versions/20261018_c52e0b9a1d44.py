@@ -0,0 +1,28 @@
+"""track when each expense was last modified
+
+Revision ID: c52e0b9a1d44
+Revises: 8b4d27e5c961
+Create Date: 2026-10-18 11:05:37.902114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c52e0b9a1d44'
+down_revision = '8b4d27e5c961'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('models', sa.Column('updated_at', sa.DateTime(), nullable=True))
+    # creation_date is the best guess we have for rows that predate this
+    op.execute('UPDATE models SET updated_at = creation_date')
+    op.create_index(op.f('ix_models_updated_at'), 'models', ['updated_at'])
+
+
+def downgrade():
+    op.drop_index(op.f('ix_models_updated_at'), table_name='models')
+    op.drop_column('models', 'updated_at')
@@ -0,0 +1,60 @@
+"""recurrence rules, and a link from each occurrence to its rule
+
+Revision ID: e4f1a6c3b258
+Revises: 9d3c5b7e1a20
+Create Date: 2026-10-18 18:12:45.118240
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4f1a6c3b258'
+down_revision = '9d3c5b7e1a20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'recurrence_rules',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('owner_id', sa.Integer(), nullable=True),
+        sa.Column('title', sa.Unicode(), nullable=False),
+        sa.Column('amount_cents', sa.BigInteger(), nullable=False),
+        sa.Column('currency', sa.Unicode(length=3), server_default='GBP', nullable=False),
+        sa.Column('frequency', sa.Unicode(length=10), nullable=False),
+        sa.Column('interval', sa.Integer(), server_default='1', nullable=False),
+        sa.Column('starts_on', sa.DateTime(), nullable=False),
+        sa.Column('ends_on', sa.DateTime(), nullable=True),
+        sa.Column('materialized_through', sa.DateTime(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(
+            ['owner_id'], ['users.id'], name=op.f('fk_recurrence_rules_owner_id_users')),
+        sa.PrimaryKeyConstraint('id', name=op.f('pk_recurrence_rules'))
+    )
+    op.create_index(
+        op.f('ix_recurrence_rules_owner_id'), 'recurrence_rules', ['owner_id'])
+    op.create_index(
+        op.f('ix_recurrence_rules_materialized_through'), 'recurrence_rules',
+        ['materialized_through'])
+    with op.batch_alter_table('models') as batch_op:
+        batch_op.add_column(sa.Column('rule_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key(
+            op.f('fk_models_rule_id_recurrence_rules'), 'recurrence_rules',
+            ['rule_id'], ['id'])
+    op.create_index('ix_models_rule_id_due_date', 'models', ['rule_id', 'due_date'])
+
+
+def downgrade():
+    op.drop_index('ix_models_rule_id_due_date', table_name='models')
+    with op.batch_alter_table('models') as batch_op:
+        batch_op.drop_constraint(
+            op.f('fk_models_rule_id_recurrence_rules'), type_='foreignkey')
+        batch_op.drop_column('rule_id')
+    op.drop_index(
+        op.f('ix_recurrence_rules_materialized_through'), table_name='recurrence_rules')
+    op.drop_index(op.f('ix_recurrence_rules_owner_id'), table_name='recurrence_rules')
+    op.drop_table('recurrence_rules')
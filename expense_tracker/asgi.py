@@ -0,0 +1,321 @@
+"""ASGI entry point, for many concurrent slow clients.
+
+The read paths (``home``, ``detail``, ``api_list`` and ``api_detail``)
+are answered on the event loop with an async SQLAlchemy session, so a
+connection waiting on the database or on a slow client costs a
+coroutine instead of a thread. Every other request, and any read that
+ends in an error, goes to the regular Pyramid WSGI app on a bounded
+thread pool, so routes, security, CSRF and error pages all stay the
+ones the WSGI app defines. The async handlers look routes up in that
+app's mapper, authenticate with its policy and check the same per-expense
+ACLs; the logged in user is loaded asynchronously up front so none of
+that blocks the loop.
+
+Needs the ``asgi`` extra (SQLAlchemy 1.4+, asgiref, uvicorn and an async
+driver). ``serve_expenses`` runs it when ``asgi.enabled`` is true.
+
+Settings (all optional):
+
+``asgi.sqlalchemy_url``   async database url, default ``sqlalchemy.url``
+                          (or the replica's) with its async driver
+``asgi.wsgi_threads``     threads for requests handed to WSGI, default 16
+"""
+import asyncio
+import io
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.wsgi import WsgiToAsgi
+from pyramid.httpexceptions import HTTPException, HTTPNotFound, HTTPNotModified
+from pyramid.interfaces import IRoutesMapper
+from pyramid.renderers import render_to_response
+from pyramid.request import Request, apply_request_extensions
+from pyramid.settings import asbool
+from sqlalchemy import select
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_engine_from_config
+from sqlalchemy.orm import sessionmaker
+
+from expense_tracker import main as wsgi_main
+from expense_tracker.cache import expense_key, get_cache, list_key
+from expense_tracker.conditional import (
+    is_fresh, make_etag, set_validators, table_version_query, versions)
+from expense_tracker.filters import FIELDS, expense_filters, parse_fields, parse_sort
+from expense_tracker.models import Expense, User, replica_settings
+from expense_tracker.models.mymodel import DICT_COLUMNS
+from expense_tracker.pagination import decode_cursor, parse_limit, seek
+from expense_tracker.security import current_owner_id, expense_acl, owner_filter
+from expense_tracker.views.api import projection, rows_page
+from expense_tracker.views.default import expense_page
+
+ASYNC_DRIVERS = {
+    'postgres': 'postgresql+asyncpg',
+    'postgresql': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+}
+
+
+def async_url(url):
+    """The same database url with an asyncio driver."""
+    url = make_url(url)
+    if url.get_backend_name() not in ASYNC_DRIVERS:
+        raise ValueError('no async driver known for {!r}'.format(url.drivername))
+    return str(url.set(drivername=ASYNC_DRIVERS[url.get_backend_name()]))
+
+
+def get_async_engine(settings, prefix='sqlalchemy.'):
+    """Build an AsyncEngine from the ``<prefix>*`` settings.
+
+    Pool settings are honoured as in ``models.get_engine``; the
+    statement timeout is passed the way asyncpg expects it.
+    """
+    settings = {key: value for key, value in settings.items() if key.startswith(prefix)}
+    statement_timeout = settings.pop(prefix + 'statement_timeout', None)
+    if prefix + 'pool_pre_ping' in settings:
+        settings[prefix + 'pool_pre_ping'] = asbool(settings[prefix + 'pool_pre_ping'])
+    kwargs = {}
+    if statement_timeout and make_url(settings[prefix + 'url']).get_backend_name() == 'postgresql':
+        kwargs['connect_args'] = {
+            'server_settings': {'statement_timeout': str(int(statement_timeout))}
+        }
+    return async_engine_from_config(settings, prefix, **kwargs)
+
+
+def scope_environ(scope):
+    """A WSGI environ for a bodiless ASGI http request."""
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+        'wsgi.version': (1, 0),
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        value = value.decode('latin-1')
+        if name in environ:
+            value = environ[name] + ('; ' if name == 'HTTP_COOKIE' else ',') + value
+        environ[name] = value
+    return environ
+
+
+class ExpenseContext(object):
+    """Stands in for security.ExpenseResource, which queries synchronously."""
+
+    def __init__(self, acl):
+        self.__acl__ = acl
+
+
+async def load_user(request, session):
+    username = request.unauthenticated_userid
+    if username is None:
+        return None
+    result = await session.execute(select(User).where(User.username == username))
+    return result.scalars().first()
+
+
+async def expense_context(request, session):
+    result = await session.execute(
+        select([Expense.owner_id]).where(Expense.id == int(request.matchdict['id'])))
+    row = result.first()
+    return ExpenseContext(expense_acl(row is not None, row[0] if row else None))
+
+
+async def table_version(request, session):
+    result = await session.execute(table_version_query(current_owner_id(request)))
+    return versions(*result.one())
+
+
+async def expense_version(request, session):
+    expense_id = int(request.matchdict['id'])
+    last_modified = await session.scalar(
+        select([Expense.updated_at]).where(Expense.id == expense_id))
+    if last_modified is None:
+        return None, None
+    return last_modified, '{}/{}'.format(expense_id, last_modified)
+
+
+async def list_expenses(request, session):
+    """Async twin of ``views.default.list_expenses`` (without ``stream``)."""
+    limit = parse_limit(request.GET.get('limit'))
+    after = decode_cursor(request.GET.get('after'), Expense.due_date)
+    cache = get_cache(request)
+    key = list_key(cache, current_owner_id(request), limit, request.GET.get('after', ''))
+    page = cache.get(key)
+    if page is None:
+        statement = seek(select(*DICT_COLUMNS).where(owner_filter(request)),
+                         Expense.due_date, Expense.id, after)
+        result = await session.execute(statement.limit(limit + 1))
+        page = expense_page(result.all(), limit)
+        cache.set(key, page)
+    return {
+        "title": "Expense List",
+        "expenses": page['expenses'],
+        "limit": limit,
+        "next_cursor": page['next_cursor'],
+        "cache_key": key
+    }
+
+
+async def expense_detail(request, session):
+    """Async twin of ``views.default.expense_detail``."""
+    expense_id = int(request.matchdict['id'])
+    cache = get_cache(request)
+    key = expense_key(expense_id)
+    expense = cache.get(key)
+    if expense is None:
+        expense = await session.get(Expense, expense_id)
+        if not expense:
+            raise HTTPNotFound
+        expense = expense.to_dict()
+        cache.set(key, expense)
+    return {
+        'title': 'One Expense',
+        'expense': expense,
+        'cache_key': key
+    }
+
+
+async def api_list(request, session):
+    """Async twin of ``views.api.api_list``."""
+    criteria = expense_filters(request.GET)
+    sort_column, descending = parse_sort(request.GET.get('sort'))
+    fields = parse_fields(request.GET.get('fields'))
+    limit = parse_limit(request.GET.get('limit'))
+    after = decode_cursor(request.GET.get('after'), sort_column)
+    statement = select(*projection(fields, sort_column)).filter(
+        owner_filter(request), *criteria)
+    statement = seek(statement, sort_column, Expense.id, after, descending)
+    result = await session.execute(statement.limit(limit + 1))
+    return rows_page(result.all(), fields, sort_column, limit)
+
+
+async def api_detail(request, session):
+    """Async twin of ``views.api.api_detail``."""
+    fields = parse_fields(request.GET.get('fields'))
+    expense_id = int(request.matchdict['id'])
+    result = await session.execute(
+        select(*[FIELDS[name] for name in fields]).where(Expense.id == expense_id))
+    row = result.first()
+    if row is None:
+        raise HTTPNotFound
+    return {
+        'expense': {name: getattr(row, name) for name in fields}
+    }
+
+
+# routes whose views need the 'view' permission on their expense
+EXPENSE_ROUTES = ('detail', 'api_detail')
+
+# route name: (handler, renderer, version for conditional GETs)
+ASYNC_ROUTES = {
+    'home': (list_expenses, 'expense_tracker:templates/index.jinja2', table_version),
+    'detail': (expense_detail, 'expense_tracker:templates/detail.jinja2', expense_version),
+    'api_list': (api_list, 'json', table_version),
+    'api_detail': (api_detail, 'json', expense_version),
+}
+
+
+class AsyncApp(object):
+    """ASGI app serving ASYNC_ROUTES itself and the rest through WSGI."""
+
+    def __init__(self, wsgi_app, engine, threads=16):
+        self.registry = wsgi_app.registry
+        self.mapper = self.registry.getUtility(IRoutesMapper)
+        self.engine = engine
+        self.session_factory = sessionmaker(
+            engine, class_=AsyncSession, expire_on_commit=False)
+        self.threads = threads
+        self.wsgi = WsgiToAsgi(wsgi_app)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] == 'http' and scope['method'] in ('GET', 'HEAD'):
+            response = await self.handle(scope)
+            if response is not None:
+                return await self.send_response(response, send, scope['method'] == 'HEAD')
+        return await self.wsgi(scope, receive, send)
+
+    async def handle(self, scope):
+        """Answer a GET on the event loop, or return None to defer to WSGI."""
+        request = Request(scope_environ(scope))
+        request.registry = self.registry
+        info = self.mapper(request)
+        route = info['route']
+        if route is None or route.name not in ASYNC_ROUTES or 'stream' in request.GET:
+            return None
+        request.matchdict = info['match']
+        request.matched_route = route
+        apply_request_extensions(request)
+        handler, renderer, version = ASYNC_ROUTES[route.name]
+        try:
+            async with self.session_factory() as session:
+                # reify's cache, so principals_for won't query synchronously
+                request.user = await load_user(request, session)
+                if route.name in EXPENSE_ROUTES:
+                    context = await expense_context(request, session)
+                    if not request.has_permission('view', context):
+                        return None  # the WSGI app answers 403
+                last_modified, token = await version(request, session)
+                etag = make_etag(request, token) if token is not None else None
+                if etag is not None and is_fresh(request, etag, last_modified):
+                    response = HTTPNotModified()
+                else:
+                    value = await handler(request, session)
+                    response = render_to_response(renderer, value, request=request)
+        except (HTTPException, ValueError):
+            return None  # 400s and 404s look exactly like the WSGI app's
+        if etag is not None:
+            set_validators(response, etag, last_modified)
+        return response
+
+    async def send_response(self, response, send, head=False):
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_int,
+            'headers': [
+                (name.lower().encode('latin-1'), value.encode('latin-1'))
+                for name, value in response.headerlist
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': b'' if head else response.body})
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                # WsgiToAsgi runs requests on the loop's default executor
+                asyncio.get_running_loop().set_default_executor(
+                    ThreadPoolExecutor(self.threads, thread_name_prefix='wsgi'))
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.engine.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+def main(global_config, **settings):
+    """Build the ASGI app from the same settings as ``expense_tracker.main``."""
+    wsgi_app = wsgi_main(global_config, **settings)
+    settings = wsgi_app.registry.settings
+    engine_settings = replica_settings(settings) or dict(settings)
+    engine_settings['sqlalchemy.url'] = settings.get('asgi.sqlalchemy_url') or \
+        async_url(engine_settings['sqlalchemy.url'])
+    engine = get_async_engine(engine_settings)
+    wsgi_app.registry['db_engines']['async'] = engine.sync_engine
+    return AsyncApp(wsgi_app, engine, int(settings.get('asgi.wsgi_threads', 16)))
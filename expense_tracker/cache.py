@@ -0,0 +1,291 @@
+"""Read-through cache for expense payloads and rendered page fragments.
+
+The ``cache.backend`` setting picks where entries live:
+
+``memory``
+    an in-process LRU with a per-entry TTL
+``dbm``
+    a local key-value file (``cache.path``) that outlives restarts;
+    entries only leave it when their TTL runs out. dbm files can't be
+    written by several processes at once, so only one process may open
+    a given path: give each worker its own, or use ``memory``
+``none``
+    caching switched off (the default)
+
+Caching is opt-in because entries are filled from whatever session a
+view reads with. With a read replica, a page read just after a write
+can come from a replica that hasn't caught up; the commit's
+invalidation has already run by then, so the stale row would be cached
+until its TTL runs out. Only turn the cache on without a replica, or
+with a ``cache.ttl`` you can live with as extra lag.
+
+Views cache ``to_dict()`` payloads per expense and per list page, and
+templates cache rendered HTML with ``{% cache key %}...{% endcache %}``.
+Writes invalidate through SQLAlchemy session events once the transaction
+commits: the changed expenses' keys are deleted and every list page is
+retired at once by bumping a generation number that is part of its key.
+"""
+import dbm
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from itertools import chain
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+from sqlalchemy import event
+
+from expense_tracker.models import Expense
+
+GENERATION_KEY = '__list_generation__'
+
+
+class CacheStats(object):
+    """Hit, miss and eviction counters for one cache."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def to_dict(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+
+
+class NullCache(object):
+    """Cache that never holds anything, for when caching is switched off."""
+
+    def __init__(self):
+        self.stats = CacheStats()
+
+    def get(self, key):
+        self.stats.misses += 1
+
+    def set(self, key, value):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def generation(self):
+        return 0
+
+    def bump_generation(self):
+        pass
+
+
+class MemoryCache(object):
+    """Thread-safe in-process LRU whose entries also expire after ``ttl``."""
+
+    def __init__(self, max_entries=1000, ttl=300, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self.stats = CacheStats()
+        self._data = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and item[1] <= self.clock():
+                del self._data[key]
+                self.stats.evictions += 1
+                item = None
+            if item is None:
+                self.stats.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.stats.hits += 1
+            return item[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, self.clock() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.stats.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def generation(self):
+        return self._generation
+
+    def bump_generation(self):
+        with self._lock:
+            self._generation += 1
+
+
+class DBMCache(object):
+    """Cache kept in a local dbm file, values pickled with their expiry.
+
+    The lock only covers this process's threads; the file must not be
+    open in any other process.
+    """
+
+    def __init__(self, path, ttl=300, clock=time.time):
+        self.ttl = ttl
+        self.clock = clock
+        self.stats = CacheStats()
+        self._db = dbm.open(path, 'c')
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            raw = self._db.get(key.encode('utf-8'))
+            if raw is not None:
+                value, expires = pickle.loads(raw)
+                if expires <= self.clock():
+                    del self._db[key.encode('utf-8')]
+                    self.stats.evictions += 1
+                    raw = None
+            if raw is None:
+                self.stats.misses += 1
+                return None
+            self.stats.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._db[key.encode('utf-8')] = pickle.dumps((value, self.clock() + self.ttl))
+
+    def delete(self, key):
+        with self._lock:
+            try:
+                del self._db[key.encode('utf-8')]
+            except KeyError:
+                pass
+
+    def generation(self):
+        with self._lock:
+            return int(self._db.get(GENERATION_KEY.encode('utf-8'), b'0'))
+
+    def bump_generation(self):
+        with self._lock:
+            key = GENERATION_KEY.encode('utf-8')
+            self._db[key] = str(int(self._db.get(key, b'0')) + 1).encode('ascii')
+
+
+NULL_CACHE = NullCache()
+
+
+def get_cache(request):
+    """The configured cache, or one that never hits if there is none."""
+    return request.registry.get('cache', NULL_CACHE)
+
+
+def expense_key(expense_id):
+    return 'expense:{}'.format(expense_id)
+
+
+def list_key(cache, *parts):
+    return 'list:{}:{}'.format(cache.generation(), ':'.join(str(p) for p in parts))
+
+
+def fragment_key(key):
+    return 'fragment:' + key
+
+
+def mark_lists_stale(session):
+    """Retire cached list pages when the session commits.
+
+    For writes that bypass the ORM (Core inserts, bulk statements), which
+    the flush hook below cannot see.
+    """
+    session.info['cache_lists_stale'] = True
+
+
+def mark_expenses_stale(session, expense_ids):
+    """Drop the given expenses' cache entries when the session commits."""
+    session.info.setdefault('cache_expense_ids', set()).update(expense_ids)
+    mark_lists_stale(session)
+
+
+def track_invalidation(session_factory, cache):
+    """Hook a session factory up so that commits invalidate ``cache``."""
+
+    def after_flush(session, flush_context):
+        changed = [
+            obj.id for obj in chain(session.new, session.dirty, session.deleted)
+            if isinstance(obj, Expense)
+        ]
+        if changed:
+            mark_expenses_stale(session, changed)
+
+    def after_commit(session):
+        for expense_id in session.info.pop('cache_expense_ids', ()):
+            cache.delete(expense_key(expense_id))
+            cache.delete(fragment_key(expense_key(expense_id)))
+        if session.info.pop('cache_lists_stale', False):
+            cache.bump_generation()
+
+    def after_rollback(session):
+        session.info.pop('cache_expense_ids', None)
+        session.info.pop('cache_lists_stale', None)
+
+    event.listen(session_factory, 'after_flush', after_flush)
+    event.listen(session_factory, 'after_commit', after_commit)
+    event.listen(session_factory, 'after_rollback', after_rollback)
+
+
+class FragmentCacheExtension(Extension):
+    """``{% cache key %}...{% endcache %}`` stores the rendered body.
+
+    The cache comes from the request's registry; with no cache configured
+    or an empty key the body is simply rendered.
+    """
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [nodes.ContextReference(), parser.parse_expression()]
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(
+            self.call_method('_cache_support', args), [], [], body
+        ).set_lineno(lineno)
+
+    def _cache_support(self, context, key, caller):
+        request = context.get('request')
+        cache = request.registry.get('cache') if request is not None else None
+        if cache is None or not key:
+            return caller()
+        rv = cache.get(fragment_key(key))
+        if rv is None:
+            rv = caller()
+            cache.set(fragment_key(key), str(rv))
+        return Markup(rv)
+
+
+def cache_from_settings(settings):
+    backend = settings.get('cache.backend', 'none')
+    ttl = int(settings.get('cache.ttl', 300))
+    if backend == 'memory':
+        return MemoryCache(int(settings.get('cache.max_entries', 1000)), ttl)
+    if backend == 'dbm':
+        return DBMCache(settings['cache.path'], ttl)
+    if backend == 'none':
+        return None
+    raise ValueError('unknown cache.backend {!r}'.format(backend))
+
+
+def includeme(config):
+    """Set up the cache named by the ``cache.*`` settings.
+
+    Include after ``expense_tracker.models`` and ``pyramid_jinja2``.
+    """
+    config.add_jinja2_extension(FragmentCacheExtension)
+    cache = cache_from_settings(config.get_settings())
+    if cache is None:
+        return
+    config.registry['cache'] = cache
+    track_invalidation(config.registry['dbsession_factory'], cache)
@@ -0,0 +1,109 @@
+"""Conditional GET support (weak ETags, Last-Modified and 304s).
+
+Use as a view decorator, e.g.
+``@view_config(..., decorator=conditional(expense_version))``.
+The version function runs one cheap query; if the client already holds
+the current representation the view (ORM load, to_dict, template render)
+is never called and a bodiless 304 goes back instead.
+"""
+import hashlib
+
+from pyramid.httpexceptions import HTTPNotModified
+from sqlalchemy import func, select
+
+from expense_tracker.models import Expense, ExpenseTotal
+from expense_tracker.security import current_owner_id, owned_by
+
+
+def table_version_query(owner_id):
+    """The newest ``updated_at`` of ``owner_id``'s expenses and of their
+    expense_totals buckets, each one index lookup.
+
+    Deleting an expense doesn't move the first, but it does move the
+    second, as every write to the expenses adjusts a bucket.
+    """
+    return select([
+        select([func.max(Expense.updated_at)])
+        .where(owned_by(owner_id)).as_scalar(),
+        select([func.max(ExpenseTotal.updated_at)])
+        .where(ExpenseTotal.owner_id == (owner_id or 0)).as_scalar(),
+    ])
+
+
+def versions(expenses_modified, totals_modified):
+    """(last modified, token) from what table_version_query returns."""
+    last_modified = max(filter(None, (expenses_modified, totals_modified)), default=None)
+    return last_modified, '{}/{}'.format(expenses_modified, totals_modified)
+
+
+def table_version(request):
+    """(last modified, token) for responses built from all the expenses
+    the request can list."""
+    row = request.read_dbsession.execute(
+        table_version_query(current_owner_id(request))).first()
+    return versions(*row)
+
+
+def expense_version(request):
+    """(last modified, token) for the expense named in the matchdict."""
+    expense_id = int(request.matchdict['id'])
+    last_modified = request.read_dbsession.query(Expense.updated_at).filter(
+        Expense.id == expense_id).scalar()
+    if last_modified is None:
+        return None, None  # let the view deal with missing rows
+    return last_modified, '{}/{}'.format(expense_id, last_modified)
+
+
+def make_etag(request, token):
+    """Hash the data version together with everything else that shapes
+    the response: the route, its query string and who is logged in."""
+    route = request.matched_route.name if request.matched_route else ''
+    parts = [route, token, request.query_string, request.authenticated_userid or '']
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+
+def is_fresh(request, etag, last_modified):
+    """Whether the client's cached copy is still current.
+
+    HTTP dates only carry whole seconds, so two writes within a second
+    share a Last-Modified. If-Modified-Since is therefore only trusted
+    when there is no ETag to check; with one, only If-None-Match can get
+    a 304.
+    """
+    if request.if_none_match:
+        return etag in request.if_none_match
+    if request.if_modified_since and last_modified and etag is None:
+        return last_modified.replace(microsecond=0) <= \
+            request.if_modified_since.replace(tzinfo=None)
+    return False
+
+
+def set_validators(response, etag, last_modified):
+    """Put the weak ETag and Last-Modified on a response and make clients
+    revalidate before reusing it."""
+    response.etag = (etag, False)
+    if last_modified:
+        response.last_modified = last_modified
+    response.cache_control = 'no-cache'
+    return response
+
+
+def conditional(version):
+    """Build a view decorator that revalidates against ``version(request)``."""
+    def decorator(view):
+        def conditional_view(context, request):
+            if request.method not in ('GET', 'HEAD'):
+                return view(context, request)
+            last_modified, token = version(request)
+            if token is None:
+                return view(context, request)
+            etag = make_etag(request, token)
+            if is_fresh(request, etag, last_modified):
+                response = HTTPNotModified()
+            else:
+                response = view(context, request)
+                if response.status_int == 202:
+                    return response  # queued as a job: nothing to revalidate yet
+            return set_validators(response, etag, last_modified)
+        return conditional_view
+    return decorator
@@ -65,4 +65,4 @@ def dummy_request(db_session):
     This is a function-level fixture, so every new request will have a
     new database session.
     """
-    return testing.DummyRequest(dbsession=db_session)
\ No newline at end of file
+    return testing.DummyRequest(dbsession=db_session, read_dbsession=db_session, user=None)
\ No newline at end of file
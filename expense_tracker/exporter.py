@@ -0,0 +1,173 @@
+"""Encode streamed rows of the models table as CSV, NDJSON or columnar.
+
+Rows come in as chunks of plain tuples straight off a server-side cursor
+and leave as chunks of bytes; no Expense instances or dicts are built.
+
+The columnar format is a compact little-endian binary layout:
+
+    b'EXPC' + version byte (2)
+    then one block per chunk:
+        uint32   row count n (a count of 0 ends the stream)
+        int64[n] ids
+        int64[n] due dates as unix seconds (INT64_MIN for null)
+        int64[n] amounts in cents (INT64_MIN for null)
+        int64[n] creation dates as unix seconds (INT64_MIN for null)
+        char[3n] currency codes, ascii
+        uint32[n] byte length of each utf-8 title
+        the titles, concatenated
+"""
+import csv
+import io
+import json
+import struct
+import sys
+from array import array
+from calendar import timegm
+
+from sqlalchemy import select
+
+from expense_tracker.models import Expense
+from expense_tracker.money import from_cents
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+    'columnar': 'application/octet-stream',
+}
+COLUMNS = (Expense.id, Expense.title, Expense.amount_cents, Expense.due_date,
+           Expense.creation_date, Expense.currency)
+HEADER = ['id', 'title', 'amount', 'due_date', 'creation_date', 'currency']
+CHUNK_SIZE = 2000
+
+MAGIC = b'EXPC\x02'
+NULL_INT = NULL_TIME = -2 ** 63
+
+
+def export_statement(criteria=()):
+    """SELECT the exported columns in id order, with any filters applied."""
+    statement = select(list(COLUMNS)).order_by(Expense.id)
+    for criterion in criteria:
+        statement = statement.where(criterion)
+    return statement
+
+
+def iter_chunks(connection, statement, chunk_size=CHUNK_SIZE):
+    """Yield lists of row tuples from a server-side cursor."""
+    result = connection.execution_options(stream_results=True).execute(statement)
+    try:
+        while True:
+            rows = result.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        result.close()
+
+
+def isoformat(value):
+    return value.isoformat() if value is not None else None
+
+
+def csv_chunks(chunks):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(HEADER)
+    for rows in chunks:
+        for row_id, title, cents, due_date, creation_date, currency in rows:
+            writer.writerow([row_id, title, from_cents(cents), isoformat(due_date),
+                             isoformat(creation_date), currency])
+        yield buf.getvalue().encode('utf-8')
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode('utf-8')
+
+
+def as_number(cents):
+    return float(from_cents(cents)) if cents is not None else None
+
+
+def ndjson_chunks(chunks):
+    for rows in chunks:
+        yield ''.join(
+            json.dumps({
+                'id': row_id,
+                'title': title,
+                'amount': as_number(cents),
+                'amount_cents': cents,
+                'currency': currency,
+                'due_date': isoformat(due_date),
+                'creation_date': isoformat(creation_date)
+            }, separators=(',', ':')) + '\n'
+            for row_id, title, cents, due_date, creation_date, currency in rows
+        ).encode('utf-8')
+
+
+def epoch(value):
+    return timegm(value.timetuple()) if value is not None else NULL_TIME
+
+
+def packed(typecode, values):
+    values = array(typecode, values)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tobytes()
+
+
+def columnar_chunks(chunks):
+    yield MAGIC
+    for rows in chunks:
+        ids, titles, cents, due_dates, creation_dates, currencies = zip(*rows)
+        titles = [(title or '').encode('utf-8') for title in titles]
+        yield b''.join([
+            struct.pack('<I', len(rows)),
+            packed('q', ids),
+            packed('q', [epoch(value) for value in due_dates]),
+            packed('q', [NULL_INT if value is None else value for value in cents]),
+            packed('q', [epoch(value) for value in creation_dates]),
+            ''.join(currencies).encode('ascii'),
+            packed('I', [len(title) for title in titles]),
+            b''.join(titles),
+        ])
+    yield struct.pack('<I', 0)
+
+
+ENCODERS = {
+    'csv': csv_chunks,
+    'ndjson': ndjson_chunks,
+    'columnar': columnar_chunks,
+}
+
+
+def read_columnar(stream):
+    """Decode a columnar export back into a dict of column lists.
+
+    Amounts come back as Decimals.
+    """
+    if stream.read(len(MAGIC)) != MAGIC:
+        raise ValueError('not a columnar expense export')
+    columns = {key: [] for key in HEADER}
+
+    def unpacked(typecode, count):
+        values = array(typecode)
+        values.frombytes(stream.read(values.itemsize * count))
+        if sys.byteorder == 'big':
+            values.byteswap()
+        return values.tolist()
+
+    while True:
+        count, = struct.unpack('<I', stream.read(4))
+        if not count:
+            return columns
+        columns['id'] += unpacked('q', count)
+        columns['due_date'] += unpacked('q', count)
+        columns['amount'] += [
+            None if value == NULL_INT else from_cents(value)
+            for value in unpacked('q', count)
+        ]
+        columns['creation_date'] += unpacked('q', count)
+        codes = stream.read(3 * count).decode('ascii')
+        columns['currency'] += [codes[i:i + 3] for i in range(0, len(codes), 3)]
+        columns['title'] += [
+            stream.read(length).decode('utf-8') for length in unpacked('I', count)
+        ]
@@ -0,0 +1,77 @@
+"""Turn query-string parameters into SQL criteria, sort keys and columns.
+
+Everything here raises ValueError on bad input so views can answer with a
+400 instead of a 500.
+"""
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from expense_tracker.models import Expense
+from expense_tracker.money import parse_currency, to_cents
+
+DATE_FMT = '%Y-%m-%d'
+
+FIELDS = OrderedDict([
+    ('id', Expense.id),
+    ('title', Expense.title),
+    ('amount', Expense.amount),
+    ('amount_cents', Expense.amount_cents),
+    ('currency', Expense.currency),
+    ('due_date', Expense.due_date),
+    ('creation_date', Expense.creation_date),
+])
+
+SORTABLE = ('due_date', 'amount', 'title', 'creation_date', 'id')
+# sort (and page) amounts on the integer column, which is what's indexed
+SORT_COLUMNS = dict(FIELDS, amount=Expense.amount_cents)
+
+
+def parse_date(value):
+    """Parse a YYYY-MM-DD query parameter."""
+    return datetime.strptime(value, DATE_FMT)
+
+
+def expense_filters(params):
+    """Build the list of WHERE criteria asked for by ``params``.
+
+    Supported keys: ``due_after``/``due_before`` (inclusive dates),
+    ``min_amount``/``max_amount``, ``currency`` and ``title`` (a prefix
+    match).
+    """
+    criteria = []
+    if params.get('due_after'):
+        criteria.append(Expense.due_date >= parse_date(params['due_after']))
+    if params.get('due_before'):
+        # inclusive of the whole day
+        end = parse_date(params['due_before']) + timedelta(days=1)
+        criteria.append(Expense.due_date < end)
+    if params.get('min_amount'):
+        criteria.append(Expense.amount_cents >= to_cents(params['min_amount']))
+    if params.get('max_amount'):
+        criteria.append(Expense.amount_cents <= to_cents(params['max_amount']))
+    if params.get('currency'):
+        criteria.append(Expense.currency == parse_currency(params['currency']))
+    if params.get('title'):
+        criteria.append(Expense.title.startswith(params['title'], autoescape=True))
+    return criteria
+
+
+def parse_sort(value):
+    """Return (column, descending) for a ``sort`` like ``-amount``."""
+    value = value or 'due_date'
+    descending = value.startswith('-')
+    name = value.lstrip('-')
+    if name not in SORTABLE:
+        raise ValueError('cannot sort by {}'.format(name))
+    return SORT_COLUMNS[name], descending
+
+
+def parse_fields(value):
+    """Return the list of field names asked for by ``fields=a,b,c``."""
+    if not value:
+        return list(FIELDS)
+    fields = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in fields if name not in FIELDS]
+    if unknown or not fields:
+        raise ValueError('unknown fields: {}'.format(', '.join(unknown)))
+    return fields
@@ -0,0 +1,182 @@
+"""Group commit for new expenses: many creates, one INSERT, one commit.
+
+With ``group_commit.enabled = true`` the create view hands its row to a
+GroupCommitter instead of its own transaction. The first create to
+arrive while other creates are still in progress waits up to
+``group_commit.window_ms`` (default 2) for more to join it, or until
+``group_commit.max_rows`` (default 100) have, then writes all of them
+with one multi-row INSERT and one commit. A create on its own goes
+straight in, so a quiet server pays nothing for the window. Every
+create waits for that commit before its response goes out, so a
+redirect always finds its expense, and each gets its own id back.
+
+The commit happens outside the request's own transaction. The create
+view keeps the id in the WSGI environ under GROUP_COMMIT_ID, which
+survives a pyramid_retry retry of the request, so a retried create
+redirects to the row it already wrote instead of inserting another.
+
+If the batch fails as a whole, its rows are written again one
+transaction each, so one bad row only fails its own request.
+"""
+import threading
+from datetime import datetime
+
+from sqlalchemy import func, select
+
+from expense_tracker.cache import mark_lists_stale
+from expense_tracker.models import Expense
+from expense_tracker.models.totals import apply_deltas, row_deltas
+from expense_tracker.money import DEFAULT_CURRENCY
+
+DEFAULT_WINDOW_MS = 2
+DEFAULT_MAX_ROWS = 100
+GROUP_COMMIT_ID = 'expense_tracker.group_commit.id'
+
+
+def expense_row(expense, utcnow=None):
+    """The columns to insert for ``expense``, a new Expense that never
+    goes near a session (so column defaults are filled in here)."""
+    return {
+        'owner_id': expense.owner_id,
+        'title': expense.title,
+        'amount_cents': expense.amount_cents,
+        'currency': expense.currency or DEFAULT_CURRENCY,
+        'due_date': expense.due_date,
+        'creation_date': expense.creation_date,
+        'updated_at': utcnow or datetime.utcnow(),
+    }
+
+
+def insert_expenses(connection, rows):
+    """Insert ``rows`` and return their ids, in order.
+
+    PostgreSQL hands out the ids from the sequence first. SQLite numbers
+    the rows of one INSERT one after the other, so the ids are the ones
+    up to its last rowid. Anywhere else rows go in one at a time (still
+    in the one transaction).
+    """
+    table = Expense.__table__
+    dialect = connection.dialect.name
+    if dialect == 'postgresql':
+        ids = [row_id for row_id, in connection.execute(
+            select([func.nextval(func.pg_get_serial_sequence('models', 'id'))])
+            .select_from(func.generate_series(1, len(rows))))]
+        connection.execute(table.insert().values(
+            [dict(row, id=row_id) for row, row_id in zip(rows, ids)]))
+        return ids
+    if dialect == 'sqlite':
+        last = connection.execute(table.insert().values(rows)).lastrowid
+        return list(range(last - len(rows) + 1, last + 1))
+    return [connection.execute(table.insert(), row).inserted_primary_key[0] for row in rows]
+
+
+class Batch(object):
+    """Rows waiting to go in together, and how that went for each."""
+
+    def __init__(self):
+        self.rows = []
+        self.ids = []
+        self.errors = []
+        self.full = threading.Event()
+        self.done = threading.Event()
+
+
+class GroupCommitter(object):
+    """Coalesces concurrent inserts; see the module docstring."""
+
+    def __init__(self, session_factory, window=DEFAULT_WINDOW_MS / 1000.0,
+                 max_rows=DEFAULT_MAX_ROWS):
+        self.session_factory = session_factory
+        self.window = window
+        self.max_rows = max_rows
+        self.batches = 0
+        self.rows = 0
+        self._lock = threading.Lock()
+        self._open = None
+        # creates in progress, counting those waiting on a batch
+        self._active = 0
+
+    def insert(self, row):
+        """Insert ``row`` with whatever else comes in meanwhile; returns
+        its id once committed, or raises what writing it raised."""
+        with self._lock:
+            self._active += 1
+            batch = self._open
+            leader = batch is None
+            if leader:
+                batch = self._open = Batch()
+                # alone, there is nobody to wait for
+                wait = self._active > 1
+            index = len(batch.rows)
+            batch.rows.append(row)
+            if len(batch.rows) >= self.max_rows:
+                self._open = None
+                batch.full.set()
+        try:
+            if leader:
+                if wait:
+                    batch.full.wait(self.window)
+                with self._lock:
+                    if self._open is batch:
+                        self._open = None
+                self.write(batch)
+            else:
+                batch.done.wait()
+        finally:
+            with self._lock:
+                self._active -= 1
+        if batch.errors[index] is not None:
+            raise batch.errors[index]
+        return batch.ids[index]
+
+    def write(self, batch):
+        """Commit ``batch``, or each of its rows on its own if that fails."""
+        try:
+            batch.ids, batch.errors = self.attempt(batch.rows)
+            if batch.errors[0] is not None and len(batch.rows) > 1:
+                results = [self.attempt([row]) for row in batch.rows]
+                batch.ids = [ids[0] for ids, _ in results]
+                batch.errors = [errors[0] for _, errors in results]
+        finally:
+            batch.done.set()
+        with self._lock:
+            self.batches += 1
+            self.rows += len(batch.rows)
+
+    def attempt(self, rows):
+        """(ids, errors) from committing ``rows`` together."""
+        try:
+            return self.commit(rows), [None] * len(rows)
+        except Exception as err:
+            return [None] * len(rows), [err] * len(rows)
+
+    def commit(self, rows):
+        """One transaction inserting ``rows``; returns their ids.
+
+        It goes through a session from the app's factory so that the
+        cache and snapshot hear about the commit like any other.
+        """
+        session = self.session_factory()
+        try:
+            connection = session.connection()
+            ids = insert_expenses(connection, rows)
+            apply_deltas(connection, row_deltas(rows))
+            mark_lists_stale(session)
+            session.commit()
+            return ids
+        finally:
+            session.close()
+
+
+def includeme(config):
+    """Give the create view a GroupCommitter.
+
+    Include after ``expense_tracker.models``, and only when
+    ``group_commit.enabled`` is set.
+    """
+    settings = config.get_settings()
+    config.registry['group_committer'] = GroupCommitter(
+        config.registry['dbsession_factory'],
+        window=float(settings.get('group_commit.window_ms', DEFAULT_WINDOW_MS)) / 1000.0,
+        max_rows=int(settings.get('group_commit.max_rows', DEFAULT_MAX_ROWS)),
+    )
@@ -0,0 +1,194 @@
+"""Stream CSV or NDJSON expense records into the models table in batches.
+
+Records are parsed one line at a time, validated, and written a batch at a
+time through a Core multi-row INSERT (or COPY on PostgreSQL/psycopg2),
+so memory use depends on the batch size and not on the size of the file.
+Each batch adds itself to expense_totals in the same transaction.
+"""
+import csv
+import io
+import json
+from datetime import datetime
+
+from expense_tracker.models import Expense
+from expense_tracker.models.totals import apply_deltas, row_deltas
+from expense_tracker.money import DEFAULT_CURRENCY, parse_currency, to_cents
+
+DEFAULT_BATCH_SIZE = 1000
+DATE_FORMATS = ('%Y-%m-%d', '%m/%d/%Y', '%Y-%m-%dT%H:%M:%S')
+FORMATS = ('csv', 'ndjson')
+COLUMNS = ('owner_id', 'title', 'amount_cents', 'currency', 'due_date', 'creation_date',
+           'updated_at')
+MAX_ERRORS = 20
+
+
+class ImportReport(object):
+    """Running totals for one import, handed to the progress callback."""
+
+    def __init__(self):
+        self.read = 0
+        self.inserted = 0
+        self.rejected = 0
+        self.errors = []
+
+    def reject(self, line, reason):
+        self.rejected += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append('line {}: {}'.format(line, reason))
+
+    @classmethod
+    def from_dict(cls, values):
+        report = cls()
+        for name, value in values.items():
+            setattr(report, name, value)
+        return report
+
+    def to_dict(self):
+        return {
+            'read': self.read,
+            'inserted': self.inserted,
+            'rejected': self.rejected,
+            'errors': self.errors
+        }
+
+    def __str__(self):
+        return 'read {read}, inserted {inserted}, rejected {rejected}'.format(
+            **self.to_dict())
+
+
+def guess_format(filename, default='csv'):
+    """Pick csv or ndjson from a file name's extension."""
+    if filename and filename.lower().endswith(('.ndjson', '.jsonl', '.json')):
+        return 'ndjson'
+    return default
+
+
+def iter_records(stream, fmt):
+    """Yield (line number, record dict) pairs from a text stream."""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+    elif fmt == 'ndjson':
+        for line_num, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            yield line_num, record
+    else:
+        raise ValueError('unknown format {}'.format(fmt))
+
+
+def parse_due_date(value):
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value.strip(), fmt)
+        except ValueError:
+            pass
+    raise ValueError('bad due_date {!r}'.format(value))
+
+
+def clean_record(record, now, utcnow, owner_id=None):
+    """Validate one raw record and turn it into a row for the insert.
+
+    Raises ValueError with the reason when the record is unusable.
+    """
+    if not isinstance(record, dict):
+        raise ValueError('not a record')
+    title = record.get('title') or ''
+    if not isinstance(title, str):
+        raise ValueError('bad title {!r}'.format(title))
+    title = title.strip()
+    if not title:
+        raise ValueError('missing title')
+    amount = record.get('amount')
+    if not isinstance(amount, (str, int, float)) or isinstance(amount, bool):
+        raise ValueError('bad amount {!r}'.format(amount))
+    return {
+        'owner_id': owner_id,
+        'title': title,
+        'amount_cents': to_cents(amount),
+        'currency': parse_currency(record.get('currency') or DEFAULT_CURRENCY),
+        'due_date': parse_due_date(str(record.get('due_date') or '')),
+        'creation_date': now,
+        'updated_at': utcnow
+    }
+
+
+def insert_rows(connection, rows):
+    """Write one batch as a single multi-row INSERT."""
+    connection.execute(Expense.__table__.insert().values(rows))
+
+
+def copy_rows(connection, rows):
+    """Write one batch with PostgreSQL's COPY."""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for row in rows:
+        writer.writerow([row[column] for column in COLUMNS])
+    buf.seek(0)
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(
+            'COPY {} ({}) FROM STDIN WITH CSV'.format(
+                Expense.__tablename__, ', '.join(COLUMNS)),
+            buf
+        )
+    finally:
+        cursor.close()
+
+
+def get_writer(connection):
+    """COPY when the driver can do it, multi-row INSERTs otherwise."""
+    if connection.dialect.driver == 'psycopg2':
+        return copy_rows
+    return insert_rows
+
+
+def import_expenses(connection, stream, fmt='csv', batch_size=DEFAULT_BATCH_SIZE,
+                    progress=None, commit=None, owner_id=None, report=None):
+    """Import every record in ``stream`` for ``owner_id`` and return an
+    ImportReport.
+
+    ``progress`` is called with the report after each batch is written,
+    and ``commit`` (if given) right before that, so command line imports
+    can commit batch by batch while web uploads stay in one transaction.
+    Given the ``report`` of an earlier run of the same stream that
+    stopped part way, the records it read are skipped and its counts
+    carried on.
+    """
+    report = report or ImportReport()
+    skip = report.read
+    write = get_writer(connection)
+    now = datetime.now()
+    utcnow = datetime.utcnow()
+    batch = []
+
+    def flush():
+        write(connection, batch)
+        apply_deltas(connection, row_deltas(batch))
+        report.inserted += len(batch)
+        del batch[:]
+        if commit:
+            commit()
+        if progress:
+            progress(report)
+
+    for line_num, record in iter_records(stream, fmt):
+        if skip:
+            skip -= 1
+            continue
+        report.read += 1
+        try:
+            batch.append(clean_record(record, now, utcnow, owner_id))
+        except ValueError as err:
+            report.reject(line_num, err)
+            continue
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    return report
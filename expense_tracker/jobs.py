@@ -0,0 +1,429 @@
+"""A job queue in the database, for work too slow for a request thread.
+
+With ``jobs.enabled = true`` the heavy views (imports, exports and the
+totals reports that have to scan) queue a Job and answer ``202
+Accepted`` with its URL instead of doing the work inline. ``run_jobs``
+workers, as many as you like, take jobs off the table one at a time:
+
+- A job is claimed with ``SELECT ... FOR UPDATE SKIP LOCKED`` (on
+  SQLite, which has no row locks, a conditional UPDATE settles races)
+  and leased to its worker. While the handler runs, the worker renews
+  the lease from a thread of its own every third of
+  ``jobs.lease_seconds``. A job whose lease runs out anyway is given to
+  another worker. Checkpoints and the final result are only committed
+  while the worker still holds the lease (``locked_by`` is still its
+  name); otherwise the transaction is rolled back and the job left to
+  whoever has it now.
+- Each job runs in a transaction of its own, committed when the handler
+  returns. Handlers may checkpoint on the way: progress is saved and
+  everything done so far committed, and a retry picks up from there.
+- Failures are retried the way pyramid_retry retries a request: only
+  errors it would retry (transient ones, serialization failures and
+  deadlocks) and up to ``retry.attempts`` attempts in all, a little
+  later each time (``jobs.retry_delay`` seconds, doubled per attempt).
+  Anything else fails the job at once.
+- Files that go with a job (an upload to import, an export) are kept
+  in ``job_chunks`` a piece at a time, written and read back without
+  ever holding the whole file.
+- Finished jobs, and the files they leave behind, are deleted
+  ``jobs.keep_seconds`` (default a day) after they finish.
+
+Handlers are looked up in HANDLERS by the job's ``kind``. They take a
+JobContext and return the job's result, which must be JSON-able.
+"""
+import io
+import logging
+import os
+import socket
+import threading
+from datetime import datetime, timedelta
+
+from pyramid.httpexceptions import HTTPAccepted
+from pyramid.path import DottedNameResolver
+from pyramid.settings import asbool
+from pyramid_retry import IRetryableError
+from sqlalchemy import and_, bindparam, or_, select
+import transaction
+import zope.sqlalchemy
+from zope.sqlalchemy import mark_changed
+
+from expense_tracker.models import Job, JobChunk
+from expense_tracker.renderers import dumps
+from expense_tracker.security import current_owner_id, owner_filter
+
+log = logging.getLogger(__name__)
+
+# dotted names, so the views that queue jobs can import this module
+HANDLERS = {
+    'import': 'expense_tracker.views.imports.import_job',
+    'export': 'expense_tracker.views.exports.export_job',
+    'totals_monthly': 'expense_tracker.views.reports.totals_by_month_job',
+    'totals_titles': 'expense_tracker.views.reports.totals_by_title_job',
+}
+DEFAULT_ATTEMPTS = 3
+DEFAULT_LEASE_SECONDS = 600
+DEFAULT_RETRY_DELAY = 1.0
+DEFAULT_KEEP_SECONDS = 86400
+CLAIM_TRIES = 5
+# how often (seconds) a worker looks for finished jobs to delete
+EXPIRE_INTERVAL = 60
+# bytes per job_chunks row
+CHUNK_BYTES = 1 << 20
+
+
+def jobs_enabled(request):
+    """Whether heavy views should queue their work."""
+    return asbool(request.registry.settings.get('jobs.enabled'))
+
+
+def write_chunks(connection, job_id, part, pieces, size=None):
+    """Store the bytes ``pieces`` yields as ``part`` of the job, in rows
+    of ``size`` (default CHUNK_BYTES) bytes; returns how many bytes
+    there were."""
+    size = size or CHUNK_BYTES
+    table = JobChunk.__table__
+    connection.execute(table.delete().where(and_(
+        table.c.job_id == job_id, table.c.part == part)))
+    buf, seq, total = bytearray(), 0, 0
+    for piece in pieces:
+        buf += piece
+        total += len(piece)
+        while len(buf) >= size:
+            connection.execute(table.insert(), job_id=job_id, part=part, seq=seq,
+                               data=bytes(buf[:size]))
+            del buf[:size]
+            seq += 1
+    if buf:
+        connection.execute(table.insert(), job_id=job_id, part=part, seq=seq, data=bytes(buf))
+    return total
+
+
+def read_chunks(connection, job_id, part):
+    """Yield ``part`` of the job a row at a time, one query per row."""
+    table = JobChunk.__table__
+    statement = select([table.c.data]).where(and_(
+        table.c.job_id == job_id, table.c.part == part, table.c.seq == bindparam('seq')))
+    seq = 0
+    while True:
+        data = connection.execute(statement, seq=seq).scalar()
+        if data is None:
+            return
+        yield bytes(data)
+        seq += 1
+
+
+class ChunkReader(io.RawIOBase):
+    """``part`` of a job as a binary file, read in as it is consumed."""
+
+    def __init__(self, connection, job_id, part):
+        self._chunks = read_chunks(connection, job_id, part)
+        self._pending = memoryview(b'')
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        while not self._pending:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._pending = memoryview(chunk)
+        n = min(len(buf), len(self._pending))
+        buf[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+
+def enqueue(request, kind, params, payload=None):
+    """Add a ``kind`` job for the user; it is queued when the request's
+    transaction commits. ``payload`` is a file to keep with it."""
+    job = Job(
+        kind=kind,
+        owner_id=current_owner_id(request),
+        params=params,
+        max_attempts=int(request.registry.settings.get('retry.attempts', DEFAULT_ATTEMPTS)),
+    )
+    request.dbsession.add(job)
+    request.dbsession.flush()
+    if payload is not None:
+        write_chunks(request.dbsession.connection(), job.id, 'payload',
+                     iter(lambda: payload.read(CHUNK_BYTES), b''))
+    return job
+
+
+def enqueue_once(request, kind, params):
+    """The user's queued or running ``kind`` job for ``params``, or a new
+    one; for GETs, which a client may repeat while it waits."""
+    job = request.dbsession.query(Job).filter(
+        Job.kind == kind,
+        owner_filter(request, Job.owner_id),
+        Job.state.in_(('queued', 'running')),
+        Job.params == params,
+    ).order_by(Job.id).first()
+    return job if job is not None else enqueue(request, kind, params)
+
+
+def job_status(request, job):
+    """What /api/jobs/{id} says about ``job``."""
+    status = job.to_dict()
+    status['url'] = request.route_url('api_job', id=job.id)
+    if job.state == 'done':
+        status['result_url'] = request.route_url('api_job_result', id=job.id)
+    return status
+
+
+def accepted(request, job):
+    """The ``202 Accepted`` a view answers with once it has queued ``job``."""
+    status = job_status(request, job)
+    return HTTPAccepted(body=dumps(status), content_type='application/json',
+                        location=status['url'])
+
+
+def claim(connection, worker, now):
+    """Lease the oldest job that is ready to ``worker``; returns its id,
+    or None when there is nothing to do."""
+    table = Job.__table__
+    ready = select([table.c.id]).where(and_(
+        table.c.state == 'queued',
+        or_(table.c.run_after.is_(None), table.c.run_after <= now),
+    )).order_by(table.c.id).limit(1).with_for_update(skip_locked=True)
+    for _ in range(CLAIM_TRIES):
+        job_id = connection.execute(ready).scalar()
+        if job_id is None:
+            return None
+        # the state check is what stops two SQLite workers sharing a job
+        claimed = connection.execute(
+            table.update().where(and_(table.c.id == job_id, table.c.state == 'queued'))
+            .values(state='running', locked_by=worker, heartbeat_at=now, started_at=now,
+                    attempts=table.c.attempts + 1))
+        if claimed.rowcount:
+            return job_id
+    return None
+
+
+def requeue_stale(connection, now, lease_seconds):
+    """Take back jobs whose worker stopped renewing its lease: queue them
+    again, or fail them if that was their last attempt."""
+    table = Job.__table__
+    stale = and_(table.c.state == 'running',
+                 table.c.heartbeat_at < now - timedelta(seconds=lease_seconds))
+    connection.execute(
+        table.update().where(and_(stale, table.c.attempts < table.c.max_attempts))
+        .values(state='queued', locked_by=None, run_after=now))
+    connection.execute(
+        table.update().where(stale)
+        .values(state='failed', error='worker lost', finished_at=now))
+
+
+def expire_finished(connection, now, keep_seconds):
+    """Delete jobs that finished more than ``keep_seconds`` ago, and
+    their files."""
+    table = Job.__table__
+    expired = and_(
+        table.c.state.in_(('done', 'failed')),
+        table.c.finished_at < now - timedelta(seconds=keep_seconds))
+    chunks = JobChunk.__table__
+    connection.execute(chunks.delete().where(
+        chunks.c.job_id.in_(select([table.c.id]).where(expired))))
+    connection.execute(table.delete().where(expired))
+
+
+class LeaseLost(Exception):
+    """The worker's lease on a job ran out and the job went to another."""
+
+
+def hold_lease(connection, job_id, worker, now):
+    """Renew ``worker``'s lease on ``job_id``, or raise LeaseLost.
+
+    Run in the transaction about to commit the job's work: it also locks
+    the job row until then, so the lease can't be taken back meanwhile.
+    """
+    table = Job.__table__
+    renewed = connection.execute(
+        table.update().where(and_(
+            table.c.id == job_id, table.c.locked_by == worker, table.c.state == 'running'))
+        .values(heartbeat_at=now))
+    if not renewed.rowcount:
+        raise LeaseLost('job {} is no longer leased to {}'.format(job_id, worker))
+
+
+def is_retryable(manager, error):
+    """Whether pyramid_tm and pyramid_retry would retry a request that
+    failed with ``error``; ask before aborting, while the session is
+    still joined to ``manager``."""
+    return IRetryableError.providedBy(error) or manager.get().isRetryableError(error)
+
+
+class JobContext(object):
+    """What a handler gets: the job, the settings, and a session whose
+    transaction the worker commits when the handler returns."""
+
+    def __init__(self, job, session, manager, settings, worker):
+        self.job = job
+        self.session = session
+        self.manager = manager
+        self.settings = settings
+        self.worker = worker
+
+    @property
+    def params(self):
+        return self.job.params or {}
+
+    def checkpoint(self, **progress):
+        """Save ``progress``, renew the lease and commit the work so far.
+
+        Anything else the handler loaded through the session has to be
+        loaded again afterwards; ``job`` already is.
+        """
+        job_id = self.job.id
+        hold_lease(self.session.connection(), job_id, self.worker, datetime.utcnow())
+        self.job.progress = progress
+        mark_changed(self.session)
+        self.manager.commit()
+        self.manager.begin()
+        # committing closed the session; loading the job again also starts
+        # the next transaction before the handler writes anything more
+        self.job = self.session.query(Job).get(job_id)
+
+    def payload(self):
+        """The file queued with the job, as a binary file object."""
+        return io.BufferedReader(
+            ChunkReader(self.session.connection(), self.job.id, 'payload'))
+
+    def write_output(self, pieces, content_type):
+        """Keep the bytes ``pieces`` yields as the job's downloadable
+        result; returns how many there were."""
+        self.job.output_type = content_type
+        return write_chunks(self.session.connection(), self.job.id, 'output', pieces)
+
+
+class Heartbeat(object):
+    """Renews a worker's lease on a job every third of the lease, from a
+    daemon thread, for as long as the ``with`` block runs."""
+
+    def __init__(self, worker, job_id):
+        self.worker = worker
+        self.job_id = job_id
+        self.interval = worker.lease_seconds / 3.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self._stop.wait(self.interval):
+            if not self.worker.renew(self.job_id):
+                return  # hold_lease stops the handler's work committing
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+
+class Worker(object):
+    """Claims and runs jobs, one at a time, for ``run_jobs``."""
+
+    def __init__(self, engine, session_factory, settings, name=None):
+        self.engine = engine
+        self.session_factory = session_factory
+        self.settings = settings
+        self.name = name or '{}:{}'.format(socket.gethostname(), os.getpid())
+        self.lease_seconds = float(settings.get('jobs.lease_seconds', DEFAULT_LEASE_SECONDS))
+        self.retry_delay = float(settings.get('jobs.retry_delay', DEFAULT_RETRY_DELAY))
+        self.keep_seconds = float(settings.get('jobs.keep_seconds', DEFAULT_KEEP_SECONDS))
+        self._expired_at = None
+        self.manager = transaction.TransactionManager(explicit=True)
+        self.resolver = DottedNameResolver()
+
+    def run_next(self):
+        """Run one job if there is one ready; returns its id or None."""
+        now = datetime.utcnow()
+        with self.engine.connect() as connection:
+            with connection.begin():
+                if self._expired_at is None or \
+                        (now - self._expired_at).total_seconds() >= EXPIRE_INTERVAL:
+                    expire_finished(connection, now, self.keep_seconds)
+                    self._expired_at = now
+                requeue_stale(connection, now, self.lease_seconds)
+                job_id = claim(connection, self.name, now)
+        if job_id is not None:
+            self.run(job_id)
+        return job_id
+
+    def run(self, job_id):
+        """Run the claimed job ``job_id`` and record how it went."""
+        manager = self.manager
+        # bound to one connection, so a handler can go on using
+        # session.connection() after its checkpoints commit
+        with self.engine.connect() as connection:
+            session = self.session_factory(bind=connection)
+            zope.sqlalchemy.register(session, transaction_manager=manager)
+            manager.begin()
+            try:
+                job = session.query(Job).get(job_id)
+                if job is None:  # deleted since it was claimed
+                    manager.abort()
+                    return
+                handler = self.resolver.maybe_resolve(HANDLERS[job.kind])
+                context = JobContext(job, session, manager, self.settings, self.name)
+                with self.heartbeat(job_id):
+                    result = handler(context)
+                hold_lease(session.connection(), job_id, self.name, datetime.utcnow())
+                job = context.job
+                job.state = 'done'
+                job.result = result
+                job.error = None
+                write_chunks(session.connection(), job_id, 'payload', ())
+                job.finished_at = datetime.utcnow()
+                mark_changed(session)
+                manager.commit()
+            except LeaseLost:
+                manager.abort()
+                log.warning('job %s was taken back from %s', job_id, self.name)
+            except Exception as err:
+                retry = is_retryable(manager, err)
+                manager.abort()
+                log.warning('job %s failed', job_id, exc_info=True)
+                try:
+                    with manager:
+                        hold_lease(session.connection(), job_id, self.name, datetime.utcnow())
+                        self.failed(session.query(Job).get(job_id), err, retry)
+                except LeaseLost:
+                    log.warning('job %s was taken back from %s', job_id, self.name)
+            finally:
+                session.close()
+
+    def heartbeat(self, job_id):
+        """Context manager renewing the lease on ``job_id`` in the
+        background until it exits."""
+        return Heartbeat(self, job_id)
+
+    def renew(self, job_id):
+        """Renew the lease on ``job_id`` in a transaction of its own;
+        False once it has been lost."""
+        try:
+            with self.engine.begin() as connection:
+                hold_lease(connection, job_id, self.name, datetime.utcnow())
+        except LeaseLost:
+            return False
+        except Exception:
+            # e.g. SQLite busy while the handler writes; try again next time
+            log.warning('could not renew the lease on job %s', job_id, exc_info=True)
+        return True
+
+    def failed(self, job, error, retry):
+        """Queue ``job`` again after ``error`` if it may be retried, or
+        mark it failed."""
+        now = datetime.utcnow()
+        job.error = '{}: {}'.format(type(error).__name__, error)
+        job.locked_by = None
+        if retry and job.attempts < job.max_attempts:
+            job.state = 'queued'
+            job.run_after = now + timedelta(
+                seconds=self.retry_delay * 2 ** (job.attempts - 1))
+        else:
+            job.state = 'failed'
+            job.finished_at = now
+
@@ -1,25 +1,96 @@
+import os
+
+from pyramid.settings import asbool
 from sqlalchemy import engine_from_config
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.orm import configure_mappers
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.orm import configure_mappers, sessionmaker
 import zope.sqlalchemy
 
 # import or define all models here to ensure they are attached to the
 # Base.metadata prior to any initialization routines
 from .mymodel import Expense  # flake8: noqa
+from .user import User  # flake8: noqa
+from .recurrence import RecurrenceRule  # flake8: noqa
+from .totals import ExpenseTotal, track_totals  # flake8: noqa
+from .job import Job, JobChunk  # flake8: noqa
+from .pool import TimedQueuePool
+
+
+# environment variables that override pool settings from the ini file
+ENVIRON_SETTINGS = {
+    'DATABASE_POOL_SIZE': 'sqlalchemy.pool_size',
+    'DATABASE_MAX_OVERFLOW': 'sqlalchemy.max_overflow',
+    'DATABASE_POOL_TIMEOUT': 'sqlalchemy.pool_timeout',
+    'DATABASE_POOL_RECYCLE': 'sqlalchemy.pool_recycle',
+    'DATABASE_POOL_PRE_PING': 'sqlalchemy.pool_pre_ping',
+    'DATABASE_STATEMENT_TIMEOUT': 'sqlalchemy.statement_timeout',
+    'DATABASE_REPLICA_URL': 'sqlalchemy_replica.url',
+}
+
+
+def settings_from_environ(settings, environ=os.environ):
+    """Copy database settings given as environment variables over the
+    ini settings, the same way ``DATABASE_URL`` is."""
+    for name, key in ENVIRON_SETTINGS.items():
+        if environ.get(name):
+            settings[key] = environ[name]
+    return settings
+
 
+def get_engine(settings, prefix='sqlalchemy.'):
+    """Build an engine from the ``<prefix>*`` settings.
 
-# run configure_mappers after defining all of the models to ensure
-# all relationships can be setup
-configure_mappers()
+    Besides everything ``engine_from_config`` understands (``pool_size``,
+    ``max_overflow``, ``pool_timeout``, ``pool_recycle``,
+    ``pool_pre_ping``...), ``<prefix>statement_timeout`` sets a per
+    statement limit in milliseconds on PostgreSQL. Pooled engines use a
+    TimedQueuePool so checkout waits show up in the metrics.
+    """
+    settings = dict(settings)
+    statement_timeout = settings.pop(prefix + 'statement_timeout', None)
+    if prefix + 'pool_pre_ping' in settings:
+        # engine_from_config leaves this one as a string
+        settings[prefix + 'pool_pre_ping'] = asbool(settings[prefix + 'pool_pre_ping'])
+    url = make_url(settings[prefix + 'url'])
+    kwargs = {}
+    if url.get_backend_name() in ('postgresql', 'postgres'):
+        kwargs['poolclass'] = TimedQueuePool
+        if statement_timeout:
+            kwargs['connect_args'] = {
+                'options': '-c statement_timeout={:d}'.format(int(statement_timeout))
+            }
+    return engine_from_config(settings, prefix, **kwargs)
+
+
+def replica_settings(settings):
+    """The ``sqlalchemy.*`` settings for the read replica, or None.
+
+    ``sqlalchemy_replica.*`` settings override the primary's
+    ``sqlalchemy.*`` ones, so only the url has to be given.
+    """
+    if not settings.get('sqlalchemy_replica.url'):
+        return None
+    merged = {
+        key: value for key, value in settings.items() if key.startswith('sqlalchemy.')
+    }
+    for key, value in settings.items():
+        if key.startswith('sqlalchemy_replica.'):
+            merged['sqlalchemy.' + key[len('sqlalchemy_replica.'):]] = value
+    return merged
 
 
-def get_engine(settings, prefix='sqlalchemy.'):
-    return engine_from_config(settings, prefix)
+def get_replica_engine(settings):
+    """Build the read replica engine, or return None if there is none."""
+    merged = replica_settings(settings)
+    if merged is None:
+        return None
+    return get_engine(merged)
 
 
 def get_session_factory(engine):
     factory = sessionmaker()
     factory.configure(bind=engine)
+    track_totals(factory)
     return factory
 
 
@@ -60,14 +131,20 @@ def includeme(config):
     settings = config.get_settings()
     settings['tm.manager_hook'] = 'pyramid_tm.explicit_manager'
 
+    # set up relationships now rather than at import time, so scripts and
+    # tests that only touch the tables don't pay for it
+    configure_mappers()
+
     # use pyramid_tm to hook the transaction lifecycle to the request
     config.include('pyramid_tm')
 
     # use pyramid_retry to retry a request when transient exceptions occur
     config.include('pyramid_retry')
 
-    session_factory = get_session_factory(get_engine(settings))
+    engine = get_engine(settings)
+    session_factory = get_session_factory(engine)
     config.registry['dbsession_factory'] = session_factory
+    config.registry['db_engines'] = {'primary': engine}
 
     # make request.dbsession available for use in Pyramid
     config.add_request_method(
@@ -76,3 +153,19 @@ def includeme(config):
         'dbsession',
         reify=True
     )
+
+    # read-only views use request.read_dbsession, which goes to the
+    # replica when one is configured and is just request.dbsession if not
+    replica = get_replica_engine(settings)
+    if replica is None:
+        config.registry['read_dbsession_factory'] = session_factory
+        config.add_request_method(lambda r: r.dbsession, 'read_dbsession', reify=True)
+    else:
+        read_session_factory = get_session_factory(replica)
+        config.registry['read_dbsession_factory'] = read_session_factory
+        config.registry['db_engines']['replica'] = replica
+        config.add_request_method(
+            lambda r: get_tm_session(read_session_factory, r.tm),
+            'read_dbsession',
+            reify=True
+        )
@@ -0,0 +1,92 @@
+import json
+
+from sqlalchemy import (
+    Column,
+    DateTime,
+    ForeignKey,
+    Index,
+    Integer,
+    LargeBinary,
+    Text,
+    Unicode,
+)
+from sqlalchemy.types import TypeDecorator
+
+from .meta import Base
+from datetime import datetime
+from expense_tracker.renderers import default
+
+class JSONText(TypeDecorator):
+    """JSON in a text column, so it works the same on every backend.
+    Dates and Decimals go in the way the json renderer writes them."""
+    impl = Text
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        # sorted, so equal params compare equal in SQL (see enqueue_once)
+        return json.dumps(value, default=default, separators=(',', ':'), sort_keys=True)
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else json.loads(value)
+
+
+class Job(Base):
+    """Slow work (an import, an export, a report) queued for run_jobs.
+
+    ``state`` goes from queued to running to done or failed (or back to
+    queued for a retry). ``params`` and the ``payload`` chunks (an
+    uploaded file, say) are what the handler for ``kind`` needs;
+    ``progress``, ``result`` and the ``output`` chunks (an export, of
+    type ``output_type``) are what it leaves behind. A running job holds a
+    lease that its worker renews through ``heartbeat_at``; see
+    expense_tracker.jobs.
+    """
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        # what workers look through for something to claim
+        Index('ix_jobs_state_run_after', 'state', 'run_after'),
+    )
+    id = Column(Integer, primary_key=True)
+    kind = Column(Unicode(40), nullable=False)
+    owner_id = Column(Integer, ForeignKey('users.id'), index=True)
+    state = Column(Unicode(10), nullable=False, default='queued', server_default='queued')
+    params = Column(JSONText)
+    progress = Column(JSONText)
+    result = Column(JSONText)
+    output_type = Column(Unicode(100))
+    error = Column(Unicode)
+    attempts = Column(Integer, nullable=False, default=0, server_default='0')
+    max_attempts = Column(Integer, nullable=False, default=3, server_default='3')
+    run_after = Column(DateTime)
+    locked_by = Column(Unicode(100))
+    heartbeat_at = Column(DateTime)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'state': self.state,
+            'attempts': self.attempts,
+            'progress': self.progress,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+
+class JobChunk(Base):
+    """One piece of a file that goes with a job: ``part`` is 'payload'
+    for what it reads, 'output' for what it writes. Files are kept in
+    pieces so neither end has to hold one whole; see expense_tracker.jobs.
+    """
+    __tablename__ = 'job_chunks'
+    job_id = Column(Integer, ForeignKey('jobs.id'), primary_key=True)
+    part = Column(Unicode(10), primary_key=True)
+    seq = Column(Integer, primary_key=True, autoincrement=False)
+    data = Column(LargeBinary, nullable=False)
@@ -1,38 +1,106 @@
 from sqlalchemy import (
+    BigInteger,
     Column,
     Unicode,
-    Float,
     DateTime,
-    Integer
+    ForeignKey,
+    Index,
+    Integer,
+    type_coerce
 )
+from sqlalchemy.ext.hybrid import hybrid_property
 
 from .meta import Base
 from datetime import datetime
+from functools import lru_cache
+from expense_tracker.money import DEFAULT_CURRENCY, Cents, from_cents, to_cents
+
+
+@lru_cache(maxsize=4096)
+def format_day(day):
+    return day.strftime('%m/%d/%Y')
+
+
+def format_date(when):
+    """``when`` as MM/DD/YYYY. Cached per day, since a page of expenses
+    only has a handful of distinct dates."""
+    if when is None:
+        return None
+    return format_day(when.date())
+
+
+def expense_dict(id, title, amount_cents, currency, due_date, creation_date):
+    """Expense.to_dict() from plain column values (see DICT_COLUMNS)."""
+    return {
+        'id': id,
+        'title': title,
+        'amount': from_cents(amount_cents),
+        'amount_cents': amount_cents,
+        'currency': currency,
+        'due_date': format_date(due_date),
+        'creation_date': format_date(creation_date)
+    }
 
 
 class Expense(Base):
     __tablename__ = 'models'
+    __table_args__ = (
+        # keyset pagination seeks on (due_date, id); plain due date range
+        # filters use the leading column of the same index
+        Index('ix_models_due_date_id', 'due_date', 'id'),
+        # the same for one user's expenses, which is what pages ask for
+        Index('ix_models_owner_id_due_date', 'owner_id', 'due_date', 'id'),
+        # a recurrence rule's occurrences, in order
+        Index('ix_models_rule_id_due_date', 'rule_id', 'due_date'),
+        # sorting one user's expenses by amount
+        Index('ix_models_owner_id_amount_cents', 'owner_id', 'amount_cents', 'id'),
+        # one user's newest change, for conditional GETs of the lists
+        Index('ix_models_owner_id_updated_at', 'owner_id', 'updated_at'),
+        # lets ``title LIKE 'prefix%'`` use a btree whatever the collation.
+        # The pg_trgm index for substring matches only exists in migrations.
+        Index('ix_models_title_prefix', 'title',
+              postgresql_ops={'title': 'text_pattern_ops'}),
+    )
     id = Column(Integer, primary_key=True)
+    # NULL for expenses from before there were users; anyone may see those
+    owner_id = Column(Integer, ForeignKey('users.id'))
+    # set on occurrences generated from a RecurrenceRule
+    rule_id = Column(Integer, ForeignKey('recurrence_rules.id'))
     title = Column(Unicode)
-    amount = Column(Float(precision=2))
+    # exact: integer minor units of ``currency``
+    amount_cents = Column(BigInteger)
+    currency = Column(Unicode(3), nullable=False, default=DEFAULT_CURRENCY,
+                      server_default=DEFAULT_CURRENCY)
     due_date = Column(DateTime)
-    creation_date = Column(DateTime)
+    creation_date = Column(DateTime, index=True)
+    # UTC, bumped on every ORM update; drives ETag/Last-Modified
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
 
     def __init__(self, *args, **kwargs):
         """Modify the init method to do more things."""
         super(Expense, self).__init__(*args, **kwargs)
         self.creation_date = datetime.now()
 
+    @hybrid_property
+    def amount(self):
+        """The amount as a Decimal; accepts anything ``to_cents`` does."""
+        return from_cents(self.amount_cents)
+
+    @amount.setter
+    def amount(self, value):
+        self.amount_cents = None if value is None else to_cents(value)
+
+    @amount.expression
+    def amount(cls):
+        return type_coerce(cls.amount_cents, Cents()).label('amount')
+
     def to_dict(self):
         """Take all model attributes and render them as a dictionary."""
-        return {
-            'id': self.id,
-            'title': self.title,
-            'amount': self.amount,
-            'due_date': self.due_date.strftime('%m/%d/%Y'),
-            'creation_date': self.creation_date.strftime('%m/%d/%Y')
-        }
+        return expense_dict(self.id, self.title, self.amount_cents, self.currency,
+                            self.due_date, self.creation_date)
 
-# model1 = MyModel() <-- a model instance
 
-# Index('my_index', MyModel.name, unique=True, mysql_length=255)
+# what expense_dict takes, in order: select these instead of whole
+# Expense objects when the dicts are all that's needed
+DICT_COLUMNS = (Expense.id, Expense.title, Expense.amount_cents, Expense.currency,
+                Expense.due_date, Expense.creation_date)
@@ -0,0 +1,66 @@
+"""Connection pool instrumentation.
+
+TimedQueuePool is a QueuePool that also records how long each checkout
+waited for a free connection, which is the number to watch when waitress
+has more threads than the pool has connections.
+"""
+import threading
+import time
+
+from sqlalchemy.pool import QueuePool
+
+
+class WaitStats(object):
+    """Running totals of pool checkout wait times."""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait += seconds
+            self.max_wait = max(self.max_wait, seconds)
+
+    def to_dict(self):
+        return {
+            'checkouts': self.checkouts,
+            'wait_ms_total': round(self.total_wait * 1000, 3),
+            'wait_ms_max': round(self.max_wait * 1000, 3),
+            'wait_ms_avg': round(self.total_wait * 1000 / self.checkouts, 3)
+            if self.checkouts else 0.0
+        }
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that times how long checkouts wait for a connection."""
+
+    def __init__(self, *args, **kwargs):
+        super(TimedQueuePool, self).__init__(*args, **kwargs)
+        self.wait_stats = WaitStats()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super(TimedQueuePool, self)._do_get()
+        finally:
+            self.wait_stats.record(time.perf_counter() - start)
+
+
+def pool_metrics(engine):
+    """Describe an engine's pool: in-use counts plus wait times if timed."""
+    pool = engine.pool
+    metrics = {'status': pool.status()}
+    if isinstance(pool, QueuePool):
+        metrics.update({
+            'size': pool.size(),
+            'checked_out': pool.checkedout(),
+            'checked_in': pool.checkedin(),
+            'overflow': pool.overflow(),
+        })
+    if isinstance(pool, TimedQueuePool):
+        metrics.update(pool.wait_stats.to_dict())
+    return metrics
@@ -0,0 +1,54 @@
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    DateTime,
+    ForeignKey,
+    Integer,
+    Unicode,
+)
+
+from .meta import Base
+from datetime import datetime
+from expense_tracker.money import DEFAULT_CURRENCY, from_cents
+
+FREQUENCIES = ('daily', 'weekly', 'monthly', 'yearly')
+
+
+class RecurrenceRule(Base):
+    """An expense that falls due every ``interval`` days, weeks, months
+    or years from ``starts_on``, until ``ends_on`` if that is set.
+
+    Occurrences become real expenses (with ``rule_id`` pointing back
+    here) a rolling window ahead; ``materialized_through`` is how far
+    that has got, so nothing before it is ever generated again. See
+    expense_tracker.recurrence.
+    """
+    __tablename__ = 'recurrence_rules'
+    id = Column(Integer, primary_key=True)
+    owner_id = Column(Integer, ForeignKey('users.id'), index=True)
+    title = Column(Unicode, nullable=False)
+    amount_cents = Column(BigInteger, nullable=False)
+    currency = Column(Unicode(3), nullable=False, default=DEFAULT_CURRENCY,
+                      server_default=DEFAULT_CURRENCY)
+    frequency = Column(Unicode(10), nullable=False)
+    interval = Column(Integer, nullable=False, default=1, server_default='1')
+    starts_on = Column(DateTime, nullable=False)
+    ends_on = Column(DateTime)
+    # high-water mark: every occurrence up to here exists in models
+    materialized_through = Column(DateTime, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'title': self.title,
+            'amount': from_cents(self.amount_cents),
+            'amount_cents': self.amount_cents,
+            'currency': self.currency,
+            'frequency': self.frequency,
+            'interval': self.interval,
+            'starts_on': self.starts_on,
+            'ends_on': self.ends_on,
+            'materialized_through': self.materialized_through,
+        }
@@ -0,0 +1,273 @@
+"""Per (owner, currency, month, title) counts and totals of expenses.
+
+``expense_totals`` holds one row per bucket so the totals reports read a
+row per bucket instead of scanning ``models``. It is kept up to date as
+deltas, in the same transaction as the change:
+
+- ORM writes are picked up by the session events ``track_totals`` hooks
+  up. Each flush adds its changes to the session's pending deltas, and
+  they are written once, at commit, so a hot bucket is only locked for
+  the end of the transaction.
+- Writes that skip the ORM (imports, bulk edits, recurring expenses)
+  call ``apply_deltas`` on their connection themselves, with deltas from
+  ``row_deltas`` or ``id_deltas``.
+
+``rebuild_totals`` recomputes the table from scratch; comparing
+``scan_totals`` with ``stored_totals`` checks it.
+"""
+from datetime import datetime
+
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    DateTime,
+    Index,
+    Integer,
+    Unicode,
+    and_,
+    bindparam,
+    event,
+    inspect,
+    select,
+)
+from sqlalchemy.dialects import postgresql
+
+from .meta import Base
+from .mymodel import Expense
+from expense_tracker.money import DEFAULT_CURRENCY
+
+# the bucket columns of Expense, in key order
+KEY_COLUMNS = ('owner_id', 'currency', 'due_date', 'title')
+# and of ExpenseTotal
+BUCKET_COLUMNS = ('owner_id', 'currency', 'month', 'title')
+
+
+class ExpenseTotal(Base):
+    """How many expenses fall in a bucket and what they add up to.
+
+    Buckets are keyed by non-NULL values: ``owner_id`` 0 stands for
+    expenses without an owner, ``month`` is yyyymm of the due date (0 when
+    there is none) and ``title`` is '' for untitled ones. Buckets that
+    empty out stay behind with a count of 0. ``updated_at`` (UTC) moves
+    whenever the bucket does, which makes it the Last-Modified of the
+    reports read from here.
+    """
+    __tablename__ = 'expense_totals'
+    __table_args__ = (
+        # a user's newest bucket change, which deletes move too
+        Index('ix_expense_totals_owner_id_updated_at', 'owner_id', 'updated_at'),
+    )
+    owner_id = Column(Integer, primary_key=True, autoincrement=False)
+    currency = Column(Unicode(3), primary_key=True)
+    month = Column(Integer, primary_key=True, autoincrement=False)
+    title = Column(Unicode, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    amount_cents = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+def bucket(owner_id, currency, due_date, title):
+    """The ExpenseTotal key of an expense with these values."""
+    return (
+        owner_id or 0,
+        currency or DEFAULT_CURRENCY,
+        due_date.year * 100 + due_date.month if due_date else 0,
+        title or '',
+    )
+
+
+def add_delta(deltas, key, count, cents):
+    delta = deltas.setdefault(key, [0, 0])
+    delta[0] += count
+    delta[1] += cents or 0
+
+
+def row_deltas(rows, sign=1, deltas=None):
+    """Deltas for inserting (or, with ``sign=-1``, deleting) the expense
+    rows given as dicts of column values."""
+    deltas = {} if deltas is None else deltas
+    for row in rows:
+        key = bucket(*(row.get(name) for name in KEY_COLUMNS))
+        add_delta(deltas, key, sign, sign * (row.get('amount_cents') or 0))
+    return deltas
+
+
+def id_deltas(connection, ids, sign=1, deltas=None):
+    """Deltas for the expenses with these ids as they are right now.
+
+    Take them with ``sign=-1`` before changing the rows and with
+    ``sign=1`` after, for statements that change many rows at once.
+    """
+    deltas = {} if deltas is None else deltas
+    table = Expense.__table__
+    rows = connection.execute(
+        select([table.c[name] for name in KEY_COLUMNS] + [table.c.amount_cents])
+        .where(table.c.id.in_(ids))
+    )
+    for owner_id, currency, due_date, title, cents in rows:
+        add_delta(deltas, bucket(owner_id, currency, due_date, title), sign, sign * (cents or 0))
+    return deltas
+
+
+def claim_deltas(connection, owner_id):
+    """Deltas for giving every expense without an owner to ``owner_id``,
+    worked out from the stored buckets rather than the expenses."""
+    deltas = {}
+    table = ExpenseTotal.__table__
+    for currency, month, title, count, cents in connection.execute(
+            select([table.c.currency, table.c.month, table.c.title,
+                    table.c.count, table.c.amount_cents])
+            .where(and_(table.c.owner_id == 0, table.c.count != 0))):
+        add_delta(deltas, (0, currency, month, title), -count, -cents)
+        add_delta(deltas, (owner_id, currency, month, title), count, cents)
+    return deltas
+
+
+def upsert_statement():
+    """INSERT ... ON CONFLICT that adds to a bucket (PostgreSQL)."""
+    table = ExpenseTotal.__table__
+    insert = postgresql.insert(table)
+    return insert.on_conflict_do_update(
+        index_elements=list(BUCKET_COLUMNS),
+        set_={
+            'count': table.c.count + insert.excluded.count,
+            'amount_cents': table.c.amount_cents + insert.excluded.amount_cents,
+            'updated_at': insert.excluded.updated_at,
+        }
+    )
+
+
+def update_statement():
+    """UPDATE that adds to a bucket if it is there (anywhere else)."""
+    table = ExpenseTotal.__table__
+    return table.update().where(and_(
+        *[table.c[name] == bindparam('key_' + name) for name in BUCKET_COLUMNS]
+    )).values(
+        count=table.c.count + bindparam('add_count'),
+        amount_cents=table.c.amount_cents + bindparam('add_cents'),
+        updated_at=bindparam('now'),
+    )
+
+
+def apply_deltas(connection, deltas):
+    """Add ``deltas`` to expense_totals on ``connection``.
+
+    Buckets are written in key order so that two transactions touching
+    the same buckets wait for each other rather than deadlock.
+    """
+    table = ExpenseTotal.__table__
+    now = datetime.utcnow()
+    rows = [
+        dict(zip(BUCKET_COLUMNS, key), count=deltas[key][0],
+             amount_cents=deltas[key][1], updated_at=now)
+        for key in sorted(deltas) if deltas[key] != [0, 0]
+    ]
+    if not rows:
+        return
+    if connection.dialect.name == 'postgresql':
+        connection.execute(STATEMENTS['upsert'], rows)
+        return
+    for row in rows:
+        params = {'key_' + name: row[name] for name in BUCKET_COLUMNS}
+        updated = connection.execute(
+            STATEMENTS['update'], add_count=row['count'], add_cents=row['amount_cents'],
+            now=now, **params)
+        if not updated.rowcount:
+            connection.execute(table.insert(), row)
+
+
+def old_values(session, obj):
+    """The bucket columns and amount of ``obj`` as last flushed."""
+    state = inspect(obj)
+    names = KEY_COLUMNS + ('amount_cents',)
+    values = []
+    for name in names:
+        history = state.attrs[name].history
+        if history.deleted:
+            values.append(history.deleted[0])
+        elif history.unchanged:
+            values.append(history.unchanged[0])
+        else:
+            # set without ever being loaded: read what is stored
+            table = Expense.__table__
+            return session.connection().execute(
+                select([table.c[n] for n in names]).where(table.c.id == obj.id)).first()
+    return values
+
+
+def count_changes(session, deltas):
+    """Add the Expense changes ``session`` is about to flush to ``deltas``."""
+    for obj in session.new:
+        if isinstance(obj, Expense):
+            add_delta(deltas, bucket(*(getattr(obj, n) for n in KEY_COLUMNS)),
+                      1, obj.amount_cents)
+    for obj in session.dirty:
+        if isinstance(obj, Expense) and session.is_modified(obj):
+            old = old_values(session, obj)
+            if old is None:
+                continue
+            add_delta(deltas, bucket(*old[:4]), -1, -(old[4] or 0))
+            add_delta(deltas, bucket(*(getattr(obj, n) for n in KEY_COLUMNS)),
+                      1, obj.amount_cents)
+    for obj in session.deleted:
+        if isinstance(obj, Expense):
+            old = old_values(session, obj)
+            if old is not None:
+                add_delta(deltas, bucket(*old[:4]), -1, -(old[4] or 0))
+
+
+def track_totals(session_factory):
+    """Hook a session factory up so its ORM writes keep expense_totals
+    current."""
+
+    def before_flush(session, flush_context, instances):
+        with session.no_autoflush:
+            count_changes(session, session.info.setdefault('expense_total_deltas', {}))
+
+    def before_commit(session):
+        # anything still pending is flushed (and counted) first
+        session.flush()
+        deltas = session.info.pop('expense_total_deltas', None)
+        if deltas:
+            apply_deltas(session.connection(), deltas)
+
+    def after_rollback(session):
+        session.info.pop('expense_total_deltas', None)
+
+    event.listen(session_factory, 'before_flush', before_flush)
+    event.listen(session_factory, 'before_commit', before_commit)
+    event.listen(session_factory, 'after_rollback', after_rollback)
+
+
+# built once: making them is most of the cost of a small write
+STATEMENTS = {'upsert': upsert_statement(), 'update': update_statement()}
+
+
+def rebuild_totals(connection):
+    """Recompute every bucket from ``models``; returns the bucket count."""
+    deltas = scan_totals(connection)
+    connection.execute(ExpenseTotal.__table__.delete())
+    apply_deltas(connection, deltas)
+    return len(deltas)
+
+
+def scan_totals(connection):
+    """Every bucket's (count, cents) worked out from ``models``."""
+    table = Expense.__table__
+    deltas = {}
+    rows = connection.execution_options(stream_results=True).execute(
+        select([table.c[name] for name in KEY_COLUMNS] + [table.c.amount_cents]))
+    for owner_id, currency, due_date, title, cents in rows:
+        add_delta(deltas, bucket(owner_id, currency, due_date, title), 1, cents)
+    return deltas
+
+
+def stored_totals(connection):
+    """Every non-empty bucket's (count, cents) as stored."""
+    table = ExpenseTotal.__table__
+    return {
+        (owner_id, currency, month, title): [count, cents]
+        for owner_id, currency, month, title, count, cents in connection.execute(
+            select([table.c.owner_id, table.c.currency, table.c.month, table.c.title,
+                    table.c.count, table.c.amount_cents]).where(table.c.count != 0))
+    }
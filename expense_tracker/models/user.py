@@ -0,0 +1,19 @@
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Integer,
+    Unicode,
+)
+
+from .meta import Base
+from datetime import datetime
+
+
+class User(Base):
+    """Someone who can log in and own expenses."""
+    __tablename__ = 'users'
+    id = Column(Integer, primary_key=True)
+    username = Column(Unicode(255), nullable=False, unique=True)
+    # passlib hash; see security.PasswordVerifier
+    password_hash = Column(Unicode(255), nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
@@ -0,0 +1,65 @@
+"""Money as an integer count of minor units (cents) and a currency code.
+
+Amounts are stored, summed, compared and sorted as integers; they only
+become Decimals at the edges, and never floats.
+"""
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+
+from sqlalchemy.types import BigInteger, TypeDecorator
+
+# the pages have always shown amounts in pounds
+DEFAULT_CURRENCY = 'GBP'
+CENT = Decimal('0.01')
+# what fits in the BigInteger column
+MAX_CENTS = 2 ** 63 - 1
+MIN_CENTS = -2 ** 63
+
+
+def to_cents(value):
+    """Turn ``'12.5'``, ``12.5`` or ``Decimal('12.50')`` into 1250.
+
+    Sub-cent digits are rounded half up. Raises ValueError for anything
+    that isn't a finite number, or is too big for the amount column.
+    """
+    if isinstance(value, float):
+        value = repr(value)  # the shortest decimal that round-trips
+    try:
+        amount = Decimal(str(value).strip())
+        if not amount.is_finite():
+            raise ValueError('bad amount {!r}'.format(value))
+        cents = int(amount.quantize(CENT, rounding=ROUND_HALF_UP).scaleb(2))
+    except InvalidOperation:
+        raise ValueError('bad amount {!r}'.format(value))
+    if not MIN_CENTS <= cents <= MAX_CENTS:
+        raise ValueError('amount out of range {!r}'.format(value))
+    return cents
+
+
+def from_cents(cents):
+    """1250 -> Decimal('12.50'); None stays None."""
+    if cents is None:
+        return None
+    return Decimal(cents).scaleb(-2)
+
+
+def parse_currency(value):
+    """Validate a three letter ISO 4217 code, e.g. ``'gbp'`` -> ``'GBP'``."""
+    if not isinstance(value, str):
+        raise ValueError('bad currency {!r}'.format(value))
+    code = value.strip().upper()
+    # ASCII only: other letters upper-case to three "letters" too
+    if len(code) != 3 or not (code.isascii() and code.isalpha()):
+        raise ValueError('bad currency {!r}'.format(value))
+    return code
+
+
+class Cents(TypeDecorator):
+    """Integer cents in the database, Decimal amounts in Python."""
+    impl = BigInteger
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return None if value is None else to_cents(value)
+
+    def process_result_value(self, value, dialect):
+        return from_cents(value)
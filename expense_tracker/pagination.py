@@ -0,0 +1,99 @@
+"""Keyset (seek) pagination for expense queries.
+
+Instead of OFFSET, each page remembers the sort value and id of its last
+row in an opaque ``after`` cursor, and the next page starts strictly after
+that pair. With an index on ``(sort column, id)`` every page costs the
+same no matter how deep into the table it is.
+"""
+import base64
+import json
+from datetime import datetime
+from decimal import Decimal
+
+from sqlalchemy import and_, or_
+from sqlalchemy.types import TypeDecorator
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+
+def parse_limit(value, default=DEFAULT_LIMIT, maximum=MAX_LIMIT):
+    """Turn a ``limit`` query parameter into an int between 1 and maximum.
+
+    Raises ValueError for anything that is not a positive integer.
+    """
+    if value in (None, ''):
+        return default
+    limit = int(value)
+    if limit < 1:
+        raise ValueError('limit must be positive')
+    return min(limit, maximum)
+
+
+def encode_cursor(value, row_id):
+    """Build the opaque cursor pointing just past (value, row_id)."""
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([value, row_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor, column):
+    """Unpack a cursor made by encode_cursor for the given sort column.
+
+    Returns None for an empty cursor and raises ValueError for a bad one.
+    """
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii'))
+        value, row_id = json.loads(raw.decode('utf-8'))
+    except (TypeError, ValueError, UnicodeError):
+        raise ValueError('malformed cursor')
+    if not isinstance(row_id, int) or isinstance(row_id, bool):
+        raise ValueError('malformed cursor')
+    if value is not None:
+        value = cursor_value(value, column)
+    return value, row_id
+
+
+def cursor_value(value, column):
+    """``value`` as something ``column`` can be compared with, or
+    ValueError if it is the wrong kind of JSON value for it."""
+    column_type = column.type
+    if isinstance(column_type, TypeDecorator):
+        column_type = column_type.impl
+    expected = column_type.python_type
+    if expected is datetime:
+        ok = isinstance(value, str)
+    elif expected is int:
+        ok = isinstance(value, int) and not isinstance(value, bool)
+    elif expected in (float, Decimal):
+        ok = isinstance(value, (int, float)) and not isinstance(value, bool)
+    else:
+        ok = isinstance(value, expected)
+    if not ok:
+        raise ValueError('malformed cursor')
+    return datetime.fromisoformat(value) if expected is datetime else value
+
+
+def seek(query, column, id_column, after=None, descending=False):
+    """Order a query by (column, id) and start it after the given cursor.
+
+    ``after`` is the (value, id) pair returned by decode_cursor.
+    """
+    if after is not None:
+        value, row_id = after
+        if descending:
+            query = query.filter(or_(
+                column < value,
+                and_(column == value, id_column < row_id)
+            ))
+        else:
+            query = query.filter(or_(
+                column > value,
+                and_(column == value, id_column > row_id)
+            ))
+    if descending:
+        return query.order_by(column.desc(), id_column.desc())
+    return query.order_by(column, id_column)
@@ -0,0 +1,200 @@
+"""Per-request timing: SQL, template rendering, password checks, total.
+
+A tween times each request while SQLAlchemy cursor events, a BeforeRender
+subscriber and a view deriver fill in where the time went. Each
+response gets a ``Server-Timing`` header, slow requests and statements
+repeated within one request (the N+1 pattern) are logged, running totals
+per route are kept for /api/metrics, and a sample of requests can be run
+under cProfile with the output dumped to disk.
+
+Settings (all optional):
+
+``profiling.enabled``                 default true
+``profiling.slow_request_ms``         log requests slower than this, default 500
+``profiling.n_plus_one_threshold``    log statements repeated this often, default 10
+``profiling.cprofile_sample_rate``    fraction of requests to profile, default 0
+``profiling.cprofile_dir``            where .prof files go, default the cwd
+"""
+import cProfile
+import logging
+import os
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from pyramid.events import BeforeRender
+from pyramid.settings import asbool
+from pyramid.tweens import INGRESS
+from sqlalchemy import event
+
+log = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+class RequestStats(object):
+    """What one request spent its time on."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.timers = defaultdict(float)
+        self.query_count = 0
+        self.statements = Counter()
+        self.render_start = None
+
+    def add(self, name, seconds):
+        self.timers[name] += seconds
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def server_timing(self, total):
+        parts = ['db;dur={:.1f};desc="{} queries"'.format(
+            self.timers['db'] * 1000, self.query_count)]
+        for name in sorted(self.timers):
+            if name != 'db':
+                parts.append('{};dur={:.1f}'.format(name, self.timers[name] * 1000))
+        parts.append('total;dur={:.1f}'.format(total * 1000))
+        return ', '.join(parts)
+
+
+class RouteStats(object):
+    """Running totals per route, thread-safe."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = defaultdict(lambda: defaultdict(float))
+
+    def record(self, route, stats, total):
+        with self._lock:
+            route_stats = self._routes[route]
+            route_stats['requests'] += 1
+            route_stats['queries'] += stats.query_count
+            route_stats['total_ms'] += total * 1000
+            for name, seconds in stats.timers.items():
+                route_stats[name + '_ms'] += seconds * 1000
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                route: {key: round(value, 3) for key, value in totals.items()}
+                for route, totals in self._routes.items()
+            }
+
+
+def current_stats():
+    """The RequestStats for the request running on this thread, if any."""
+    return getattr(_local, 'stats', None)
+
+
+@contextmanager
+def timed(name):
+    """Add the time spent in the block to the current request's ``name``."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats = current_stats()
+        if stats is not None:
+            stats.add(name, time.perf_counter() - start)
+
+
+def route_name(request):
+    route = getattr(request, 'matched_route', None)
+    return route.name if route is not None else 'notfound'
+
+
+def profiling_tween_factory(handler, registry):
+    settings = registry.settings
+    slow = float(settings.get('profiling.slow_request_ms', 500)) / 1000
+    n_plus_one = int(settings.get('profiling.n_plus_one_threshold', 10))
+    sample_rate = float(settings.get('profiling.cprofile_sample_rate', 0))
+    profile_dir = settings.get('profiling.cprofile_dir', os.getcwd())
+    route_stats = registry['route_stats']
+
+    def profiling_tween(request):
+        stats = _local.stats = RequestStats()
+        profiler = None
+        if sample_rate and random.random() < sample_rate:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        try:
+            response = handler(request)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            _local.stats = None
+        total = stats.elapsed()
+        route = route_name(request)
+
+        response.headers['Server-Timing'] = stats.server_timing(total)
+        route_stats.record(route, stats, total)
+        if total >= slow:
+            log.warning(
+                'slow request %s %s (%s): %.1fms total, %d queries in %.1fms',
+                request.method, request.path, route, total * 1000,
+                stats.query_count, stats.timers['db'] * 1000)
+        for statement, count in stats.statements.items():
+            if count >= n_plus_one:
+                log.warning(
+                    'possible N+1 in %s: statement ran %d times: %s',
+                    route, count, ' '.join(statement.split())[:200])
+        if profiler is not None:
+            path = os.path.join(profile_dir, '{}-{:.0f}.prof'.format(route, time.time() * 1000))
+            profiler.dump_stats(path)
+            log.info('wrote profile for %s to %s', request.path, path)
+        return response
+
+    return profiling_tween
+
+
+def instrument_engine(engine):
+    """Time every statement the engine runs against the current request."""
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_start'].pop()
+        stats = current_stats()
+        if stats is not None:
+            stats.add('db', elapsed)
+            stats.query_count += 1
+            stats.statements[statement] += 1
+
+
+def before_render(event):
+    stats = current_stats()
+    if stats is not None:
+        stats.render_start = time.perf_counter()
+
+
+def render_timing(view, info):
+    """View deriver that sits just outside the renderer and stops the
+    clock BeforeRender started."""
+    def render_timed_view(context, request):
+        response = view(context, request)
+        stats = current_stats()
+        if stats is not None and stats.render_start is not None:
+            stats.add('render', time.perf_counter() - stats.render_start)
+            stats.render_start = None
+        return response
+    return render_timed_view
+
+
+def includeme(config):
+    """Install the profiling tween. Include after expense_tracker.models."""
+    settings = config.get_settings()
+    if not asbool(settings.get('profiling.enabled', True)):
+        return
+    config.registry['route_stats'] = RouteStats()
+    for engine in config.registry['db_engines'].values():
+        instrument_engine(engine)
+    config.add_subscriber(before_render, BeforeRender)
+    config.add_view_deriver(render_timing)
+    # outermost, so the total includes pyramid_tm's commit
+    config.add_tween('expense_tracker.profiling.profiling_tween_factory', under=INGRESS)
@@ -0,0 +1,163 @@
+"""Turn recurrence rules into expenses, a rolling window at a time.
+
+``materialize`` inserts each rule's occurrences up to ``horizon_days``
+ahead and records how far it got in ``materialized_through``; later runs
+start just after that, so history is never generated twice and a
+missed run is caught up by the next one. ``projected`` works out the
+occurrences past that mark for any date range without storing them,
+for reports that look further ahead than the window.
+
+Occurrence n of a rule is computed directly from ``starts_on``, so
+finding the first one in a range doesn't walk the ones before it.
+Monthly and yearly rules keep the day of the month they started on,
+clamped to the end of shorter months (Jan 31, Feb 28, Mar 31...).
+"""
+import calendar
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_
+
+from expense_tracker.models import Expense, RecurrenceRule
+from expense_tracker.models.recurrence import FREQUENCIES
+from expense_tracker.models.totals import apply_deltas, row_deltas
+
+DEFAULT_HORIZON_DAYS = 60
+MAX_INTERVAL = 1000
+MONTHS = {'monthly': 1, 'yearly': 12}
+DAYS = {'daily': 1, 'weekly': 7}
+
+
+def add_months(when, months):
+    month = when.month - 1 + months
+    year = when.year + month // 12
+    month = month % 12 + 1
+    day = min(when.day, calendar.monthrange(year, month)[1])
+    return when.replace(year=year, month=month, day=day)
+
+
+def occurrence(rule, n):
+    """The due date of the ``n``th (0-based) occurrence of ``rule``."""
+    if rule.frequency in DAYS:
+        return rule.starts_on + timedelta(days=n * rule.interval * DAYS[rule.frequency])
+    return add_months(rule.starts_on, n * rule.interval * MONTHS[rule.frequency])
+
+
+def first_index(rule, when):
+    """The index of the first occurrence on or after ``when``."""
+    if when <= rule.starts_on:
+        return 0
+    if rule.frequency in DAYS:
+        step = timedelta(days=rule.interval * DAYS[rule.frequency])
+        n = (when - rule.starts_on) // step
+    else:
+        step = rule.interval * MONTHS[rule.frequency]
+        months = (when.year - rule.starts_on.year) * 12 + when.month - rule.starts_on.month
+        n = max(0, months // step - 1)
+    while occurrence(rule, n) < when:
+        n += 1
+    return n
+
+
+def occurrences(rule, start, end):
+    """Due dates of ``rule`` in [start, end), also bounded by ``ends_on``."""
+    if rule.ends_on is not None:
+        end = min(end, rule.ends_on + timedelta(microseconds=1))
+    n = first_index(rule, start)
+    while True:
+        try:
+            due = occurrence(rule, n)
+        except (OverflowError, ValueError):
+            return  # past datetime.max, so past any end
+        if due >= end:
+            return
+        yield due
+        n += 1
+
+
+def next_start(rule):
+    """Where generation picks up: just after the high-water mark."""
+    if rule.materialized_through is None:
+        return rule.starts_on
+    return rule.materialized_through + timedelta(microseconds=1)
+
+
+def validate_rule(rule):
+    """Raise ValueError unless ``rule`` can generate occurrences."""
+    if rule.frequency not in FREQUENCIES:
+        raise ValueError('frequency must be one of {}'.format(', '.join(FREQUENCIES)))
+    if (not isinstance(rule.interval, int) or isinstance(rule.interval, bool)
+            or not 1 <= rule.interval <= MAX_INTERVAL):
+        raise ValueError('interval must be an integer from 1 to {}'.format(MAX_INTERVAL))
+    if rule.ends_on is not None and rule.ends_on < rule.starts_on:
+        raise ValueError('ends_on is before starts_on')
+    try:
+        occurrence(rule, 1)
+    except (OverflowError, ValueError):
+        raise ValueError('starts_on is too far ahead')
+
+
+def materialize_rule(connection, rule, through, now, utcnow):
+    """Insert ``rule``'s occurrences up to and including ``through``.
+
+    A rule that hasn't been materialised yet starts from the day of
+    ``now`` at the earliest, rather than filling in its history. Returns
+    the number of expenses inserted. Moves the rule's high-water mark;
+    the caller commits.
+    """
+    start = next_start(rule)
+    if rule.materialized_through is None:
+        start = max(start, now.replace(hour=0, minute=0, second=0, microsecond=0))
+    rows = [
+        {
+            'owner_id': rule.owner_id,
+            'rule_id': rule.id,
+            'title': rule.title,
+            'amount_cents': rule.amount_cents,
+            'currency': rule.currency,
+            'due_date': due,
+            'creation_date': now,
+            'updated_at': utcnow,
+        }
+        for due in occurrences(rule, start, through + timedelta(microseconds=1))
+    ]
+    if rows:
+        connection.execute(Expense.__table__.insert(), rows)
+        apply_deltas(connection, row_deltas(rows))
+    if rule.materialized_through is None or through > rule.materialized_through:
+        rule.materialized_through = through
+    return len(rows)
+
+
+def due_rules(session, through):
+    """Rules with occurrences left to generate up to ``through``, locked."""
+    return session.query(RecurrenceRule).filter(
+        or_(RecurrenceRule.materialized_through.is_(None),
+            RecurrenceRule.materialized_through < through),
+        or_(RecurrenceRule.ends_on.is_(None),
+            RecurrenceRule.materialized_through.is_(None),
+            RecurrenceRule.ends_on > RecurrenceRule.materialized_through),
+    ).order_by(RecurrenceRule.id).with_for_update()
+
+
+def materialize(session, horizon_days=DEFAULT_HORIZON_DAYS, now=None):
+    """Generate every rule's occurrences up to ``horizon_days`` from now.
+
+    Rows go in through Core on ``session``'s connection in the caller's
+    transaction. Returns the number of expenses inserted.
+    """
+    now = now or datetime.now()
+    through = now + timedelta(days=horizon_days)
+    connection = session.connection()
+    utcnow = datetime.utcnow()
+    return sum(
+        materialize_rule(connection, rule, through, now, utcnow)
+        for rule in due_rules(session, through)
+    )
+
+
+def projected(rules, start, end):
+    """(rule, due date) for the occurrences in [start, end) that haven't
+    been materialised yet, in no particular order."""
+    for rule in rules:
+        for due in occurrences(rule, max(start, next_start(rule)), end):
+            yield rule, due
@@ -0,0 +1,54 @@
+"""Renderer setup shared by the HTML views and the JSON API.
+
+The ``json`` renderer encodes with orjson when it is installed (the
+``fastjson`` extra) and with the standard library otherwise. Either way
+it calls one plain ``default`` function for the types the stdlib can't
+encode, rather than looking an adapter up in the registry each time.
+"""
+import json
+from datetime import date
+from decimal import Decimal
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+
+def default(obj):
+    """Encode the types our queries hand back that JSON doesn't have."""
+    if isinstance(obj, date):
+        return obj.isoformat()
+    if isinstance(obj, Decimal):
+        # JSON has no decimal type; amount_cents is there for exact values
+        return float(obj)
+    raise TypeError('{!r} is not JSON serializable'.format(obj))
+
+
+if orjson is not None:
+    def dumps(value):
+        # orjson encodes datetimes itself, the same way isoformat() does
+        return orjson.dumps(value, default=default, option=orjson.OPT_NON_STR_KEYS)
+else:
+    def dumps(value):
+        return json.dumps(value, default=default, separators=(',', ':')).encode('utf-8')
+
+
+class FastJSON(object):
+    """Renderer factory for ``renderer='json'``; returns utf-8 bytes."""
+
+    def __init__(self, info):
+        pass
+
+    def __call__(self, value, system):
+        request = system.get('request')
+        if request is not None:
+            response = request.response
+            if response.content_type == response.default_content_type:
+                response.content_type = 'application/json'
+        return dumps(value)
+
+
+def includeme(config):
+    """Register the json renderer."""
+    config.add_renderer('json', FastJSON)
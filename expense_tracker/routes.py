@@ -1,10 +1,29 @@
+# routes about a single expense get its owner's ACL
+EXPENSE = 'expense_tracker.security.ExpenseResource'
+
+
 def includeme(config):
     config.add_static_view('static', 'static', cache_max_age=3600)
     config.add_route('home', '/')
-    config.add_route('detail', '/expenses/{id:\d+}')
+    config.add_route('detail', '/expenses/{id:\d+}', factory=EXPENSE)
     config.add_route('create', '/expenses/new-expense')
-    config.add_route('update', '/expenses/{id:\d+}/edit')
-    config.add_route('delete', '/expenses/{id:\d+}/delete')
-    config.add_route('api_detail', '/api/expenses/{id:\d+}')
+    config.add_route('search', '/expenses/search')
+    config.add_route('import', '/expenses/import')
+    config.add_route('update', '/expenses/{id:\d+}/edit', factory=EXPENSE)
+    config.add_route('delete', '/expenses/{id:\d+}/delete', factory=EXPENSE)
+    config.add_route('api_list', '/api/expenses')
+    config.add_route('export', '/api/expenses/export.{format:csv|ndjson|columnar}')
+    config.add_route('api_detail', '/api/expenses/{id:\d+}', factory=EXPENSE)
+    config.add_route('api_bulk_update', '/api/expenses/bulk-update')
+    config.add_route('api_bulk_delete', '/api/expenses/bulk-delete')
+    config.add_route('api_search', '/api/expenses/search')
+    config.add_route('api_recurring', '/api/recurring')
+    config.add_route('api_csrf', '/api/csrf-token')
+    config.add_route('api_totals_monthly', '/api/expenses/totals/monthly')
+    config.add_route('api_totals_titles', '/api/expenses/totals/titles')
+    config.add_route('api_upcoming', '/api/expenses/upcoming')
+    config.add_route('api_job', '/api/jobs/{id:\d+}')
+    config.add_route('api_job_result', '/api/jobs/{id:\d+}/result')
+    config.add_route('metrics', '/api/metrics')
     config.add_route('login', '/login')
     config.add_route('logout', '/logout')
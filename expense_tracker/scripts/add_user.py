@@ -0,0 +1,80 @@
+"""Create a user, or reset an existing user's password.
+
+usage: add_user <config_uri> <username> [--claim] [var=value]
+
+The password is prompted for, or read from the first line of stdin when
+it isn't a terminal. With --claim, every expense that has no owner yet
+(everything created before there were users) is given to this user.
+"""
+import argparse
+import getpass
+import os
+import sys
+import transaction
+
+from passlib.apps import custom_app_context as pwd_context
+from pyramid.paster import (
+    get_appsettings,
+    setup_logging,
+    )
+
+from pyramid.scripts.common import parse_vars
+
+from ..models import (
+    Expense,
+    User,
+    get_engine,
+    get_session_factory,
+    get_tm_session,
+    )
+from ..models.totals import apply_deltas, claim_deltas
+
+
+def read_password():
+    if not sys.stdin.isatty():
+        return sys.stdin.readline().rstrip('\n')
+    password = getpass.getpass('Password: ')
+    if password != getpass.getpass('Again: '):
+        sys.exit('passwords do not match')
+    return password
+
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(
+        prog=os.path.basename(argv[0]),
+        description='Create a user, or reset their password.'
+    )
+    parser.add_argument('config_uri')
+    parser.add_argument('username')
+    parser.add_argument('--claim', action='store_true',
+                        help='give every unowned expense to this user')
+    args, extra = parser.parse_known_args(argv[1:])
+    options = parse_vars(extra)
+    setup_logging(args.config_uri)
+    settings = get_appsettings(args.config_uri, options=options)
+    settings['sqlalchemy.url'] = os.environ['DATABASE_URL']
+
+    password = read_password()
+    if not password:
+        sys.exit('empty password')
+    password_hash = pwd_context.hash(password)
+
+    session_factory = get_session_factory(get_engine(settings))
+    with transaction.manager:
+        dbsession = get_tm_session(session_factory, transaction.manager)
+        user = dbsession.query(User).filter(User.username == args.username).first()
+        if user is None:
+            user = User(username=args.username, password_hash=password_hash)
+            dbsession.add(user)
+            dbsession.flush()
+            print('created user {}'.format(args.username), file=sys.stderr)
+        else:
+            user.password_hash = password_hash
+            print('reset the password of {}'.format(args.username), file=sys.stderr)
+        if args.claim:
+            connection = dbsession.connection()
+            apply_deltas(connection, claim_deltas(connection, user.id))
+            claimed = dbsession.query(Expense).filter(Expense.owner_id.is_(None)).update(
+                {'owner_id': user.id}, synchronize_session=False)
+            print('gave {} unowned expenses to {}'.format(claimed, args.username),
+                  file=sys.stderr)
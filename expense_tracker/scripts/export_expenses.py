@@ -0,0 +1,47 @@
+"""Stream the models table out as CSV, NDJSON or columnar binary.
+
+usage: export_expenses <config_uri> [--format csv|ndjson|columnar]
+                       [--output path] [var=value]
+
+Writes to stdout unless --output is given.
+"""
+import argparse
+import os
+import sys
+
+from pyramid.paster import (
+    get_appsettings,
+    setup_logging,
+    )
+
+from pyramid.scripts.common import parse_vars
+
+from ..exporter import ENCODERS, export_statement, iter_chunks
+from ..models import get_engine
+
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(
+        prog=os.path.basename(argv[0]),
+        description='Stream the expenses table to a file.'
+    )
+    parser.add_argument('config_uri')
+    parser.add_argument('--format', choices=sorted(ENCODERS), default='csv')
+    parser.add_argument('--output', help='file to write, defaults to stdout')
+    args, extra = parser.parse_known_args(argv[1:])
+    options = parse_vars(extra)
+    setup_logging(args.config_uri)
+    settings = get_appsettings(args.config_uri, options=options)
+    settings['sqlalchemy.url'] = os.environ['DATABASE_URL']
+
+    engine = get_engine(settings)
+    if args.output:
+        out = open(args.output, 'wb')
+    else:
+        out = sys.stdout.buffer
+    with engine.connect() as connection:
+        for data in ENCODERS[args.format](iter_chunks(connection, export_statement())):
+            out.write(data)
+    out.flush()
+    if args.output:
+        out.close()
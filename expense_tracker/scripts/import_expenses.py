@@ -0,0 +1,82 @@
+"""Bulk load expenses from a CSV or NDJSON file.
+
+usage: import_expenses <config_uri> <path or -> [--format csv|ndjson]
+                       [--batch-size N] [--owner username] [var=value]
+
+CSV files need a header row with title, amount and due_date columns
+(and optionally currency, GBP if missing); NDJSON files hold one object
+with the same keys per line. Each batch is
+committed as it is written, and progress goes to stderr. Without --owner
+the expenses are unowned, which everyone can see.
+"""
+import argparse
+import os
+import sys
+
+from pyramid.paster import (
+    get_appsettings,
+    setup_logging,
+    )
+
+from pyramid.scripts.common import parse_vars
+from sqlalchemy import select
+
+from ..importer import (
+    DEFAULT_BATCH_SIZE,
+    FORMATS,
+    guess_format,
+    import_expenses,
+    )
+from ..models import User, get_engine
+
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(
+        prog=os.path.basename(argv[0]),
+        description='Bulk load expenses from a CSV or NDJSON file.'
+    )
+    parser.add_argument('config_uri')
+    parser.add_argument('path', help='file to import, or - for stdin')
+    parser.add_argument('--format', choices=FORMATS)
+    parser.add_argument('--batch-size', type=int)
+    parser.add_argument('--owner', help='username to import the expenses for')
+    args, extra = parser.parse_known_args(argv[1:])
+    options = parse_vars(extra)
+    setup_logging(args.config_uri)
+    settings = get_appsettings(args.config_uri, options=options)
+    settings['sqlalchemy.url'] = os.environ['DATABASE_URL']
+
+    batch_size = args.batch_size or int(
+        settings.get('import.batch_size', DEFAULT_BATCH_SIZE))
+    fmt = args.format or guess_format(args.path)
+    if args.path == '-':
+        stream = sys.stdin
+    else:
+        stream = open(args.path, newline='', encoding='utf-8')
+
+    def progress(report):
+        print(report, file=sys.stderr)
+
+    engine = get_engine(settings)
+    with stream, engine.connect() as connection:
+        owner_id = None
+        if args.owner:
+            owner_id = connection.scalar(
+                select([User.id]).where(User.username == args.owner))
+            if owner_id is None:
+                sys.exit('no user called {}'.format(args.owner))
+        trans = connection.begin()
+
+        def commit():
+            nonlocal trans
+            trans.commit()
+            trans = connection.begin()
+
+        report = import_expenses(
+            connection, stream, fmt, batch_size, progress=progress, commit=commit,
+            owner_id=owner_id)
+        trans.commit()
+
+    print('done: {}'.format(report), file=sys.stderr)
+    for error in report.errors:
+        print(error, file=sys.stderr)
@@ -2,6 +2,9 @@ import os
 import sys
 import transaction
 
+from alembic import command
+from alembic.config import Config
+
 from pyramid.paster import (
     get_appsettings,
     setup_logging,
@@ -9,13 +12,12 @@ from pyramid.paster import (
 
 from pyramid.scripts.common import parse_vars
 
-from ..models.meta import Base
 from ..models import (
     get_engine,
     get_session_factory,
     get_tm_session,
     )
-from ..models import Expense
+from ..models import Expense, RecurrenceRule
 from datetime import datetime
 
 
@@ -37,6 +39,10 @@ EXPENSES = [
     {'id': 5, 'title': 'Internet', 'amount': 100, 'due_date': datetime.strptime('11/12/2017', FMT)},
 ]
 
+# the seed expenses that come round every month; each seed row is its
+# rule's first occurrence, so materialize_recurring carries on after it
+MONTHLY = ('Rent', 'Phone Bill', 'Internet')
+
 
 def main(argv=sys.argv):
     if len(argv) < 2:
@@ -48,23 +54,40 @@ def main(argv=sys.argv):
     # Point to your environment's database URL before the engine is created
     settings['sqlalchemy.url'] = os.environ['DATABASE_URL']
 
-    engine = get_engine(settings)
-    Base.metadata.drop_all(engine)  # drop all existing tables from this database
-    Base.metadata.create_all(engine)  # make new tables based on whatever inherits from the Base class
+    # bring the schema up to date without throwing away existing rows
+    command.upgrade(Config(config_uri.split('#')[0]), 'head')
 
     # ---- NOTHING BELOW THIS POINT IS NECESSARY UNLESS YOU WANT TO START WITH A NEW MODEL INSTANCE -----
+    engine = get_engine(settings)
     session_factory = get_session_factory(engine)
 
     with transaction.manager:
         dbsession = get_tm_session(session_factory, transaction.manager)
+        if dbsession.query(Expense.id).first() is not None:
+            return  # only seed an empty database
+
+        rules = {}
+        for expense in EXPENSES:
+            if expense['title'] in MONTHLY:
+                rules[expense['title']] = RecurrenceRule(
+                    title=expense['title'],
+                    amount_cents=expense['amount'] * 100,
+                    frequency='monthly',
+                    starts_on=expense['due_date'],
+                    materialized_through=expense['due_date']
+                )
+        dbsession.add_all(rules.values())
+        dbsession.flush()
 
         all_expenses = []
         for expense in EXPENSES:
+            rule = rules.get(expense['title'])
             all_expenses.append(
                 Expense(
                     title=expense['title'],
                     amount=expense['amount'],
-                    due_date=expense['due_date']
+                    due_date=expense['due_date'],
+                    rule_id=rule.id if rule is not None else None
                 )
             )
         dbsession.add_all(all_expenses)
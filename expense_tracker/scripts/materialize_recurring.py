@@ -0,0 +1,54 @@
+"""Generate the expenses recurrence rules have coming up.
+
+usage: materialize_recurring <config_uri> [--days N] [var=value]
+
+Meant to run from cron (daily is plenty). Each rule gets its occurrences
+up to N days ahead (``recurring.horizon_days``, default 60) inserted as
+expenses, once; running it again only adds what has come into the
+window since. Rules are locked while they are worked on, so overlapping
+runs don't double up. Cached list pages pick the new rows up when their
+``cache.ttl`` runs out.
+"""
+import argparse
+import os
+import sys
+
+import transaction
+from pyramid.paster import (
+    get_appsettings,
+    setup_logging,
+    )
+from pyramid.scripts.common import parse_vars
+from zope.sqlalchemy import mark_changed
+
+from ..models import (
+    get_engine,
+    get_session_factory,
+    get_tm_session,
+    )
+from ..recurrence import DEFAULT_HORIZON_DAYS, materialize
+
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(
+        prog=os.path.basename(argv[0]),
+        description='Insert the next occurrences of every recurring expense.'
+    )
+    parser.add_argument('config_uri')
+    parser.add_argument('--days', type=int, default=None,
+                        help='how far ahead to generate (default recurring.horizon_days)')
+    args, extra = parser.parse_known_args(argv[1:])
+    options = parse_vars(extra)
+    setup_logging(args.config_uri)
+    settings = get_appsettings(args.config_uri, options=options)
+    settings['sqlalchemy.url'] = os.environ['DATABASE_URL']
+    days = args.days
+    if days is None:
+        days = int(settings.get('recurring.horizon_days', DEFAULT_HORIZON_DAYS))
+
+    session_factory = get_session_factory(get_engine(settings))
+    with transaction.manager:
+        dbsession = get_tm_session(session_factory, transaction.manager)
+        inserted = materialize(dbsession, days)
+        mark_changed(dbsession)
+    print('inserted {} expenses'.format(inserted), file=sys.stderr)
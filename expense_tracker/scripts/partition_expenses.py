@@ -0,0 +1,91 @@
+"""Turn the models table into one hash partitioned by owner (PostgreSQL).
+
+usage: partition_expenses <config_uri> [--partitions N] [var=value]
+
+Every expense must have an owner first (see ``add_user --claim``), since
+owner_id becomes part of the primary key. The table is rebuilt in one
+transaction under an exclusive lock, so run it in a maintenance window.
+Queries for one user's expenses then only touch that user's partition.
+There is no script to undo it.
+"""
+import argparse
+import os
+import sys
+
+from pyramid.paster import (
+    get_appsettings,
+    setup_logging,
+    )
+
+from pyramid.scripts.common import parse_vars
+
+from ..models import Expense, get_engine
+from ..search import TITLE_VECTOR_INDEX
+
+
+def is_partitioned(connection):
+    return connection.scalar("SELECT relkind = 'p' FROM pg_class WHERE oid = 'models'::regclass")
+
+
+def partition(connection, partitions):
+    """Rebuild models as ``partitions`` hash partitions of owner_id."""
+    connection.execute('LOCK TABLE models IN ACCESS EXCLUSIVE MODE')
+    # keep the id sequence alive while its table is dropped
+    connection.execute('ALTER SEQUENCE models_id_seq OWNED BY NONE')
+    connection.execute(
+        'CREATE TABLE models_partitioned (LIKE models INCLUDING DEFAULTS)'
+        ' PARTITION BY HASH (owner_id)')
+    for remainder in range(partitions):
+        connection.execute(
+            'CREATE TABLE models_p{0} PARTITION OF models_partitioned'
+            ' FOR VALUES WITH (MODULUS {1}, REMAINDER {0})'.format(remainder, partitions))
+    connection.execute('INSERT INTO models_partitioned SELECT * FROM models')
+    connection.execute('DROP TABLE models')
+    connection.execute('ALTER TABLE models_partitioned RENAME TO models')
+    connection.execute('ALTER SEQUENCE models_id_seq OWNED BY models.id')
+    connection.execute('ALTER TABLE models ALTER COLUMN owner_id SET NOT NULL')
+    # unique constraints on a partitioned table must include its key
+    connection.execute('ALTER TABLE models ADD CONSTRAINT pk_models PRIMARY KEY (owner_id, id)')
+    connection.execute(
+        'ALTER TABLE models ADD CONSTRAINT fk_models_owner_id_users'
+        ' FOREIGN KEY (owner_id) REFERENCES users (id)')
+    connection.execute(
+        'ALTER TABLE models ADD CONSTRAINT fk_models_rule_id_recurrence_rules'
+        ' FOREIGN KEY (rule_id) REFERENCES recurrence_rules (id)')
+    for index in Expense.__table__.indexes:
+        index.create(connection)
+    # lookups by id alone can no longer use the primary key
+    connection.execute('CREATE INDEX ix_models_id ON models (id)')
+    connection.execute(TITLE_VECTOR_INDEX)
+    if connection.scalar("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'"):
+        connection.execute(
+            'CREATE INDEX ix_models_title_trgm ON models USING gin (title gin_trgm_ops)')
+
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(
+        prog=os.path.basename(argv[0]),
+        description='Hash partition the expenses table by owner.'
+    )
+    parser.add_argument('config_uri')
+    parser.add_argument('--partitions', type=int, default=16)
+    args, extra = parser.parse_known_args(argv[1:])
+    options = parse_vars(extra)
+    setup_logging(args.config_uri)
+    settings = get_appsettings(args.config_uri, options=options)
+    settings['sqlalchemy.url'] = os.environ['DATABASE_URL']
+    settings.pop('sqlalchemy.statement_timeout', None)  # copying takes a while
+
+    engine = get_engine(settings)
+    if engine.dialect.name != 'postgresql':
+        sys.exit('partitioning needs PostgreSQL')
+    with engine.begin() as connection:
+        if is_partitioned(connection):
+            sys.exit('models is already partitioned')
+        unowned = connection.scalar('SELECT count(*) FROM models WHERE owner_id IS NULL')
+        if unowned:
+            sys.exit('{} expenses have no owner; give them one with add_user --claim'.format(
+                unowned))
+        partition(connection, args.partitions)
+    print('models is now split into {} partitions by owner'.format(args.partitions),
+          file=sys.stderr)
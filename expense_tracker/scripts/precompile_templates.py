@@ -0,0 +1,58 @@
+"""Compile every template into the jinja2 bytecode cache.
+
+usage: precompile_templates <config_uri> [var=value]
+
+Run at build or deploy time, with the same install path and settings as
+the app, so workers start with ``jinja2.bytecode_caching_directory``
+already filled. Needs ``jinja2.bytecode_caching = true``; no database.
+"""
+import os
+import sys
+import time
+
+from pyramid.config import Configurator
+from pyramid.paster import (
+    get_appsettings,
+    setup_logging,
+    )
+from pyramid.scripts.common import parse_vars
+from pyramid.settings import asbool
+from pyramid_jinja2 import IJinja2Environment
+
+from ..cache import FragmentCacheExtension
+from ..warmup import compile_templates
+
+
+def usage(argv):
+    cmd = os.path.basename(argv[0])
+    print('usage: %s <config_uri> [var=value]\n'
+          '(example: "%s production.ini")' % (cmd, cmd))
+    sys.exit(1)
+
+
+def main(argv=sys.argv):
+    if len(argv) < 2:
+        usage(argv)
+    config_uri = argv[1]
+    options = parse_vars(argv[2:])
+    setup_logging(config_uri)
+    settings = get_appsettings(config_uri, options=options)
+    if not asbool(settings.get('jinja2.bytecode_caching', False)):
+        print('jinja2.bytecode_caching is off in %s; nothing to do' % config_uri,
+              file=sys.stderr)
+        sys.exit(1)
+
+    # just enough of main() to build the same jinja2 environment
+    settings = dict(settings)
+    settings.pop('pyramid.includes', None)
+    config = Configurator(settings=settings, package='expense_tracker')
+    config.include('pyramid_jinja2')
+    config.include('expense_tracker.warmup')
+    config.add_jinja2_extension(FragmentCacheExtension)
+    config.commit()
+    env = config.registry.getUtility(IJinja2Environment, name='.jinja2')
+
+    start = time.perf_counter()
+    count = compile_templates(env)
+    print('compiled %d templates into %s in %.1fms' % (
+        count, env.bytecode_cache.directory, (time.perf_counter() - start) * 1000))
@@ -0,0 +1,66 @@
+"""Recompute expense_totals from the expenses, or check it against them.
+
+usage: rebuild_totals <config_uri> [--check] [var=value]
+
+The migration that adds the table fills it, and writes keep it current
+from then on, so this is for checking and repairs: ``--check`` recounts
+every bucket without changing anything, prints the ones that disagree
+and exits 1 if there are any. A rebuild runs in one transaction, and on
+PostgreSQL holds off writers to the expenses until it is done.
+"""
+import argparse
+import os
+import sys
+
+from pyramid.paster import (
+    get_appsettings,
+    setup_logging,
+    )
+from pyramid.scripts.common import parse_vars
+
+from ..models import get_engine
+from ..models.totals import rebuild_totals, scan_totals, stored_totals
+
+
+def check(engine):
+    """Print the buckets that are wrong; returns 1 if there are any."""
+    if engine.dialect.name == 'postgresql':
+        # both reads from one snapshot
+        engine = engine.execution_options(isolation_level='REPEATABLE READ')
+    with engine.begin() as connection:
+        expected = scan_totals(connection)
+        stored = stored_totals(connection)
+    wrong = sorted(
+        key for key in set(expected) | set(stored)
+        if expected.get(key, [0, 0]) != stored.get(key, [0, 0])
+    )
+    for key in wrong:
+        print('{}: stored {}, counted {}'.format(
+            key, stored.get(key, [0, 0]), expected.get(key, [0, 0])))
+    print('{} of {} buckets wrong'.format(len(wrong), len(expected)), file=sys.stderr)
+    return 1 if wrong else 0
+
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(
+        prog=os.path.basename(argv[0]),
+        description='Backfill or verify the expense_totals rollup.'
+    )
+    parser.add_argument('config_uri')
+    parser.add_argument('--check', action='store_true',
+                        help='only compare the stored totals with a recount')
+    args, extra = parser.parse_known_args(argv[1:])
+    options = parse_vars(extra)
+    setup_logging(args.config_uri)
+    settings = get_appsettings(args.config_uri, options=options)
+    settings['sqlalchemy.url'] = os.environ['DATABASE_URL']
+
+    engine = get_engine(settings)
+    if args.check:
+        sys.exit(check(engine))
+    with engine.begin() as connection:
+        if engine.dialect.name == 'postgresql':
+            # deltas committed between the scan and the rewrite would be lost
+            connection.execute('LOCK TABLE models IN SHARE MODE')
+        buckets = rebuild_totals(connection)
+    print('rebuilt {} buckets'.format(buckets), file=sys.stderr)
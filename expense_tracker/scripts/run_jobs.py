@@ -0,0 +1,69 @@
+"""Run queued jobs (imports, exports, reports) until stopped.
+
+usage: run_jobs <config_uri> [--once] [--name NAME] [var=value]
+
+Start as many as the database can take, on any machine that can reach
+it; each job is claimed by exactly one of them. With nothing to do a
+worker checks again every ``jobs.poll_interval`` seconds (default 1).
+``--once`` runs whatever is ready and exits, for cron or tests. As with
+the other scripts, list pages cached by the web workers pick up what
+the jobs write when their ``cache.ttl`` runs out.
+"""
+import argparse
+import os
+import sys
+import time
+
+from pyramid.paster import (
+    get_appsettings,
+    setup_logging,
+    )
+from pyramid.scripts.common import parse_vars
+from sqlalchemy.exc import OperationalError
+
+from ..jobs import Worker
+from ..models import (
+    get_engine,
+    get_session_factory,
+    )
+
+DEFAULT_POLL_INTERVAL = 1.0
+
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(
+        prog=os.path.basename(argv[0]),
+        description='Run queued jobs.'
+    )
+    parser.add_argument('config_uri')
+    parser.add_argument('--once', action='store_true',
+                        help='exit once nothing is ready instead of waiting')
+    parser.add_argument('--name', help='worker name recorded on its jobs '
+                                       '(default host:pid)')
+    args, extra = parser.parse_known_args(argv[1:])
+    options = parse_vars(extra)
+    setup_logging(args.config_uri)
+    settings = get_appsettings(args.config_uri, options=options)
+    settings['sqlalchemy.url'] = os.environ['DATABASE_URL']
+    poll_interval = float(settings.get('jobs.poll_interval', DEFAULT_POLL_INTERVAL))
+
+    engine = get_engine(settings)
+    worker = Worker(engine, get_session_factory(engine), settings, args.name)
+    ran = 0
+    try:
+        while True:
+            try:
+                job_id = worker.run_next()
+            except OperationalError as err:
+                # e.g. SQLite busy while another worker claims; try again
+                print('could not claim a job: {}'.format(err), file=sys.stderr)
+                job_id = None
+            if job_id is not None:
+                ran += 1
+                continue
+            if args.once:
+                break
+            time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        pass
+    print('ran {} jobs'.format(ran), file=sys.stderr)
@@ -0,0 +1,47 @@
+"""Serve the app with waitress, or with uvicorn when ``asgi.enabled`` is on.
+
+usage: serve_expenses <config_uri> [var=value]
+
+With ``asgi.enabled = false`` (the default) this is ``pserve config_uri``
+and the ``[server:main]`` section applies. Otherwise the ASGI app from
+expense_tracker.asgi is served on ``asgi.host``/``asgi.port``.
+"""
+import os
+import sys
+
+from pyramid.paster import (
+    get_appsettings,
+    setup_logging,
+    )
+from pyramid.scripts import pserve
+from pyramid.scripts.common import parse_vars
+from pyramid.settings import asbool
+
+
+def usage(argv):
+    cmd = os.path.basename(argv[0])
+    print('usage: %s <config_uri> [var=value]\n'
+          '(example: "%s production.ini")' % (cmd, cmd))
+    sys.exit(1)
+
+
+def main(argv=sys.argv):
+    if len(argv) < 2:
+        usage(argv)
+    config_uri = argv[1]
+    options = parse_vars(argv[2:])
+    settings = get_appsettings(config_uri, options=options)
+    if not asbool(settings.get('asgi.enabled', False)):
+        return pserve.main(['pserve', config_uri] + argv[2:])
+
+    import uvicorn
+    from ..asgi import main as make_app
+
+    setup_logging(config_uri)
+    app = make_app(settings.global_conf, **settings)
+    uvicorn.run(
+        app,
+        host=settings.get('asgi.host', '127.0.0.1'),
+        port=int(settings.get('asgi.port', 6543)),
+        log_config=None,  # keep the ini's logging
+    )
@@ -0,0 +1,192 @@
+"""Ranked prefix search over expense titles.
+
+Every word of the query has to start a word of the title, so ``ren ca``
+finds "Rental car". Results come best match first, in keyset pages like
+the list API.
+
+On PostgreSQL the match runs against a GIN index on
+``to_tsvector('simple', title)`` (see the migrations) and is ranked with
+``ts_rank``. Anywhere else each process keeps an inverted index of the
+titles in memory instead. It is built on the first search and then
+brought up to date from ``updated_at`` at most every
+``search.refresh_interval`` seconds (default 1), or right after this
+process commits a change.
+"""
+import math
+import re
+import threading
+import time
+from bisect import bisect_left
+from heapq import nlargest
+
+from sqlalchemy import Float, cast, event, func, literal_column
+
+from expense_tracker.models import Expense
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+MAX_TERMS = 8
+
+# must match the expression the migration indexes
+REGCONFIG = literal_column("'simple'::regconfig")
+TITLE_VECTOR = func.to_tsvector(REGCONFIG, func.coalesce(Expense.title, literal_column("''")))
+TITLE_VECTOR_INDEX = (
+    "CREATE INDEX ix_models_title_tsv ON models"
+    " USING gin (to_tsvector('simple'::regconfig, coalesce(title, '')))"
+)
+
+
+def tokenize(text):
+    """Lower-cased words of ``text``."""
+    return WORD_RE.findall((text or '').lower())
+
+
+def parse_query(value):
+    """The search terms in a ``q`` parameter; raises ValueError if none."""
+    terms = tokenize(value)[:MAX_TERMS]
+    if not terms:
+        raise ValueError('nothing to search for')
+    return terms
+
+
+def rank_column(terms):
+    """``ts_rank`` of the title against a prefix query for every term.
+
+    Terms are plain words (see tokenize), so they can't carry tsquery
+    syntax of their own.
+    """
+    query = func.to_tsquery(REGCONFIG, ' & '.join(term + ':*' for term in terms))
+    # normalization 1: divide by 1 + log(number of words in the title).
+    # ts_rank is a real; as a double it compares equal to the cursor's
+    # value, which comes back as a Python float.
+    rank = cast(func.ts_rank(TITLE_VECTOR, query, 1), Float(53))
+    return TITLE_VECTOR.op('@@')(query), rank.label('rank')
+
+
+def score(terms, words):
+    """Rank of a title's ``words`` for ``terms``, or 0 if one doesn't match.
+
+    Close to what ts_rank gives: exact words count more than prefixes,
+    and long titles count less.
+    """
+    total = 0.0
+    for term in terms:
+        if term in words:
+            total += 1.0
+        elif any(word.startswith(term) for word in words):
+            total += 0.5
+        else:
+            return 0.0
+    return total / (1 + math.log(len(words)))
+
+
+class TitleIndex(object):
+    """Inverted index of expense titles: word -> ids, kept in one process."""
+
+    def __init__(self, refresh_interval=1.0, clock=time.monotonic):
+        self.refresh_interval = refresh_interval
+        self.clock = clock
+        self.stale = True
+        self._lock = threading.Lock()
+        self._checked = None
+        self._version = None
+        self._docs = {}       # id -> (owner_id, words)
+        self._postings = {}   # word -> set of ids
+        self._words = []      # sorted keys of _postings, for prefix lookups
+
+    def _add(self, expense_id, owner_id, title):
+        self._remove(expense_id)
+        words = frozenset(tokenize(title))
+        self._docs[expense_id] = (owner_id, words)
+        for word in words:
+            ids = self._postings.get(word)
+            if ids is None:
+                ids = self._postings[word] = set()
+                self._words.insert(bisect_left(self._words, word), word)
+            ids.add(expense_id)
+
+    def _remove(self, expense_id):
+        doc = self._docs.pop(expense_id, None)
+        if doc is None:
+            return
+        for word in doc[1]:
+            ids = self._postings[word]
+            ids.discard(expense_id)
+            if not ids:
+                del self._postings[word]
+                del self._words[bisect_left(self._words, word)]
+
+    def _rebuild(self, session):
+        self._docs, self._postings, self._words = {}, {}, []
+        for expense_id, owner_id, title in session.query(
+                Expense.id, Expense.owner_id, Expense.title).yield_per(5000):
+            self._add(expense_id, owner_id, title)
+
+    def refresh(self, session):
+        """Catch up with the table if it may have changed since last time.
+
+        Rows changed since the newest ``updated_at`` seen are re-read;
+        when the row count then disagrees (something was deleted) the
+        index is rebuilt.
+        """
+        now = self.clock()
+        if not self.stale and self._checked is not None and \
+                now - self._checked < self.refresh_interval:
+            return
+        with self._lock:
+            self.stale = False
+            self._checked = now
+            version = session.query(func.max(Expense.updated_at), func.count(Expense.id)).one()
+            if version == self._version:
+                return
+            newest = self._version[0] if self._version else None
+            if newest is None:
+                self._rebuild(session)
+            else:
+                # >= : other rows may share the newest timestamp we saw
+                for expense_id, owner_id, title in session.query(
+                        Expense.id, Expense.owner_id, Expense.title).filter(
+                        Expense.updated_at >= newest):
+                    self._add(expense_id, owner_id, title)
+                if len(self._docs) != version[1]:
+                    self._rebuild(session)
+            self._version = version
+
+    def search(self, terms, owner_id, after=None, limit=20):
+        """The next ``limit + 1`` (rank, id) pairs owned by ``owner_id``,
+        best first, after the (rank, id) cursor ``after``."""
+        with self._lock:
+            matches = None
+            for term in terms:
+                ids = set()
+                position = bisect_left(self._words, term)
+                while position < len(self._words) and self._words[position].startswith(term):
+                    ids |= self._postings[self._words[position]]
+                    position += 1
+                matches = ids if matches is None else matches & ids
+                if not matches:
+                    return []
+            hits = []
+            for expense_id in matches:
+                doc_owner, words = self._docs[expense_id]
+                if doc_owner == owner_id:
+                    hits.append((score(terms, words), expense_id))
+        if after is not None:
+            hits = [hit for hit in hits if hit < tuple(after)]
+        return nlargest(limit + 1, hits)
+
+
+def includeme(config):
+    """Set up the in-memory index when the database isn't PostgreSQL.
+
+    Include after ``expense_tracker.models``.
+    """
+    engine = config.registry['db_engines']['primary']
+    if engine.dialect.name == 'postgresql':
+        return
+    interval = float(config.get_settings().get('search.refresh_interval', 1))
+    index = config.registry['search_index'] = TitleIndex(interval)
+
+    def after_commit(session):
+        index.stale = True
+
+    event.listen(config.registry['dbsession_factory'], 'after_commit', after_commit)
@@ -1,11 +1,23 @@
 """Configure and hold all pertinent security information for the app."""
+import hashlib
+import hmac
+import logging
 import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
 from pyramid.authentication import AuthTktAuthenticationPolicy
 from pyramid.authorization import ACLAuthorizationPolicy
 from pyramid.security import Authenticated
 from pyramid.security import Allow
-from passlib.apps import custom_app_context as pwd_context
+from pyramid.security import DENY_ALL
+from pyramid.security import Everyone
 from pyramid.session import SignedCookieSessionFactory  # <-- include this
+from expense_tracker.models import Expense, User
+from expense_tracker.profiling import timed
+
+log = logging.getLogger(__name__)
 
 
 class MyRoot(object):
@@ -18,10 +30,263 @@ class MyRoot(object):
     ]
 
 
-def is_authenticated(username, password):
-    """Check if the user's username and password are good."""
-    if username == os.environ.get('AUTH_USERNAME', ''):
-        if pwd_context.verify(password, os.environ.get('AUTH_PASSWORD', '')):
+def owner_principal(user_id):
+    return 'user:{}'.format(user_id)
+
+
+def expense_acl(found, owner_id):
+    """The ACL for one expense: only its owner may see or change it.
+
+    Unowned expenses, from before there were users, can be seen by
+    everyone and changed by anyone logged in, like every expense could
+    before. Missing ones get the same, so the views can answer 404.
+    """
+    if not found or owner_id is None:
+        return [(Allow, Everyone, 'view'), (Allow, Authenticated, 'secret')]
+    return [(Allow, owner_principal(owner_id), ('view', 'secret')), DENY_ALL]
+
+
+class ExpenseResource(object):
+    """Context for the routes about the one expense named by ``{id}``."""
+
+    def __init__(self, request):
+        self.request = request
+        if request.method in ('GET', 'HEAD'):
+            session = request.read_dbsession
+        else:
+            session = request.dbsession
+        row = session.query(Expense.owner_id).filter(
+            Expense.id == int(request.matchdict['id'])).first()
+        self.__acl__ = expense_acl(row is not None, row[0] if row else None)
+
+
+def find_user(dbsession, username):
+    return dbsession.query(User).filter(User.username == username).first()
+
+
+def get_user(request):
+    """The logged in User or None, as ``request.user``."""
+    username = request.unauthenticated_userid
+    if username is None:
+        return None
+    return find_user(request.dbsession, username)
+
+
+def principals_for(userid, request):
+    """AuthTkt callback: a ticket for a user that no longer exists is
+    treated as logged out."""
+    user = request.user
+    if user is None:
+        return None
+    return [owner_principal(user.id)]
+
+
+def current_owner_id(request):
+    """Whose expenses ``request`` lists: the user's id, or None for the
+    unowned ones when nobody is logged in."""
+    user = request.user
+    return user.id if user is not None else None
+
+
+def owned_by(owner_id, column=Expense.owner_id):
+    """Criterion for the rows ``owner_id`` owns; the unowned for None."""
+    if owner_id is None:
+        return column.is_(None)
+    return column == owner_id
+
+
+def owner_filter(request, column=Expense.owner_id):
+    """Criterion limiting a query to the expenses (or whatever else
+    ``column`` belongs to) listed for ``request``."""
+    return owned_by(current_owner_id(request), column)
+
+
+class LoginThrottled(Exception):
+    """A login attempt was refused before its password was checked."""
+
+
+class RateLimiter(object):
+    """Allow ``limit`` attempts per ``window`` seconds for each key.
+
+    Keys are kept in the order of their latest attempt, so those whose
+    attempts have all left the window are dropped from the front as new
+    ones come in. At most ``max_keys`` are tracked; past that the least
+    recently tried key is forgotten.
+    """
+
+    def __init__(self, limit, window, clock=time.monotonic, max_keys=10000):
+        self.limit = limit
+        self.window = window
+        self.clock = clock
+        self.max_keys = max_keys
+        self._attempts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def allow(self, key):
+        now = self.clock()
+        with self._lock:
+            self._forget(now, key)
+            attempts = self._attempts.setdefault(key, deque())
+            while attempts and attempts[0] <= now - self.window:
+                attempts.popleft()
+            if len(attempts) >= self.limit:
+                return False
+            attempts.append(now)
+            self._attempts.move_to_end(key)
+            return True
+
+    def _forget(self, now, key):
+        """Drop expired keys, and make room if ``key`` is new."""
+        full = key not in self._attempts and len(self._attempts) >= self.max_keys
+        while self._attempts:
+            oldest = next(iter(self._attempts.values()))
+            if oldest and oldest[-1] > now - self.window and not full:
+                break
+            self._attempts.popitem(last=False)
+            full = False
+
+
+def default_context():
+    """passlib's app context; imported on first use as it's slow to load."""
+    from passlib.apps import custom_app_context
+    return custom_app_context
+
+
+class PasswordVerifier(object):
+    """Check passwords without letting slow hashing eat the request threads.
+
+    Hashes run on a few dedicated threads, with at most ``max_pending``
+    queued or running at once; past that, and past ``rate_limit``
+    attempts per username per ``rate_window`` seconds, attempts fail
+    fast with LoginThrottled. A successful check is remembered for
+    ``cache_ttl`` seconds as an HMAC under a per-process key, compared in
+    constant time, so repeat logins skip the hash. Hashes made with
+    outdated settings are redone in the background; the new hash is kept
+    in ``upgrades`` and handed to ``on_upgrade`` if given.
+    """
+
+    def __init__(self, threads=2, max_pending=8, timeout=5, rate_limit=10,
+                 rate_window=60, cache_ttl=300, context=None,
+                 on_upgrade=None, clock=time.monotonic):
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix='verify')
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self._context = context
+        self.on_upgrade = on_upgrade
+        self.clock = clock
+        self.limiter = RateLimiter(rate_limit, rate_window, clock)
+        self.upgrades = {}
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._key = os.urandom(32)
+        self._verified = {}
+
+    @property
+    def context(self):
+        if self._context is None:
+            self._context = default_context()
+        return self._context
+
+    def _mac(self, username, password, stored_hash):
+        message = '\0'.join((username, password, stored_hash)).encode('utf-8')
+        return hmac.new(self._key, message, hashlib.sha256).digest()
+
+    def _submit(self, fn, *args):
+        """Run ``fn`` on the hashing threads, or return None if they're full."""
+        if not self._slots.acquire(blocking=False):
+            return None
+        try:
+            future = self.executor.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda f: self._slots.release())
+        return future
+
+    def verify(self, username, password, stored_hash):
+        """Whether ``password`` matches ``stored_hash``.
+
+        Raises LoginThrottled if the attempt is rate limited, the hashing
+        threads are saturated, or the check takes longer than ``timeout``.
+        """
+        mac = self._mac(username, password, stored_hash)
+        cached = self._verified.get(username)
+        if cached is not None and cached[1] > self.clock() and \
+                hmac.compare_digest(cached[0], mac):
+            return True
+        if not self.limiter.allow(username):
+            raise LoginThrottled('too many attempts for this username')
+        future = self._submit(self.context.verify, password, stored_hash)
+        if future is None:
+            raise LoginThrottled('too many password checks in progress')
+        try:
+            with timed('auth'):
+                verified = future.result(self.timeout)
+        except TimeoutError:
+            raise LoginThrottled('password check timed out')
+        if verified:
+            self._verified[username] = (mac, self.clock() + self.cache_ttl)
+            if self.context.needs_update(stored_hash):
+                self.upgrade(username, password)
+        return verified
+
+    def upgrade(self, username, password):
+        """Rehash ``password`` with the current settings in the background."""
+        future = self._submit(self.context.hash, password)
+        if future is None:
+            return  # busy; the next login will try again
+
+        def done(future):
+            if future.exception() is not None:
+                log.error('rehashing the password for %s failed', username,
+                          exc_info=future.exception())
+                return
+            self.upgrades[username] = future.result()
+            log.info('rehashed the password for %s with current settings', username)
+            if self.on_upgrade is not None:
+                self.on_upgrade(username, future.result())
+        future.add_done_callback(done)
+
+
+def verifier_from_settings(settings, on_upgrade=None):
+    return PasswordVerifier(
+        threads=int(settings.get('login.verify_threads', 2)),
+        max_pending=int(settings.get('login.max_pending', 8)),
+        timeout=float(settings.get('login.verify_timeout', 5)),
+        rate_limit=int(settings.get('login.rate_limit', 10)),
+        rate_window=float(settings.get('login.rate_window', 60)),
+        cache_ttl=float(settings.get('login.success_cache_ttl', 300)),
+        on_upgrade=on_upgrade,
+    )
+
+
+def hash_saver(session_factory):
+    """An ``on_upgrade`` callback that stores rehashed passwords."""
+    def save(username, password_hash):
+        session = session_factory()
+        try:
+            session.query(User).filter(User.username == username).update(
+                {'password_hash': password_hash}, synchronize_session=False)
+            session.commit()
+        finally:
+            session.close()
+    return save
+
+
+def is_authenticated(request, username, password):
+    """Check if the user's username and password are good.
+
+    Users live in the users table. The AUTH_USERNAME/AUTH_PASSWORD user
+    from the environment still works, and gets a row there the first
+    time it logs in. May raise LoginThrottled.
+    """
+    verifier = request.registry['password_verifier']
+    user = find_user(request.dbsession, username)
+    if user is not None:
+        return verifier.verify(username, password, user.password_hash)
+    if username and username == os.environ.get('AUTH_USERNAME', ''):
+        stored_hash = os.environ.get('AUTH_PASSWORD', '')
+        if verifier.verify(username, password, stored_hash):
+            request.dbsession.add(User(username=username, password_hash=stored_hash))
             return True
     return False
 
@@ -32,8 +297,10 @@ def includeme(config):
     auth_secret = os.environ.get('AUTH_SECRET', '')
     authn_policy = AuthTktAuthenticationPolicy(
         secret=auth_secret,
-        hashalg='sha512'
+        hashalg='sha512',
+        callback=principals_for
     )
+    config.add_request_method(get_user, 'user', reify=True)
     config.set_authentication_policy(authn_policy)
 
     # set up authorization
@@ -47,3 +314,7 @@ def includeme(config):
     session_factory = SignedCookieSessionFactory(session_secret)
     config.set_session_factory(session_factory)
     config.set_default_csrf_options(require_csrf=True)
+
+    # password checks run on their own threads, see PasswordVerifier
+    config.registry['password_verifier'] = verifier_from_settings(
+        config.get_settings(), hash_saver(config.registry['dbsession_factory']))
@@ -0,0 +1,278 @@
+"""A read-only copy of the expenses in typed NumPy arrays, for reports.
+
+With ``snapshot.enabled = true`` (and the ``analytics`` extra installed)
+each process keeps every expense as one row of a few int64/int32 arrays,
+about 40 bytes an expense. Filtered totals reports are then worked out
+with vectorised array operations instead of a SQL scan, and without
+building an ORM object per row. Meant for workers that serve reports.
+
+The copy is loaded on first use. Afterwards, at most every
+``snapshot.refresh_interval`` seconds (default 5), or right after this
+process commits a change, it reads only the rows with an id past the
+highest it holds and the rows updated since the newest ``updated_at`` it
+has seen. If the row count still disagrees after that (something was
+deleted), it is loaded again from scratch.
+"""
+import calendar
+import threading
+import time
+from collections import namedtuple
+from datetime import timedelta
+
+import numpy as np
+from sqlalchemy import BigInteger, cast, event, extract, func, select
+
+from expense_tracker.filters import parse_date
+from expense_tracker.models import Expense
+from expense_tracker.money import parse_currency, to_cents
+
+NO_DATE = np.iinfo(np.int64).min
+NO_MONTH = np.iinfo(np.int32).min  # -1 is December 1969
+CHUNK_SIZE = 50000
+
+# one array per column, all in id order; ``months`` is the due date's
+# month counted from January 1970, worked out once on loading
+Columns = namedtuple('Columns', 'ids owners due months cents currencies titles')
+
+
+def epoch(when):
+    """Seconds since 1970 of a naive datetime, or NO_DATE."""
+    if when is None:
+        return NO_DATE
+    return calendar.timegm(when.timetuple())
+
+
+def due_epoch(dialect_name):
+    """SQL for ``due_date`` in seconds since 1970 (NO_DATE when NULL), or
+    None where that is left to ``epoch``. Converting in the database
+    saves making a datetime per row."""
+    due_date = Expense.__table__.c.due_date
+    if dialect_name == 'postgresql':
+        seconds = extract('epoch', due_date)
+    elif dialect_name == 'sqlite':
+        seconds = func.strftime('%s', due_date)
+    else:
+        return None
+    return func.coalesce(cast(seconds, BigInteger), NO_DATE)
+
+
+def to_months(due):
+    """Months since January 1970 of epoch seconds, NO_MONTH for NO_DATE."""
+    months = (due // 86400).astype('datetime64[D]').astype('datetime64[M]').astype(np.int32)
+    months[due == NO_DATE] = NO_MONTH
+    return months
+
+
+def parse_filters(params):
+    """The snapshot's version of filters.expense_filters.
+
+    Takes the same keys, apart from ``currency`` which reports give
+    separately. Raises ValueError on bad input.
+    """
+    filters = {}
+    if params.get('due_after'):
+        filters['due_after'] = epoch(parse_date(params['due_after']))
+    if params.get('due_before'):
+        # inclusive of the whole day
+        filters['due_before'] = epoch(parse_date(params['due_before']) + timedelta(days=1))
+    if params.get('min_amount'):
+        filters['min_cents'] = to_cents(params['min_amount'])
+    if params.get('max_amount'):
+        filters['max_cents'] = to_cents(params['max_amount'])
+    if params.get('title'):
+        filters['title'] = params['title']
+    return filters
+
+
+def group_sums(keys, cents):
+    """(distinct keys, counts, int64 sums of ``cents``) grouped by key.
+
+    Keys are small ints (month numbers, title codes), so this counts into
+    one slot per possible key instead of sorting.
+    """
+    if not len(keys):
+        return keys, keys.astype(np.int64), cents
+    low = keys.min()
+    slots = keys - low
+    counts = np.bincount(slots)
+    sums = np.zeros(len(counts), np.int64)
+    # add.at stays in int64, so totals are exact
+    np.add.at(sums, slots, cents)
+    present = np.flatnonzero(counts)
+    return present + low, counts[present], sums[present]
+
+
+class ExpenseSnapshot(object):
+    """Every expense as parallel arrays; see the module docstring."""
+
+    def __init__(self, refresh_interval=5.0, clock=time.monotonic):
+        self.refresh_interval = refresh_interval
+        self.clock = clock
+        self.stale = True
+        self.columns = None
+        self._lock = threading.Lock()
+        self._checked = None
+        self._newest = None
+        self._title_codes = {}
+        self._title_names = []
+        self._currency_codes = {}
+        self._currency_names = []
+
+    def _coder(self, name):
+        """A function giving each distinct ``name`` value a small int."""
+        codes = getattr(self, '_{}_codes'.format(name))
+        names = getattr(self, '_{}_names'.format(name))
+
+        def code(value):
+            found = codes.get(value)
+            if found is None:
+                found = codes[value] = len(names)
+                names.append(value)
+            return found
+        return code
+
+    def _read(self, connection, *criteria):
+        """Columns for the rows matching ``criteria``, in id order."""
+        table = Expense.__table__
+        due = due_epoch(connection.dialect.name)
+        query = select([
+            table.c.id, func.coalesce(table.c.owner_id, 0),
+            table.c.due_date if due is None else due,
+            func.coalesce(table.c.amount_cents, 0), table.c.currency, table.c.title,
+        ]).order_by(table.c.id)
+        for criterion in criteria:
+            query = query.where(criterion)
+        result = connection.execution_options(stream_results=True).execute(query)
+        currency_code, title_code = self._coder('currency'), self._coder('title')
+        chunks = []
+        while True:
+            rows = result.fetchmany(CHUNK_SIZE)
+            if not rows:
+                break
+            ids, owners, dues, cents, currencies, titles = zip(*rows)
+            if due is None:
+                dues = [epoch(when) for when in dues]
+            dues = np.array(dues, np.int64)
+            chunks.append(Columns(
+                np.array(ids, np.int64),
+                np.array(owners, np.int64),
+                dues,
+                to_months(dues),
+                np.array(cents, np.int64),
+                np.array([currency_code(value) for value in currencies], np.int32),
+                np.array([title_code(value) for value in titles], np.int32),
+            ))
+        if not chunks:
+            return Columns(*(np.empty(0, dtype) for dtype in (
+                np.int64, np.int64, np.int64, np.int32, np.int64, np.int32, np.int32)))
+        return Columns(*(np.concatenate(parts) for parts in zip(*chunks)))
+
+    def _merge(self, changed):
+        """Columns with ``changed`` rows replaced or added, as new arrays."""
+        current = self.columns
+        positions = np.searchsorted(current.ids, changed.ids)
+        known = positions < len(current.ids)
+        known[known] = current.ids[positions[known]] == changed.ids[known]
+        merged = Columns(*(np.copy(column) for column in current))
+        for column, values in zip(merged, changed):
+            column[positions[known]] = values[known]
+        if known.all():
+            return merged
+        ids = np.concatenate([merged.ids, changed.ids[~known]])
+        order = np.argsort(ids, kind='stable')
+        return Columns(*(
+            np.concatenate([column, values[~known]])[order]
+            for column, values in zip(merged, changed)
+        ))
+
+    def refresh(self, connection):
+        """Catch up with the table if it may have changed since last time."""
+        now = self.clock()
+        if not self.stale and self._checked is not None and \
+                now - self._checked < self.refresh_interval:
+            return
+        with self._lock:
+            self.stale = False
+            self._checked = now
+            newest, count = connection.execute(
+                select([func.max(Expense.updated_at), func.count(Expense.id)])).first()
+            if self.columns is None or self._newest is None:
+                self.columns = self._read(connection)
+            elif (newest, count) != (self._newest, len(self.columns.ids)):
+                last_id = int(self.columns.ids[-1]) if len(self.columns.ids) else 0
+                # >= : other rows may share the newest timestamp we saw
+                changed = self._read(connection, (Expense.id > last_id) |
+                                     (Expense.updated_at >= self._newest))
+                self.columns = self._merge(changed)
+                if len(self.columns.ids) != count:
+                    self.columns = self._read(connection)
+            self._newest = newest
+
+    @property
+    def version(self):
+        """(newest updated_at, row count) of what the arrays hold."""
+        return self._newest, len(self.columns.ids)
+
+    def mask(self, columns, owner_id, currency, filters):
+        """Which rows of ``columns`` are ``owner_id``'s (0 for unowned) in
+        ``currency`` and pass ``filters`` (from parse_filters)."""
+        keep = columns.owners == (owner_id or 0)
+        code = self._currency_codes.get(parse_currency(currency))
+        if code is None:
+            return np.zeros(len(columns.ids), bool)
+        keep &= columns.currencies == code
+        if 'due_after' in filters:
+            keep &= columns.due >= filters['due_after']
+        if 'due_before' in filters:
+            keep &= (columns.due < filters['due_before']) & (columns.due != NO_DATE)
+        if 'min_cents' in filters:
+            keep &= columns.cents >= filters['min_cents']
+        if 'max_cents' in filters:
+            keep &= columns.cents <= filters['max_cents']
+        if 'title' in filters:
+            codes = [code for code, name in enumerate(self._title_names)
+                     if name is not None and name.startswith(filters['title'])]
+            keep &= np.isin(columns.titles, codes)
+        return keep
+
+    def totals_by_month(self, owner_id, currency, params):
+        """(year, month, count, cents) per month of the due date, in order,
+        for the expenses that pass the filters in ``params``."""
+        columns = self.columns
+        keep = self.mask(columns, owner_id, currency, parse_filters(params))
+        keep &= columns.months != NO_MONTH
+        keys, counts, sums = group_sums(columns.months[keep], columns.cents[keep])
+        return [
+            (1970 + int(key) // 12, int(key) % 12 + 1, int(count), int(cents))
+            for key, count, cents in zip(keys, counts, sums)
+        ]
+
+    def totals_by_title(self, owner_id, currency, params, limit=None):
+        """(title, count, cents) per title, biggest total first."""
+        columns = self.columns
+        keep = self.mask(columns, owner_id, currency, parse_filters(params))
+        keys, counts, sums = group_sums(columns.titles[keep], columns.cents[keep])
+        if limit and limit < len(keys):
+            # only the top ``limit`` need sorting
+            top = np.argpartition(-sums, limit - 1)[:limit]
+        else:
+            top = np.arange(len(keys))
+        top = top[np.argsort(-sums[top], kind='stable')]
+        return [
+            (self._title_names[keys[i]], int(counts[i]), int(sums[i])) for i in top
+        ]
+
+
+def includeme(config):
+    """Keep an ExpenseSnapshot for the reports.
+
+    Include after ``expense_tracker.models``, and only when
+    ``snapshot.enabled`` is set: this module needs NumPy.
+    """
+    interval = float(config.get_settings().get('snapshot.refresh_interval', 5))
+    snapshot = config.registry['expense_snapshot'] = ExpenseSnapshot(interval)
+
+    def after_commit(session):
+        snapshot.stale = True
+
+    event.listen(config.registry['dbsession_factory'], 'after_commit', after_commit)
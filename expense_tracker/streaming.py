@@ -0,0 +1,72 @@
+"""Stream query results and rendered templates through WSGI app_iters.
+
+pyramid_tm commits and closes ``request.dbsession`` as soon as the view
+returns, which is before the server starts iterating the response body.
+Anything that reads rows lazily while the body is being written therefore
+opens its own short-lived session, which is closed once the iterator is
+exhausted or the client goes away.
+"""
+from pyramid.response import Response
+from pyramid_jinja2 import IJinja2Environment
+
+CHUNK_SIZE = 500
+BUFFER_SIZE = 8192
+
+
+def on_own_session(request, produce):
+    """Yield from ``produce(session)`` using a session of its own.
+
+    The session is closed once the generator is exhausted or closed.
+    """
+    session = request.registry['read_dbsession_factory']()
+    try:
+        for item in produce(session):
+            yield item
+    finally:
+        session.close()
+
+
+def iter_query(request, build_query, chunk_size=CHUNK_SIZE):
+    """Yield the rows of ``build_query(session)`` a chunk at a time.
+
+    The query runs on a fresh session (a server-side cursor where the
+    driver supports it) so memory stays flat however many rows come back.
+    """
+    return on_own_session(
+        request, lambda session: build_query(session).yield_per(chunk_size))
+
+
+def buffered(chunks, size=BUFFER_SIZE):
+    """Join many tiny text chunks into fewer, larger utf-8 writes."""
+    pending = []
+    pending_size = 0
+    for chunk in chunks:
+        pending.append(chunk)
+        pending_size += len(chunk)
+        if pending_size >= size:
+            yield ''.join(pending).encode('utf-8')
+            pending = []
+            pending_size = 0
+    if pending:
+        yield ''.join(pending).encode('utf-8')
+
+
+def stream_template(request, renderer_name, value):
+    """Render a jinja2 template into a Response as it is being generated.
+
+    Lazy iterables in ``value`` are only consumed as the body is written,
+    so the first bytes reach the client before the last row is fetched.
+    """
+    env = request.registry.queryUtility(IJinja2Environment, name='.jinja2')
+    template = env.get_template(renderer_name)
+    system = {
+        'request': request,
+        'context': getattr(request, 'context', None),
+        'renderer_name': renderer_name,
+    }
+    system.update(value)
+    return Response(
+        app_iter=buffered(template.generate(system)),
+        content_type='text/html',
+        charset='utf-8',
+    )
@@ -0,0 +1,80 @@
+from pyramid.view import view_config
+from pyramid.httpexceptions import HTTPNotFound, HTTPBadRequest
+from expense_tracker.conditional import conditional, expense_version, table_version
+from expense_tracker.filters import expense_filters, parse_fields, parse_sort, FIELDS
+from expense_tracker.models import Expense
+from expense_tracker.pagination import decode_cursor, encode_cursor, parse_limit, seek
+from expense_tracker.security import owner_filter
+
+
+def bad_request(err):
+    return HTTPBadRequest(json_body={'error': str(err)})
+
+
+@view_config(
+    route_name='api_list',
+    renderer='json',
+    request_method='GET',
+    decorator=conditional(table_version)
+)
+def api_list(request):
+    """List expenses as JSON, filtered, sorted and paginated in SQL.
+
+    Only the columns named in ``fields`` (plus whatever the cursor needs)
+    are selected, and no Expense instances are built along the way.
+    """
+    try:
+        criteria = expense_filters(request.GET)
+        sort_column, descending = parse_sort(request.GET.get('sort'))
+        fields = parse_fields(request.GET.get('fields'))
+        limit = parse_limit(request.GET.get('limit'))
+        after = decode_cursor(request.GET.get('after'), sort_column)
+    except ValueError as err:
+        raise bad_request(err)
+
+    query = request.read_dbsession.query(*projection(fields, sort_column)).filter(
+        owner_filter(request), *criteria)
+    rows = seek(query, sort_column, Expense.id, after, descending).limit(limit + 1).all()
+    return rows_page(rows, fields, sort_column, limit)
+
+
+def projection(fields, sort_column):
+    """The columns to select: the requested fields plus the cursor's."""
+    columns = [FIELDS[name] for name in fields]
+    return columns + [c for c in (sort_column, Expense.id) if c not in columns]
+
+
+def rows_page(rows, fields, sort_column, limit):
+    """Turn the first ``limit + 1`` rows after a cursor into the response."""
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, sort_column.key), last.id)
+    return {
+        'expenses': [{name: getattr(row, name) for name in fields} for row in rows],
+        'next_cursor': next_cursor
+    }
+
+
+@view_config(
+    route_name='api_detail',
+    renderer='json',
+    request_method='GET',
+    permission='view',
+    decorator=conditional(expense_version)
+)
+def api_detail(request):
+    """Return one expense as JSON, optionally only some of its fields."""
+    try:
+        fields = parse_fields(request.GET.get('fields'))
+    except ValueError as err:
+        raise bad_request(err)
+    expense_id = int(request.matchdict['id'])
+    row = request.read_dbsession.query(*[FIELDS[name] for name in fields]).filter(
+        Expense.id == expense_id).first()
+    if row is None:
+        raise HTTPNotFound
+    return {
+        'expense': {name: getattr(row, name) for name in fields}
+    }
@@ -0,0 +1,166 @@
+from datetime import datetime
+
+from pyramid.view import view_config
+from zope.sqlalchemy import mark_changed
+
+from expense_tracker.cache import mark_expenses_stale
+from expense_tracker.filters import expense_filters, parse_date
+from expense_tracker.models import Expense
+from expense_tracker.models.totals import apply_deltas, id_deltas
+from expense_tracker.money import parse_currency, to_cents
+from expense_tracker.security import owner_filter
+from expense_tracker.views.api import bad_request
+
+MAX_IDS = 10000
+
+
+def parse_body(request):
+    """The JSON object posted to a bulk endpoint."""
+    try:
+        body = request.json_body
+    except ValueError:
+        raise ValueError('body must be JSON')
+    if not isinstance(body, dict):
+        raise ValueError('body must be a JSON object')
+    return body
+
+
+def parse_ids(value):
+    """Validate the ``ids`` list of a bulk request."""
+    if not isinstance(value, list) or not all(
+            isinstance(i, int) and not isinstance(i, bool) for i in value):
+        raise ValueError('ids must be a list of integers')
+    if len(value) > MAX_IDS:
+        raise ValueError('at most {} ids at a time'.format(MAX_IDS))
+    return sorted(set(value))
+
+
+def bulk_criteria(body):
+    """WHERE criteria for the ``ids`` and/or ``filter`` of a bulk request.
+
+    ``filter`` takes the same keys as the list API's query string. One of
+    the two is required, so an empty body never matches every row.
+    """
+    criteria = []
+    ids = None
+    if 'ids' in body:
+        ids = parse_ids(body['ids'])
+        criteria.append(Expense.id.in_(ids))
+    if body.get('filter') is not None:
+        if not isinstance(body['filter'], dict):
+            raise ValueError('filter must be a JSON object')
+        if not all(isinstance(value, str) for value in body['filter'].values()):
+            # the same strings the list API takes in its query string
+            raise ValueError('filter values must be strings')
+        criteria += expense_filters(body['filter'])
+    if not criteria:
+        raise ValueError('give ids or a filter')
+    return ids, criteria
+
+
+def bulk_values(changes):
+    """Column values for the ``set`` object of a bulk update."""
+    if not isinstance(changes, dict) or not changes:
+        raise ValueError('set must be a non-empty JSON object')
+    unknown = set(changes) - {'title', 'amount', 'currency', 'due_date'}
+    if unknown:
+        raise ValueError('cannot set {}'.format(', '.join(sorted(unknown))))
+    values = {}
+    if 'title' in changes:
+        title = changes['title']
+        if not isinstance(title, str) or not title.strip():
+            raise ValueError('bad title {!r}'.format(title))
+        values['title'] = title
+    if 'amount' in changes:
+        values['amount_cents'] = to_cents(changes['amount'])
+    if 'currency' in changes:
+        values['currency'] = parse_currency(changes['currency'])
+    if 'due_date' in changes:
+        values['due_date'] = parse_date(str(changes['due_date']))
+    # bulk statements skip the ORM, so keep the conditional GET validators honest
+    values['updated_at'] = datetime.utcnow()
+    return values
+
+
+def matching_ids(request, criteria):
+    """Lock and return the ids of the user's expenses that match.
+
+    A filter can match far more rows than ``ids`` may list, so the same
+    MAX_IDS cap applies to the matches; past it the request is refused.
+    """
+    query = request.dbsession.query(Expense.id).filter(owner_filter(request), *criteria)
+    found = [row_id for row_id, in query.limit(MAX_IDS + 1).with_for_update()]
+    if len(found) > MAX_IDS:
+        raise ValueError('matches more than {} expenses'.format(MAX_IDS))
+    return found
+
+
+def report(ids, found, count_key):
+    result = {count_key: len(found)}
+    if ids is not None:
+        result['not_found'] = sorted(set(ids) - set(found))
+    return result
+
+
+@view_config(
+    route_name='api_bulk_update',
+    renderer='json',
+    request_method='POST',
+    permission='secret'
+)
+def bulk_update(request):
+    """Change the same fields on many of the user's expenses at once.
+
+    Takes ``{"ids": [...], "filter": {...}, "set": {...}}`` and runs one
+    ``UPDATE ... WHERE id IN (...)`` in the request's transaction. Like
+    every POST, it needs the CSRF token (the ``X-CSRF-Token`` header).
+    """
+    try:
+        body = parse_body(request)
+        ids, criteria = bulk_criteria(body)
+        values = bulk_values(body.get('set'))
+        found = matching_ids(request, criteria)
+    except ValueError as err:
+        raise bad_request(err)
+    if found:
+        connection = request.dbsession.connection()
+        deltas = id_deltas(connection, found, -1)
+        request.dbsession.query(Expense).filter(Expense.id.in_(found)).update(
+            values, synchronize_session=False)
+        apply_deltas(connection, id_deltas(connection, found, 1, deltas))
+        mark_changed(request.dbsession)
+        mark_expenses_stale(request.dbsession, found)
+    return report(ids, found, 'updated')
+
+
+@view_config(
+    route_name='api_bulk_delete',
+    renderer='json',
+    request_method='POST',
+    permission='secret'
+)
+def bulk_delete(request):
+    """Delete many of the user's expenses with one ``DELETE`` statement.
+
+    Takes ``{"ids": [...]}`` and/or ``{"filter": {...}}``; see bulk_update.
+    """
+    try:
+        ids, criteria = bulk_criteria(parse_body(request))
+        found = matching_ids(request, criteria)
+    except ValueError as err:
+        raise bad_request(err)
+    if found:
+        connection = request.dbsession.connection()
+        deltas = id_deltas(connection, found, -1)
+        request.dbsession.query(Expense).filter(Expense.id.in_(found)).delete(
+            synchronize_session=False)
+        apply_deltas(connection, deltas)
+        mark_changed(request.dbsession)
+        mark_expenses_stale(request.dbsession, found)
+    return report(ids, found, 'deleted')
+
+
+@view_config(route_name='api_csrf', renderer='json', request_method='GET')
+def csrf_token(request):
+    """The session's CSRF token, for API clients to send as X-CSRF-Token."""
+    return {'csrf_token': request.session.get_csrf_token()}
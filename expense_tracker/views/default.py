@@ -1,33 +1,113 @@
 from pyramid.view import view_config
 from pyramid.httpexceptions import HTTPNotFound, HTTPFound, HTTPBadRequest
 from pyramid.security import remember, forget, NO_PERMISSION_REQUIRED
+from expense_tracker.cache import expense_key, get_cache, list_key
+from expense_tracker.conditional import conditional, expense_version, table_version
+from expense_tracker.group_commit import GROUP_COMMIT_ID, expense_row
 from expense_tracker.models import Expense
-from expense_tracker.security import is_authenticated
+from expense_tracker.models.mymodel import DICT_COLUMNS, expense_dict
+from expense_tracker.money import DEFAULT_CURRENCY, parse_currency
+from expense_tracker.pagination import decode_cursor, encode_cursor, parse_limit, seek
+from expense_tracker.security import (
+    LoginThrottled,
+    current_owner_id,
+    is_authenticated,
+    owner_filter,
+)
+from expense_tracker.streaming import iter_query, stream_template
 from datetime import datetime
 
 
-@view_config(route_name='home', renderer="expense_tracker:templates/index.jinja2")
-def list_expenses(request):
-    expenses = request.dbsession.query(Expense).all()
-    if not expenses:
+def expense_page(rows, limit):
+    """Turn the first ``limit + 1`` DICT_COLUMNS rows after a cursor into
+    a page."""
+    if not rows:
         raise HTTPNotFound
-    expenses = [expense.to_dict() for expense in expenses]
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].due_date, rows[-1].id)
+    return {
+        'expenses': [expense_dict(*row) for row in rows],
+        'next_cursor': next_cursor
+    }
+
+
+@view_config(
+    route_name='home',
+    renderer="expense_tracker:templates/index.jinja2",
+    decorator=conditional(table_version)
+)
+def list_expenses(request):
+    """List one keyset page of expenses ordered by due date.
+
+    ``limit`` caps the page size and ``after`` is the cursor handed out as
+    ``next_cursor`` by the previous page. With ``stream`` set, the rows are
+    rendered into the response as they come off the database cursor.
+    Either way only the columns the page shows are selected, as plain
+    rows; no Expense objects are built.
+    """
+    try:
+        limit = parse_limit(request.GET.get('limit'))
+        after = decode_cursor(request.GET.get('after'), Expense.due_date)
+    except ValueError:
+        raise HTTPBadRequest
+
+    owner = owner_filter(request)
+    if 'stream' in request.GET:
+        if 'limit' not in request.GET:
+            limit = None
+
+        def build_query(session):
+            query = seek(session.query(*DICT_COLUMNS).filter(owner),
+                         Expense.due_date, Expense.id, after)
+            return query.limit(limit) if limit else query
+
+        expenses = (expense_dict(*row) for row in iter_query(request, build_query))
+        return stream_template(request, "expense_tracker:templates/index.jinja2", {
+            "title": "Expense List",
+            "expenses": expenses
+        })
+
+    cache = get_cache(request)
+    key = list_key(cache, current_owner_id(request), limit, request.GET.get('after', ''))
+    page = cache.get(key)
+    if page is None:
+        query = seek(request.read_dbsession.query(*DICT_COLUMNS).filter(owner),
+                     Expense.due_date, Expense.id, after)
+        page = expense_page(query.limit(limit + 1).all(), limit)
+        cache.set(key, page)
     return {
         "title": "Expense List",
-        "expenses": expenses
+        "expenses": page['expenses'],
+        "limit": limit,
+        "next_cursor": page['next_cursor'],
+        "cache_key": key
     }
 
 
-@view_config(route_name='detail', renderer="expense_tracker:templates/detail.jinja2")
+@view_config(
+    route_name='detail',
+    renderer="expense_tracker:templates/detail.jinja2",
+    permission='view',
+    decorator=conditional(expense_version)
+)
 def expense_detail(request):
     expense_id = int(request.matchdict['id'])
-    expense = request.dbsession.query(Expense).get(expense_id)
-    if expense:
-        return {
-            'title': 'One Expense',
-            'expense': expense.to_dict()
-        }
-    raise HTTPNotFound
+    cache = get_cache(request)
+    key = expense_key(expense_id)
+    expense = cache.get(key)
+    if expense is None:
+        expense = request.read_dbsession.query(Expense).get(expense_id)
+        if not expense:
+            raise HTTPNotFound
+        expense = expense.to_dict()
+        cache.set(key, expense)
+    return {
+        'title': 'One Expense',
+        'expense': expense,
+        'cache_key': key
+    }
 
 
 @view_config(
@@ -36,18 +116,37 @@ def expense_detail(request):
     permission='secret'
 )
 def create_expense(request):
-    """Create a new expense and add it to the database."""
+    """Create a new expense and add it to the database.
+
+    With ``group_commit.enabled`` it goes in with other creates arriving
+    at the same time (see expense_tracker.group_commit), and the redirect
+    goes to the new expense, whose id only comes back that way.
+    """
     if request.method == "GET":
         return {'title': 'create'}
 
     if request.method == "POST":
         if not all([field in request.POST for field in ['title', 'amount', 'due_date']]):
             raise HTTPBadRequest
-        new_expense = Expense(
-            title=request.POST['title'],
-            amount=request.POST['amount'],
-            due_date=datetime.strptime(request.POST['due_date'], '%Y-%m-%d')
-        )
+        try:
+            new_expense = Expense(
+                title=request.POST['title'],
+                amount=request.POST['amount'],
+                currency=parse_currency(request.POST.get('currency') or DEFAULT_CURRENCY),
+                due_date=datetime.strptime(request.POST['due_date'], '%Y-%m-%d'),
+                owner_id=current_owner_id(request)
+            )
+        except ValueError:
+            raise HTTPBadRequest
+        committer = request.registry.get('group_committer')
+        if committer is not None:
+            # committed outside the request's transaction, so a retry of
+            # the request (pyramid_retry) must not insert it again
+            expense_id = request.environ.get(GROUP_COMMIT_ID)
+            if expense_id is None:
+                expense_id = request.environ[GROUP_COMMIT_ID] = \
+                    committer.insert(expense_row(new_expense))
+            return HTTPFound(request.route_url('detail', id=expense_id))
         request.dbsession.add(new_expense)
         return HTTPFound(request.route_url('home'))
 
@@ -71,9 +170,14 @@ def update_expense(request):
         }
 
     if request.method == "POST":
-        expense.title = request.POST['title']
-        expense.amount = request.POST['amount']
-        expense.due_date = datetime.strptime(request.POST['due_date'], '%Y-%m-%d')
+        try:
+            expense.title = request.POST['title']
+            expense.amount = request.POST['amount']
+            if request.POST.get('currency'):
+                expense.currency = parse_currency(request.POST['currency'])
+            expense.due_date = datetime.strptime(request.POST['due_date'], '%Y-%m-%d')
+        except ValueError:
+            raise HTTPBadRequest
         request.dbsession.add(expense)
         request.dbsession.flush()
         return HTTPFound(request.route_url('detail', id=expense.id))
@@ -92,18 +196,6 @@ def delete_expense(request):
     request.dbsession.delete(expense)
     return HTTPFound(request.route_url('home'))
 
-# @view_config(route_name="api_detail", renderer="json")
-# def api_detail(request):
-#     expense_id = int(request.matchdict['id'])
-#     if expense_id < 0 or expense_id > len(EXPENSES) - 1:
-#         raise HTTPNotFound
-#     expense = list(filter(lambda expense: expense['id'] == expense_id, EXPENSES))[0]
-#     expense['due_date'] = expense['due_date'].strftime(FMT)
-#     return {
-#         'title': 'One Expense',
-#         'expense': expense
-#     }
-
 
 @view_config(
     route_name='login',
@@ -121,7 +213,15 @@ def login(request):
         username = request.POST['username']
         password = request.POST['password']
         # do some verification
-        if is_authenticated(username, password):
+        try:
+            verified = is_authenticated(request, username, password)
+        except LoginThrottled:
+            request.response.status = 429
+            request.response.headers['Retry-After'] = '30'
+            return {
+                'error': 'Too many login attempts, please try again shortly.'
+            }
+        if verified:
             headers = remember(request, username)
             return HTTPFound(request.route_url('home'), headers=headers)
 
@@ -0,0 +1,49 @@
+from pyramid.view import view_config
+from pyramid.response import Response
+
+from expense_tracker.exporter import ENCODERS, FORMATS, export_statement, iter_chunks
+from expense_tracker.filters import expense_filters
+from expense_tracker.jobs import accepted, enqueue_once, jobs_enabled
+from expense_tracker.security import owned_by, owner_filter
+from expense_tracker.streaming import on_own_session
+from expense_tracker.views.api import bad_request
+
+
+@view_config(route_name='export', request_method='GET')
+def export_expenses(request):
+    """Stream the user's (optionally filtered) expenses as a download.
+
+    Rows go from a server-side cursor through the encoder into the
+    response body a chunk at a time, after the view itself has returned.
+    With ``jobs.enabled`` the export is queued for export_job instead.
+    """
+    fmt = request.matchdict['format']
+    try:
+        statement = export_statement(
+            [owner_filter(request)] + expense_filters(request.GET))
+    except ValueError as err:
+        raise bad_request(err)
+    if jobs_enabled(request):
+        return accepted(request, enqueue_once(
+            request, 'export', {'format': fmt, 'filters': dict(request.GET)}))
+
+    chunks = on_own_session(
+        request, lambda session: iter_chunks(session.connection(), statement))
+    response = Response(
+        app_iter=ENCODERS[fmt](chunks),
+        content_type=FORMATS[fmt],
+    )
+    response.content_disposition = 'attachment; filename="expenses.{}"'.format(fmt)
+    return response
+
+
+def export_job(context):
+    """Encode a queued export into the job's output, a chunk at a time
+    as the rows come off the cursor."""
+    job = context.job
+    fmt = job.params['format']
+    statement = export_statement(
+        [owned_by(job.owner_id)] + expense_filters(job.params['filters']))
+    chunks = iter_chunks(context.session.connection(), statement)
+    size = context.write_output(ENCODERS[fmt](chunks), FORMATS[fmt])
+    return {'format': fmt, 'bytes': size}
@@ -0,0 +1,73 @@
+import io
+
+from pyramid.view import view_config
+from pyramid.httpexceptions import HTTPBadRequest
+from zope.sqlalchemy import mark_changed
+
+from expense_tracker.cache import mark_lists_stale
+from expense_tracker.jobs import enqueue, job_status, jobs_enabled
+from expense_tracker.security import current_owner_id
+from expense_tracker.importer import (
+    DEFAULT_BATCH_SIZE,
+    FORMATS,
+    ImportReport,
+    guess_format,
+    import_expenses,
+)
+
+
+@view_config(
+    route_name='import',
+    renderer="expense_tracker:templates/import_expenses.jinja2",
+    permission='secret'
+)
+def import_view(request):
+    """Bulk load an uploaded CSV or NDJSON file of expenses.
+
+    The whole upload goes in as one transaction, written in batches of
+    ``import.batch_size`` rows. With ``jobs.enabled`` the upload is
+    queued for import_job instead, and the page links to the job.
+    """
+    if request.method == "GET":
+        return {'title': 'Import Expenses'}
+
+    upload = request.POST.get('file')
+    if not hasattr(upload, 'file'):
+        raise HTTPBadRequest
+    fmt = request.POST.get('format') or guess_format(upload.filename)
+    if fmt not in FORMATS:
+        raise HTTPBadRequest
+    batch_size = int(request.registry.settings.get('import.batch_size', DEFAULT_BATCH_SIZE))
+
+    if jobs_enabled(request):
+        job = enqueue(request, 'import', {'format': fmt, 'batch_size': batch_size},
+                      payload=upload.file)
+        status = job_status(request, job)
+        request.response.status_int = 202
+        request.response.location = status['url']
+        return {'title': 'Import Expenses', 'job': status}
+
+    stream = io.TextIOWrapper(upload.file, encoding='utf-8', errors='replace', newline='')
+    report = import_expenses(request.dbsession.connection(), stream, fmt, batch_size,
+                             owner_id=current_owner_id(request))
+    # the rows went in through Core, so tell zope.sqlalchemy to commit them
+    mark_changed(request.dbsession)
+    mark_lists_stale(request.dbsession)
+    return {
+        'title': 'Import Expenses',
+        'report': report.to_dict()
+    }
+
+
+def import_job(context):
+    """Import a queued upload, committing (and checkpointing) each batch;
+    a retry carries on after the last batch that went in."""
+    job = context.job
+    stream = io.TextIOWrapper(context.payload(), encoding='utf-8',
+                              errors='replace', newline='')
+    report = ImportReport.from_dict(job.progress) if job.progress else None
+    report = import_expenses(
+        context.session.connection(), stream, job.params['format'], job.params['batch_size'],
+        progress=lambda report: context.checkpoint(**report.to_dict()),
+        owner_id=job.owner_id, report=report)
+    return report.to_dict()
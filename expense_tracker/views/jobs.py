@@ -0,0 +1,52 @@
+from pyramid.view import view_config
+from pyramid.httpexceptions import HTTPConflict, HTTPNotFound
+from pyramid.response import Response
+
+from expense_tracker.jobs import job_status, read_chunks
+from expense_tracker.models import Job
+from expense_tracker.security import owner_filter
+
+
+def find_job(request):
+    """The job in the matchdict if it is the user's, or a 404."""
+    job = request.dbsession.query(Job).filter(
+        Job.id == int(request.matchdict['id']), owner_filter(request, Job.owner_id)
+    ).first()
+    if job is None:
+        raise HTTPNotFound
+    return job
+
+
+@view_config(route_name='api_job', renderer='json', request_method='GET')
+def job_detail(request):
+    """Where a queued job has got to: its state, progress and error."""
+    job = find_job(request)
+    if job.state in ('queued', 'running'):
+        request.response.headers['Retry-After'] = '1'
+    return job_status(request, job)
+
+
+@view_config(route_name='api_job_result', renderer='json', request_method='GET')
+def job_result(request):
+    """What a finished job produced: the file for exports, JSON otherwise.
+
+    Answers 409 until the job is done.
+    """
+    job = find_job(request)
+    if job.state != 'done':
+        raise HTTPConflict(json_body={'error': 'job is {}'.format(job.state)})
+    if job.output_type is not None:
+        return Response(app_iter=output_chunks(request, job.id), content_type=job.output_type)
+    return job.result
+
+
+def output_chunks(request, job_id):
+    """Yield a job's output from the primary, on a session of its own
+    since the body is written after pyramid_tm has closed the request's
+    (see expense_tracker.streaming)."""
+    session = request.registry['dbsession_factory']()
+    try:
+        for chunk in read_chunks(session.connection(), job_id, 'output'):
+            yield chunk
+    finally:
+        session.close()
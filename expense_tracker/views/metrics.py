@@ -0,0 +1,22 @@
+from pyramid.view import view_config
+
+from expense_tracker.cache import get_cache
+from expense_tracker.models.pool import pool_metrics
+
+
+@view_config(
+    route_name='metrics',
+    renderer='json',
+    request_method='GET',
+    permission='secret'
+)
+def metrics(request):
+    """Expose the app's runtime counters as JSON, to logged-in users only."""
+    engines = request.registry.get('db_engines', {})
+    return {
+        'cache': get_cache(request).stats.to_dict(),
+        'db': {name: pool_metrics(engine) for name, engine in engines.items()},
+        'routes': request.registry['route_stats'].to_dict()
+        if 'route_stats' in request.registry else {},
+        'startup': request.registry.get('startup', {})
+    }
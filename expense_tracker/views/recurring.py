@@ -0,0 +1,70 @@
+from datetime import datetime, timedelta
+
+from pyramid.view import view_config
+from zope.sqlalchemy import mark_changed
+
+from expense_tracker.cache import mark_lists_stale
+from expense_tracker.filters import parse_date
+from expense_tracker.models import RecurrenceRule
+from expense_tracker.money import DEFAULT_CURRENCY, parse_currency, to_cents
+from expense_tracker.recurrence import DEFAULT_HORIZON_DAYS, materialize_rule, validate_rule
+from expense_tracker.security import current_owner_id, owner_filter
+from expense_tracker.views.api import bad_request
+from expense_tracker.views.bulk import parse_body
+
+
+def rule_from_body(body, owner_id):
+    """Build an unsaved RecurrenceRule from a posted JSON object."""
+    title = body.get('title')
+    if not isinstance(title, str) or not title.strip():
+        raise ValueError('bad title {!r}'.format(title))
+    if body.get('amount') is None:
+        raise ValueError('amount is required')
+    rule = RecurrenceRule(
+        owner_id=owner_id,
+        title=title,
+        amount_cents=to_cents(body['amount']),
+        currency=parse_currency(body.get('currency') or DEFAULT_CURRENCY),
+        frequency=body.get('frequency'),
+        interval=body.get('interval', 1),
+        starts_on=parse_date(str(body.get('starts_on') or '')),
+        ends_on=parse_date(str(body['ends_on'])) if body.get('ends_on') else None,
+    )
+    validate_rule(rule)
+    return rule
+
+
+@view_config(route_name='api_recurring', renderer='json', request_method='GET')
+def list_rules(request):
+    """The user's recurrence rules."""
+    rules = request.read_dbsession.query(RecurrenceRule).filter(
+        owner_filter(request, RecurrenceRule.owner_id)).order_by(RecurrenceRule.id)
+    return {'rules': [rule.to_dict() for rule in rules]}
+
+
+@view_config(
+    route_name='api_recurring',
+    renderer='json',
+    request_method='POST',
+    permission='secret'
+)
+def create_rule(request):
+    """Add a recurrence rule and generate its occurrences in the window.
+
+    Takes ``{"title", "amount", "frequency", "starts_on"}`` and optionally
+    ``currency``, ``interval`` and ``ends_on``; dates are YYYY-MM-DD.
+    """
+    try:
+        rule = rule_from_body(parse_body(request), current_owner_id(request))
+    except ValueError as err:
+        raise bad_request(err)
+    request.dbsession.add(rule)
+    request.dbsession.flush()
+    days = int(request.registry.settings.get('recurring.horizon_days', DEFAULT_HORIZON_DAYS))
+    now = datetime.now()
+    materialize_rule(request.dbsession.connection(), rule, now + timedelta(days=days),
+                     now, datetime.utcnow())
+    mark_changed(request.dbsession)
+    mark_lists_stale(request.dbsession)
+    request.response.status_int = 201
+    return {'rule': rule.to_dict()}
@@ -0,0 +1,277 @@
+from datetime import datetime, timedelta
+
+from pyramid.view import view_config
+from sqlalchemy import extract, func, or_
+
+from expense_tracker.conditional import conditional, table_version
+from expense_tracker.filters import expense_filters, parse_date
+from expense_tracker.jobs import accepted, enqueue_once, jobs_enabled
+from expense_tracker.models import Expense, ExpenseTotal, RecurrenceRule
+from expense_tracker.money import DEFAULT_CURRENCY, from_cents, parse_currency, to_cents
+from expense_tracker.pagination import parse_limit
+from expense_tracker.recurrence import projected
+from expense_tracker.security import current_owner_id, owned_by, owner_filter
+from expense_tracker.views.api import bad_request
+
+MAX_DAYS = 3650
+
+
+def parse_days(value, default=30):
+    """Turn the ``days`` query parameter into a bounded int."""
+    if value in (None, ''):
+        return default
+    days = int(value)
+    if days < 0:
+        raise ValueError('days must not be negative')
+    return min(days, MAX_DAYS)
+
+
+def report_currency(params):
+    """The one currency a report totals; amounts in others don't add up."""
+    return parse_currency(params.get('currency') or DEFAULT_CURRENCY)
+
+
+def total(cents):
+    return from_cents(cents or 0)
+
+
+def report_filters(params):
+    """expense_filters for a report; report_currency deals with currency."""
+    return expense_filters({key: value for key, value in params.items() if key != 'currency'})
+
+
+def rule_filters(params):
+    """The amount and title criteria of expense_filters, for recurrence
+    rules; upcoming_due narrows its window by the due dates itself."""
+    criteria = []
+    if params.get('min_amount'):
+        criteria.append(RecurrenceRule.amount_cents >= to_cents(params['min_amount']))
+    if params.get('max_amount'):
+        criteria.append(RecurrenceRule.amount_cents <= to_cents(params['max_amount']))
+    if params.get('title'):
+        criteria.append(RecurrenceRule.title.startswith(params['title'], autoescape=True))
+    return criteria
+
+
+def report_snapshot(request):
+    """The process's expense snapshot brought up to date, or None when
+    ``snapshot.enabled`` is off."""
+    snapshot = request.registry.get('expense_snapshot')
+    if snapshot is not None:
+        snapshot.refresh(request.read_dbsession.connection())
+    return snapshot
+
+
+def rollup_query(request, currency, *columns):
+    """Query expense_totals for the user's buckets in ``currency``.
+
+    Reports without filters read these instead of scanning the expenses.
+    """
+    return request.read_dbsession.query(*columns).filter(
+        ExpenseTotal.owner_id == (current_owner_id(request) or 0),
+        ExpenseTotal.currency == currency)
+
+
+def totals_version(request):
+    """(last modified, token) for the totals reports.
+
+    Comes from wherever the report reads, expense_totals or the snapshot,
+    which saves counting the user's expenses on every request.
+    """
+    try:
+        currency = report_currency(request.GET)
+        filtered = bool(report_filters(request.GET))
+    except ValueError:
+        return None, None  # the view turns it down
+    if filtered:
+        snapshot = report_snapshot(request)
+        if snapshot is None:
+            return table_version(request)
+        last_modified, count = snapshot.version
+        return last_modified, 'snapshot/{}/{}'.format(last_modified, count)
+    last_modified, count, cents = rollup_query(
+        request, currency, func.max(ExpenseTotal.updated_at),
+        func.sum(ExpenseTotal.count), func.sum(ExpenseTotal.amount_cents)).one()
+    return last_modified, 'totals/{}/{}/{}/{}'.format(currency, last_modified, count, cents)
+
+
+def report_params(request):
+    """The query string, kept with a queued report."""
+    return dict(request.GET)
+
+
+def scan_by_month(session, owner_id, currency, criteria):
+    """(year, month, count, cents) per month, worked out from the expenses."""
+    year = extract('year', Expense.due_date).label('year')
+    month = extract('month', Expense.due_date).label('month')
+    return session.query(
+        year, month, func.count(Expense.id), func.sum(Expense.amount_cents)
+    ).filter(
+        Expense.due_date.isnot(None), Expense.currency == currency,
+        owned_by(owner_id), *criteria
+    ).group_by(year, month).order_by(year, month)
+
+
+def month_report(currency, rows):
+    return {
+        'currency': currency,
+        'columns': ['month', 'count', 'total'],
+        'rows': [
+            ['{:04d}-{:02d}'.format(int(y), int(m)), count, total(cents)]
+            for y, m, count, cents in rows
+        ]
+    }
+
+
+def scan_by_title(session, owner_id, currency, criteria, limit):
+    """(title, count, cents) per title, biggest total first, worked out
+    from the expenses."""
+    cents = func.sum(Expense.amount_cents).label('total')
+    query = session.query(
+        Expense.title, func.count(Expense.id), cents
+    ).filter(
+        Expense.currency == currency, owned_by(owner_id), *criteria
+    ).group_by(Expense.title).order_by(cents.desc())
+    return query.limit(limit) if limit else query
+
+
+def title_report(currency, rows):
+    return {
+        'currency': currency,
+        'columns': ['title', 'count', 'total'],
+        'rows': [[title, count, total(cents)] for title, count, cents in rows]
+    }
+
+
+@view_config(
+    route_name='api_totals_monthly',
+    renderer='json',
+    request_method='GET',
+    decorator=conditional(totals_version)
+)
+def totals_by_month(request):
+    """Count and total expenses per month of their due date.
+
+    Filtered reports that would have to scan the expenses are queued for
+    totals_by_month_job when ``jobs.enabled`` is set.
+    """
+    try:
+        currency = report_currency(request.GET)
+        criteria = report_filters(request.GET)
+    except ValueError as err:
+        raise bad_request(err)
+    snapshot = report_snapshot(request) if criteria else None
+    if snapshot is not None:
+        rows = snapshot.totals_by_month(current_owner_id(request), currency, request.GET)
+    elif criteria:
+        if jobs_enabled(request):
+            return accepted(request, enqueue_once(
+                request, 'totals_monthly', report_params(request)))
+        rows = scan_by_month(
+            request.read_dbsession, current_owner_id(request), currency, criteria)
+    else:
+        count = func.sum(ExpenseTotal.count)
+        rows = (
+            (month // 100, month % 100, count, cents)
+            for month, count, cents in rollup_query(
+                request, currency, ExpenseTotal.month, count, func.sum(ExpenseTotal.amount_cents)
+            ).filter(ExpenseTotal.month != 0).group_by(ExpenseTotal.month).having(count > 0)
+            .order_by(ExpenseTotal.month)
+        )
+    return month_report(currency, rows)
+
+
+@view_config(
+    route_name='api_totals_titles',
+    renderer='json',
+    request_method='GET',
+    decorator=conditional(totals_version)
+)
+def totals_by_title(request):
+    """Count and total expenses per title, biggest total first.
+
+    Queued like totals_by_month when it would have to scan.
+    """
+    try:
+        currency = report_currency(request.GET)
+        criteria = report_filters(request.GET)
+        limit = parse_limit(request.GET.get('limit'), default=None)
+    except ValueError as err:
+        raise bad_request(err)
+    snapshot = report_snapshot(request) if criteria else None
+    if snapshot is not None:
+        rows = snapshot.totals_by_title(current_owner_id(request), currency, request.GET, limit)
+    elif criteria:
+        if jobs_enabled(request):
+            return accepted(request, enqueue_once(
+                request, 'totals_titles', report_params(request)))
+        rows = scan_by_title(
+            request.read_dbsession, current_owner_id(request), currency, criteria, limit)
+    else:
+        count = func.sum(ExpenseTotal.count)
+        cents = func.sum(ExpenseTotal.amount_cents).label('total')
+        query = rollup_query(
+            request, currency, func.nullif(ExpenseTotal.title, ''), count, cents
+        ).group_by(ExpenseTotal.title).having(count > 0).order_by(cents.desc())
+        rows = query.limit(limit) if limit else query
+    return title_report(currency, rows)
+
+
+def totals_by_month_job(context):
+    """totals_by_month for a queued report."""
+    params = context.params
+    currency = report_currency(params)
+    rows = scan_by_month(context.session, context.job.owner_id, currency,
+                         report_filters(params))
+    return month_report(currency, rows)
+
+
+def totals_by_title_job(context):
+    """totals_by_title for a queued report."""
+    params = context.params
+    currency = report_currency(params)
+    limit = parse_limit(params.get('limit'), default=None)
+    rows = scan_by_title(context.session, context.job.owner_id, currency,
+                         report_filters(params), limit)
+    return title_report(currency, rows)
+
+
+@view_config(route_name='api_upcoming', renderer='json', request_method='GET')
+def upcoming_due(request):
+    """Count and total what falls due in the next ``days`` days.
+
+    Recurring expenses past the materialised window are worked out from
+    their rules and included; ``projected`` says how many of those there
+    were. Takes the list API's filters too.
+    """
+    try:
+        days = parse_days(request.GET.get('days'))
+        currency = report_currency(request.GET)
+        criteria = report_filters(request.GET)
+        rule_criteria = rule_filters(request.GET)
+        start = datetime.now()
+        end = start + timedelta(days=days)
+        if request.GET.get('due_after'):
+            start = max(start, parse_date(request.GET['due_after']))
+        if request.GET.get('due_before'):
+            end = min(end, parse_date(request.GET['due_before']) + timedelta(days=1))
+    except ValueError as err:
+        raise bad_request(err)
+    count, cents = request.read_dbsession.query(
+        func.count(Expense.id), func.sum(Expense.amount_cents)
+    ).filter(
+        Expense.due_date >= start, Expense.due_date < end,
+        Expense.currency == currency, owner_filter(request), *criteria
+    ).one()
+    rules = request.read_dbsession.query(RecurrenceRule).filter(
+        RecurrenceRule.currency == currency, RecurrenceRule.starts_on < end,
+        or_(RecurrenceRule.ends_on.is_(None), RecurrenceRule.ends_on >= start),
+        owner_filter(request, RecurrenceRule.owner_id), *rule_criteria)
+    ahead = [rule.amount_cents for rule, due in projected(rules, start, end)]
+    return {
+        'days': days,
+        'currency': currency,
+        'count': count + len(ahead),
+        'projected': len(ahead),
+        'total': total((cents or 0) + sum(ahead))
+    }
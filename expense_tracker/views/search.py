@@ -0,0 +1,85 @@
+from pyramid.view import view_config
+from pyramid.httpexceptions import HTTPBadRequest
+
+from expense_tracker.models import Expense
+from expense_tracker.pagination import decode_cursor, encode_cursor, parse_limit, seek
+from expense_tracker.search import parse_query, rank_column
+from expense_tracker.security import current_owner_id, owner_filter
+from expense_tracker.views.api import bad_request
+
+FIELDS = (Expense.id, Expense.title, Expense.amount, Expense.currency, Expense.due_date)
+SEARCH_LIMIT = 20
+
+
+def parse_search(params):
+    """(terms, after cursor, limit) from the query string."""
+    terms = parse_query(params.get('q'))
+    after = decode_cursor(params.get('after'), rank_column(terms)[1])
+    # the rank is compared with floats, in SQL or in TitleIndex.search
+    if after is not None and (
+            not isinstance(after[0], (int, float)) or isinstance(after[0], bool)):
+        raise ValueError('malformed cursor')
+    limit = parse_limit(params.get('limit'), default=SEARCH_LIMIT)
+    return terms, after, limit
+
+
+def ranked_rows(request, terms, after, limit):
+    """The next ``limit + 1`` matches as dicts with a ``rank``, best first."""
+    index = request.registry.get('search_index')
+    if index is None:
+        match, rank = rank_column(terms)
+        query = request.read_dbsession.query(*(FIELDS + (rank,))).filter(
+            match, owner_filter(request))
+        rows = seek(query, rank, Expense.id, after, descending=True).limit(limit + 1)
+        return [row._asdict() for row in rows]
+
+    index.refresh(request.read_dbsession)
+    hits = index.search(terms, current_owner_id(request), after, limit)
+    if not hits:
+        return []
+    rows = {
+        row.id: row._asdict() for row in request.read_dbsession.query(*FIELDS).filter(
+            Expense.id.in_([expense_id for _, expense_id in hits]))
+    }
+    if len(rows) < len(hits):
+        index.stale = True  # deleted behind our back; catch up next time
+    return [dict(rows[expense_id], rank=rank)
+            for rank, expense_id in hits if expense_id in rows]
+
+
+def search_page(request, terms, after, limit):
+    rows = ranked_rows(request, terms, after, limit)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]['rank'], rows[-1]['id'])
+    return {'expenses': rows, 'next_cursor': next_cursor}
+
+
+@view_config(route_name='api_search', renderer='json', request_method='GET')
+def api_search(request):
+    """Expenses whose title words start with every word of ``q``, best
+    match first. Pages with ``limit`` and ``after`` like api_list."""
+    try:
+        terms, after, limit = parse_search(request.GET)
+    except ValueError as err:
+        raise bad_request(err)
+    return search_page(request, terms, after, limit)
+
+
+@view_config(
+    route_name='search',
+    renderer="expense_tracker:templates/search.jinja2",
+    request_method='GET'
+)
+def search_expenses(request):
+    """The search form, and a page of results when ``q`` is given."""
+    result = {'title': 'Search', 'q': request.GET.get('q', ''), 'expenses': None}
+    if not result['q'].strip():
+        return result
+    try:
+        terms, after, limit = parse_search(request.GET)
+    except ValueError:
+        raise HTTPBadRequest
+    result.update(search_page(request, terms, after, limit), limit=limit)
+    return result
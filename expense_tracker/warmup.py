@@ -0,0 +1,98 @@
+"""Get a new process ready before it takes traffic.
+
+Jinja2 compiles each template to Python the first time it is rendered,
+which makes the first requests after a deploy slow. With
+``jinja2.bytecode_caching`` on, the compiled code is kept in
+``jinja2.bytecode_caching_directory`` and shared by every worker and
+restart. ``precompile_templates <ini>`` fills that directory at build
+time. With ``warmup.enabled`` on, ``main()`` loads every template, the
+mappers, the route table and the password hashing context before it
+returns the app.
+
+main() logs how long it took either way, and /api/metrics reports it
+under ``startup``.
+
+Settings (all optional):
+
+``jinja2.bytecode_caching``            default false (pyramid_jinja2's own)
+``jinja2.bytecode_caching_directory``  created if missing, default a temp dir
+``warmup.enabled``                     default false
+"""
+import logging
+import os
+import time
+
+from pyramid.interfaces import IRoutesMapper
+from pyramid.request import Request
+from pyramid.settings import asbool
+from pyramid_jinja2 import IJinja2Environment
+from sqlalchemy.orm import configure_mappers
+
+log = logging.getLogger(__name__)
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), 'templates')
+TEMPLATE_PACKAGE = 'expense_tracker:templates/'
+
+
+def template_names():
+    """Asset specs of every template in expense_tracker/templates."""
+    return sorted(
+        TEMPLATE_PACKAGE + name for name in os.listdir(TEMPLATE_DIR)
+        if name.endswith('.jinja2')
+    )
+
+
+def compile_templates(env):
+    """Load (and so compile, or read from the bytecode cache) every template.
+
+    Returns the number of templates loaded.
+    """
+    names = template_names()
+    for name in names:
+        env.get_template(name)
+    return len(names)
+
+
+def warm_routes(registry):
+    """Match one request so the router and its predicates are set up."""
+    request = Request.blank('/')
+    request.registry = registry
+    registry.getUtility(IRoutesMapper)(request)
+
+
+def warm_passwords(registry):
+    """Import the password hashing context the first login would need."""
+    verifier = registry.get('password_verifier')
+    if verifier is not None:
+        verifier.context
+
+
+def warm_up(app, started):
+    """Warm the app if ``warmup.enabled`` is set and report the cold start.
+
+    ``started`` is the ``time.perf_counter()`` reading main() began at.
+    """
+    registry = app.registry
+    timings = {}
+    if asbool(registry.settings.get('warmup.enabled', False)):
+        for name, step in (
+            ('templates', lambda: compile_templates(
+                registry.getUtility(IJinja2Environment, name='.jinja2'))),
+            ('mappers', configure_mappers),
+            ('routes', lambda: warm_routes(registry)),
+            ('passwords', lambda: warm_passwords(registry)),
+        ):
+            start = time.perf_counter()
+            step()
+            timings[name + '_ms'] = round((time.perf_counter() - start) * 1000, 3)
+    timings['total_ms'] = round((time.perf_counter() - started) * 1000, 3)
+    registry['startup'] = timings
+    log.info('app ready in %.1fms %s', timings['total_ms'], timings)
+    return app
+
+
+def includeme(config):
+    """Make sure the bytecode cache directory exists before jinja2 needs it."""
+    directory = config.get_settings().get('jinja2.bytecode_caching_directory')
+    if directory and asbool(config.get_settings().get('jinja2.bytecode_caching', False)):
+        os.makedirs(directory, exist_ok=True)
@@ -9,6 +9,7 @@ with open(os.path.join(here, 'CHANGES.txt')) as f:
     CHANGES = f.read()
 
 requires = [
+    'alembic',
     'plaster_pastedeploy',
     'pyramid >= 1.9a',
     'pyramid_debugtoolbar',
@@ -16,7 +17,7 @@ requires = [
     'pyramid_retry',
     'pyramid_tm',
     'SQLAlchemy',  # OBJECT RELATIONAL MAPPER
-    'transaction',
+    'transaction >= 2.4',
     'zope.sqlalchemy',
     'waitress',
     'psycopg2',
@@ -27,6 +28,7 @@ tests_require = [
     'WebTest >= 1.3.1',  # py3 compat
     'pytest',
     'pytest-cov',
+    'Faker',
 ]
 
 setup(
@@ -44,11 +46,24 @@ setup(
     author_email='nicholas@codefellows.com',
     url='',
     keywords='web pyramid pylons',
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks']),
     include_package_data=True,
     zip_safe=False,
     extras_require={
         'testing': tests_require,
+        'asgi': [
+            'SQLAlchemy >= 1.4',
+            'asgiref',
+            'uvicorn',
+            'asyncpg',
+            'aiosqlite',
+        ],
+        'analytics': [
+            'numpy',
+        ],
+        'fastjson': [
+            'orjson',
+        ],
     },
     install_requires=requires,
     entry_points={
@@ -57,6 +72,15 @@ setup(
         ],
         'console_scripts': [
             'initdb = expense_tracker.scripts.initializedb:main',
+            'import_expenses = expense_tracker.scripts.import_expenses:main',
+            'export_expenses = expense_tracker.scripts.export_expenses:main',
+            'serve_expenses = expense_tracker.scripts.serve:main',
+            'add_user = expense_tracker.scripts.add_user:main',
+            'partition_expenses = expense_tracker.scripts.partition_expenses:main',
+            'precompile_templates = expense_tracker.scripts.precompile_templates:main',
+            'materialize_recurring = expense_tracker.scripts.materialize_recurring:main',
+            'rebuild_totals = expense_tracker.scripts.rebuild_totals:main',
+            'run_jobs = expense_tracker.scripts.run_jobs:main',
         ],
     },
 )